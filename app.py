@@ -1,285 +1,211 @@
+"""SynapseAI web app.
+
+create_app() builds a configured app; nothing is created or fetched at import
+time, so a worker boots without network access or Gemini credentials. The
+Gemini SDK and client are loaded on first use. Run with
+
+    flask --app app run
+    gunicorn -c gunicorn.conf.py          # preloads the app, see warm_up()
+"""
+import gc
 import os
-from flask import Flask, redirect, url_for, session, render_template, request, flash, send_from_directory
-from models import db, User, Space, SpaceMember, Assignment, Submission
-from datetime import datetime
-from requests_oauthlib import OAuth2Session
+import time
+import click
+from flask import Flask, Request, redirect, url_for, request, flash
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
-from config import Config
 
+# Before config is imported: Config reads the environment when its module loads
 load_dotenv()
 
-# WARNING: only for local dev!
-os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
-
-app = Flask(__name__)
-app.config.from_object(Config)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-basedir = os.path.abspath(os.path.dirname(__file__))
-print("CWD:", os.getcwd())
-print("DB will live at:", os.path.join(basedir, 'instance', 'synapseai.sqlite'))
-
-db.init_app(app)
-
-# OAuth2 client setup
-GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
-GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
-GOOGLE_DISCOVERY_URL = os.getenv('GOOGLE_DISCOVERY_URL')
-
-# Allowed file extensions for pupil submissions
-ALLOWED_SUBMISSION_EXTENSIONS = {'pdf', 'py'}
-
-
-def allowed_file(filename: str, allowed_extensions: set) -> bool:
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
-
-# Utility to get Google provider configuration
-import requests
-import smtplib
-from email.message import EmailMessage
-
-def get_google_provider_cfg():
-    return requests.get(GOOGLE_DISCOVERY_URL).json()
+from models import db
+from grading import GradingWorkerPool, grade_assignment as queue_assignment_grading, assignment_grading_progress
+from llm_cache import ResultCache
+from rate_limit import make_rate_limiter
+from model_routing import ModelRouter, ModelTier
+from storage import BlobStore
+from oidc import OIDCProvider
+from mailer import OutboxSender
+from database import engine_options, apply_sqlite_pragmas
+from downloads import OFFLOAD_MODES
+from page_cache import EXTENSION_KEY as PAGE_CACHE_KEY, make_page_cache
+from metrics import EXTENSION_KEY as METRICS_KEY, instrument_app, reset as reset_metrics
+from services import EXTENSION_KEY, Services, get_services
+from flask_migrate import Migrate
+from config import Config
+import blueprints
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Stream file fields straight into the blob store, hashing as they are parsed
+        incoming = get_services().blob_store.incoming_file()
+        if not hasattr(self, '_incoming_files'):
+            self._incoming_files = []
+        self._incoming_files.append(incoming)
+        return incoming
+
+    def close(self):
+        # Also covers files the parser dropped (oversized or cut-off uploads); closing removes
+        # every temp file that was not saved as a blob
+        super().close()
+        for incoming in getattr(self, '_incoming_files', ()):
+            incoming.close()
+
+
+def create_app(config=None):
+    """Builds the app from Config and the environment; `config` overrides individual settings."""
+    # WARNING: only for local dev!
+    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    app.config.from_object(Config)
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL') or app.config['SQLALCHEMY_DATABASE_URI']
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # OAuth2 client setup
+    app.config['GOOGLE_CLIENT_ID'] = os.getenv('GOOGLE_CLIENT_ID')
+    app.config['GOOGLE_CLIENT_SECRET'] = os.getenv('GOOGLE_CLIENT_SECRET')
+    app.config['GOOGLE_DISCOVERY_URL'] = os.getenv('GOOGLE_DISCOVERY_URL')
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config))
+    if app.config['DOWNLOAD_OFFLOAD'] not in OFFLOAD_MODES:
+        raise ValueError(f"DOWNLOAD_OFFLOAD must be one of {', '.join(filter(None, OFFLOAD_MODES))} or empty")
+    # Rejects oversized bodies from Content-Length before any of the body is read
+    app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_SIZE'] + 64 * 1024
+
+    db.init_app(app)
+    with app.app_context():
+        # Creates the engine and registers the pragmas; no connection is opened here
+        apply_sqlite_pragmas(db.engine, busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT'])
+    instrument_app(app)
+    # render_as_batch lets constraint changes work on SQLite, which cannot ALTER them in place
+    Migrate(app, db, render_as_batch=True)
+
+    app.extensions[EXTENSION_KEY] = build_services(app)
+    app.extensions[PAGE_CACHE_KEY] = make_page_cache(app.config, app.instance_path)
+    for bp in blueprints.ALL:
+        app.register_blueprint(bp)
+    register_handlers(app)
+    register_commands(app)
+    return app
+
+
+def build_services(app):
+    config = app.config
+    llm_cache = ResultCache(ttl=config['LLM_CACHE_TTL'], max_entries=config['LLM_CACHE_MAX_ENTRIES'])
+    model_router = ModelRouter(
+        {tier: ModelTier(tier, config[f'GEMINI_MODEL_{tier.upper()}'], config[f'GEMINI_TIMEOUT_{tier.upper()}'])
+         for tier in ('fast', 'standard', 'quality')},
+        large_input_tokens=config['GEMINI_LARGE_INPUT_TOKENS'], hedging=config['GEMINI_HEDGING'])
+    llm_options = dict(cache=llm_cache,
+                       limiter=make_rate_limiter(config, app.instance_path),
+                       max_retries=config['GEMINI_MAX_RETRIES'],
+                       router=model_router)
+    return Services(
+        blob_store=BlobStore(config['UPLOAD_FOLDER'], max_size=config['MAX_UPLOAD_SIZE']),
+        llm_cache=llm_cache,
+        model_router=model_router,
+        llm_options=llm_options,
+        grading_pool=GradingWorkerPool(app, workers=config['GRADING_WORKERS'],
+                                       poll_interval=config['GRADING_POLL_INTERVAL'],
+                                       stale_after=config['GRADING_STALE_AFTER'],
+                                       max_attempts=config['GRADING_MAX_ATTEMPTS']),
+        mail_sender=OutboxSender(app, batch_size=config['MAIL_BATCH_SIZE'],
+                                 poll_interval=config['MAIL_POLL_INTERVAL'],
+                                 max_attempts=config['MAIL_MAX_ATTEMPTS']),
+        # Discovery and signing keys are fetched on the first login, not here
+        google_oidc=OIDCProvider(config['GOOGLE_DISCOVERY_URL'], config['GOOGLE_CLIENT_ID']),
+        gemini_api_key=config['GEMINI_API_KEY'],
+    )
+
+
+def register_handlers(app):
+    services = get_services(app)
+
+    @app.before_request
+    def start_grading_workers():
+        # Started lazily so that only serving processes (and each forked worker) run a pool
+        services.grading_pool.ensure_started()
+        services.mail_sender.ensure_started()
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def upload_too_large(e):
+        flash(f"File too large. The maximum upload size is {app.config['MAX_UPLOAD_SIZE'] // (1024 * 1024)} MB.")
+        return redirect(request.referrer or url_for('auth.index'))
+
+    @app.template_filter('upload_name')
+    def upload_name(path):
+        return services.blob_store.relative_name(path)
+
+
+def register_commands(app):
+    services = get_services(app)
+
+    @app.cli.command('grading-worker')
+    def grading_worker():
+        """Run the grading worker pool in the foreground."""
+        services.grading_pool.run_forever()
+
+    @app.cli.command('send-outbox')
+    def send_outbox():
+        """Deliver all queued emails that are due, then exit."""
+        sent = services.mail_sender.send_pending()
+        click.echo(f'Sent {sent} emails.')
+
+    @app.cli.command('grade-assignment')
+    @click.argument('assignment_id', type=int)
+    @click.option('--workers', default=4, show_default=True, help='Concurrent grading threads.')
+    @click.option('--regrade', is_flag=True, help='Grade submissions that already have feedback again.')
+    def grade_assignment_command(assignment_id, workers, regrade):
+        """Grade every submission of an assignment and wait until done.
+
+        Safe to re-run after a crash: graded submissions are skipped.
+        """
+        counts = queue_assignment_grading(assignment_id, regrade=regrade)
+        click.echo(f"Queued {counts['queued']} submissions, {counts['skipped']} already queued or graded.")
+        pool = GradingWorkerPool(app, workers=workers, poll_interval=1,
+                                 stale_after=app.config['GRADING_STALE_AFTER'],
+                                 max_attempts=app.config['GRADING_MAX_ATTEMPTS'])
+        pool.ensure_started()
+        try:
+            while True:
+                progress = assignment_grading_progress(assignment_id)
+                db.session.remove()
+                click.echo(', '.join(f'{k}: {v}' for k, v in progress.items()))
+                if not progress['pending'] and not progress['running']:
+                    break
+                time.sleep(5)
+        finally:
+            pool.stop(timeout=5)
+
+
+def warm_up(app):
+    """Does the work otherwise left to the first requests, without any network calls.
+
+    Meant for a preloading server master (gunicorn --preload): forked workers
+    inherit the imported Gemini SDK and compiled templates.
+    """
+    import llm_service  # noqa: F401  (google.genai is by far the slowest import)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # Totals of workers from an earlier run would otherwise be added to this one's
+    if app.extensions[METRICS_KEY]:
+        app.extensions[METRICS_KEY].clear()
+    # Keeps everything loaded so far out of the workers' garbage collections, which would
+    # otherwise scan (and copy-on-write) the whole inherited heap
+    gc.freeze()
 
 
-def send_email(to_address: str, subject: str, body: str):
-    """Send an email. Uses SMTP credentials from environment.
+def after_fork(app):
+    """Drops database connections and metric values inherited from the parent; the worker keeps its own."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    reset_metrics()
 
-    This is a best-effort implementation; if sending fails, we simply log the
-    message to the console.
-    """
-    smtp_server = os.getenv('SMTP_SERVER')
-    smtp_port = int(os.getenv('SMTP_PORT', '587'))
-    smtp_user = os.getenv('SMTP_USER')
-    smtp_password = os.getenv('SMTP_PASSWORD')
-    if not smtp_server or not smtp_user or not smtp_password:
-        print(f"Email to {to_address}: {subject}\n{body}")
-        return
-    try:
-        msg = EmailMessage()
-        msg['Subject'] = subject
-        msg['From'] = smtp_user
-        msg['To'] = to_address
-        msg.set_content(body)
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_user, smtp_password)
-            server.send_message(msg)
-    except Exception as e:
-        print('Failed to send email:', e)
-        print(f"Email to {to_address}: {subject}\n{body}")
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/login')
-def login():
-    google = OAuth2Session(GOOGLE_CLIENT_ID, redirect_uri=url_for('authorize', _external=True), scope=['openid', 'email', 'profile'])
-    authorization_url, state = google.authorization_url(get_google_provider_cfg()['authorization_endpoint'], access_type='offline', prompt='consent')
-    session['oauth_state'] = state
-    return redirect(authorization_url)
-
-@app.route('/authorize')
-def authorize():
-    google = OAuth2Session(GOOGLE_CLIENT_ID, state=session['oauth_state'], redirect_uri=url_for('authorize', _external=True))
-    token = google.fetch_token(get_google_provider_cfg()['token_endpoint'], client_secret=GOOGLE_CLIENT_SECRET, authorization_response=request.url)
-    session['oauth_token'] = token
-
-    # Fetch user info
-    userinfo = google.get(get_google_provider_cfg()['userinfo_endpoint']).json()
-    google_id = userinfo['sub']
-    email = userinfo['email']
-    name = userinfo.get('name', '')
-
-    emails = os.getenv('MASTER_EMAILS', '').split(',')
-    role = 'master' if email in emails else 'pupil'
-
-    user = User(google_id=google_id, name=name, email=email, role=role)
-
-    # Create or get user
-    user = User.query.filter_by(google_id=google_id).first()
-    if not user:
-        # Default role assignment logic can be improved later
-        user = User(google_id=google_id, name=name, email=email, role=role)
-        db.session.add(user)
-        db.session.commit()
-    session['user_id'] = user.id
-    session['role'] = user.role
-
-    # Redirect based on role
-    if user.role == 'master':
-        return redirect(url_for('master_dashboard'))
-    return redirect(url_for('pupil_dashboard'))
-
-@app.route('/logout')
-def logout():
-    session.clear()
-    flash('You have been logged out.')
-    return redirect(url_for('index'))
-
-@app.route('/master_dashboard')
-def master_dashboard():
-    if session.get('role') != 'master':
-        flash('Access denied.')
-        return redirect(url_for('index'))
-    user = User.query.get(session['user_id'])
-    spaces = Space.query.filter_by(master_id=user.id).all()
-    return render_template('master_dashboard.html', spaces=spaces)
-
-@app.route('/pupil_dashboard')
-def pupil_dashboard():
-    if session.get('role') != 'pupil':
-        flash('Access denied.')
-        return redirect(url_for('index'))
-    user = User.query.get(session['user_id'])
-    membership = SpaceMember.query.filter_by(user_id=user.id).all()
-    spaces = [m.space for m in membership]
-    return render_template('pupil_dashboard.html', spaces=spaces)
-
-@app.route('/create_space', methods=['POST'])
-def create_space():
-    if session.get('role') != 'master':
-        flash('Access denied.')
-        return redirect(url_for('index'))
-    name = request.form.get('name')
-    code = os.urandom(4).hex()
-    space = Space(name=name, unique_code=code, master_id=session['user_id'])
-    db.session.add(space)
-    db.session.commit()
-    return redirect(url_for('master_dashboard'))
-
-
-@app.route('/space/<int:space_id>')
-def space_detail(space_id):
-    space = Space.query.get_or_404(space_id)
-    assignments = Assignment.query.filter_by(space_id=space.id).all()
-    return render_template('space_detail.html', space=space, assignments=assignments)
-
-
-@app.route('/create_assignment/<int:space_id>', methods=['POST'])
-def create_assignment(space_id):
-    if session.get('role') != 'master':
-        flash('Access denied.')
-        return redirect(url_for('index'))
-    space = Space.query.get_or_404(space_id)
-    title = request.form.get('title')
-    description = request.form.get('description')
-    due_date = request.form.get('due_date')
-    solution_file = request.files.get('solution')
-
-    assignment = Assignment(space_id=space.id, title=title, description=description)
-    if due_date:
-        try:
-            assignment.due_date = datetime.fromisoformat(due_date)
-        except ValueError:
-            flash('Invalid due date format.')
-    db.session.add(assignment)
-    db.session.commit()
-
-    if solution_file and allowed_file(solution_file.filename, {'pdf', 'py', 'txt'}):
-        filename = f"solution_{assignment.id}_{solution_file.filename}"
-        path = os.path.join('uploads', filename)
-        os.makedirs('uploads', exist_ok=True)
-        solution_file.save(path)
-        assignment.solution_file_path = path
-        db.session.commit()
-
-    return redirect(url_for('space_detail', space_id=space.id))
-
-
-@app.route('/edit_assignment/<int:assignment_id>', methods=['GET', 'POST'])
-def edit_assignment(assignment_id):
-    if session.get('role') != 'master':
-        flash('Access denied.')
-        return redirect(url_for('index'))
-    assignment = Assignment.query.get_or_404(assignment_id)
-    space = assignment.space
-    if request.method == 'POST':
-        assignment.title = request.form.get('title')
-        assignment.description = request.form.get('description')
-        due_date = request.form.get('due_date')
-        if due_date:
-            try:
-                assignment.due_date = datetime.fromisoformat(due_date)
-            except ValueError:
-                flash('Invalid due date format.')
-        else:
-            assignment.due_date = None
-        solution_file = request.files.get('solution')
-        if solution_file and allowed_file(solution_file.filename, {'pdf', 'py', 'txt'}):
-            filename = f"solution_{assignment.id}_{solution_file.filename}"
-            path = os.path.join('uploads', filename)
-            os.makedirs('uploads', exist_ok=True)
-            solution_file.save(path)
-            assignment.solution_file_path = path
-        db.session.commit()
-
-        # notify pupils
-        members = SpaceMember.query.filter_by(space_id=space.id).all()
-        for m in members:
-            user = User.query.get(m.user_id)
-            if user:
-                send_email(user.email, f'Assignment updated: {assignment.title}',
-                           f'The assignment "{assignment.title}" has been updated.')
-        flash('Assignment updated and pupils notified.')
-        return redirect(url_for('space_detail', space_id=space.id))
-    return render_template('edit_assignment.html', assignment=assignment, space=space)
-
-@app.route('/join_space', methods=['POST'])
-def join_space():
-    if session.get('role') != 'pupil':
-        flash('Access denied.')
-        return redirect(url_for('index'))
-    code = request.form.get('code')
-    space = Space.query.filter_by(unique_code=code).first()
-    if not space:
-        flash('Invalid code.')
-        return redirect(url_for('pupil_dashboard'))
-    exists = SpaceMember.query.filter_by(space_id=space.id, user_id=session['user_id']).first()
-    if not exists:
-        db.session.add(SpaceMember(space_id=space.id, user_id=session['user_id']))
-        db.session.commit()
-    return redirect(url_for('pupil_dashboard'))
-
-@app.route('/submit_assignment/<int:assignment_id>', methods=['POST'])
-def submit_assignment(assignment_id):
-    if session.get('role') != 'pupil':
-        flash('Access denied.')
-        return redirect(url_for('index'))
-    user_id = session['user_id']
-    existing = Submission.query.filter_by(assignment_id=assignment_id, pupil_id=user_id).first()
-    if existing:
-        flash('You have already submitted this assignment.')
-        return redirect(url_for('assignment_detail', assignment_id=assignment_id))
-    file = request.files.get('file')
-    if not file or not allowed_file(file.filename, ALLOWED_SUBMISSION_EXTENSIONS):
-        flash('Invalid or missing file. Allowed types: pdf, py')
-        return redirect(url_for('assignment_detail', assignment_id=assignment_id))
-    filename = f"sub_{assignment_id}_{user_id}_{file.filename}"
-    path = os.path.join('uploads', filename)
-    os.makedirs('uploads', exist_ok=True)
-    file.save(path)
-    submission = Submission(assignment_id=assignment_id, pupil_id=user_id, file_path=path, attempted=True)
-    db.session.add(submission)
-    db.session.commit()
-    flash('Submission successful.')
-    return redirect(url_for('assignment_detail', assignment_id=assignment_id))
-
-@app.route('/assignment/<int:assignment_id>')
-def assignment_detail(assignment_id):
-    assignment = Assignment.query.get_or_404(assignment_id)
-    submission = None
-    if session.get('role') == 'pupil':
-        submission = Submission.query.filter_by(assignment_id=assignment_id, pupil_id=session['user_id']).first()
-    return render_template('assignment_detail.html', assignment=assignment, submission=submission)
-
-
-@app.route('/uploads/<path:filename>')
-def uploaded_file(filename):
-    return send_from_directory('uploads', filename)
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,116 @@
+"""Measure how long the app takes to boot and how fast a forked worker is ready.
+
+Every run happens in a fresh interpreter with outbound sockets disabled and no
+Gemini API key, so a run also fails if booting needs the network. A run times
+`import app`, create_app(), then forks a worker the way gunicorn does and
+times, inside it, the first page (a dashboard: one query and a template) and
+the first use of the Gemini service (what a grading thread does first).
+The cold mode forks straight after create_app(); the preload mode runs
+warm_up() in the parent first, as gunicorn.conf.py does with --preload.
+
+    python benchmarks/bench_boot.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, os, socket, sys, time
+
+def no_network(*args, **kwargs):
+    raise OSError('network access while booting')
+
+socket.socket.connect = no_network
+socket.create_connection = no_network
+preload = sys.argv[1] == 'preload'
+timings = {}
+
+start = time.perf_counter()
+import app as app_module
+timings['import app'] = time.perf_counter() - start
+
+start = time.perf_counter()
+app = app_module.create_app()
+timings['create_app()'] = time.perf_counter() - start
+
+from models import db, User
+with app.app_context():
+    db.create_all()
+    db.session.add(User(id=1, google_id='g1', name='Pupil', email='pupil@school.test', role='pupil'))
+    db.session.commit()
+
+if preload:
+    start = time.perf_counter()
+    app_module.warm_up(app)
+    timings['warm_up()'] = time.perf_counter() - start
+
+read_end, write_end = os.pipe()
+pid = os.fork()
+if pid == 0:
+    worker = {}
+    start = time.perf_counter()
+    app_module.after_fork(app)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'], session['role'] = 1, 'pupil'
+    assert client.get('/pupil_dashboard').status_code == 200
+    worker['worker: first page'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from services import get_services
+    get_services(app).gemini()
+    worker['worker: first LLM use'] = time.perf_counter() - start
+    os.write(write_end, json.dumps(worker).encode())
+    os._exit(0)
+os.close(write_end)
+os.waitpid(pid, 0)
+timings.update(json.loads(os.read(read_end, 65536)))
+print(json.dumps(timings))
+'''
+
+
+def run_once(mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'boot.db')}",
+                   UPLOAD_FOLDER=os.path.join(tmp, 'uploads'), PAGE_CACHE_PATH=os.path.join(tmp, 'page_cache.sqlite'),
+                   GEMINI_QUOTA_PATH=os.path.join(tmp, 'gemini_quota.sqlite'),
+                   METRICS_DIR=os.path.join(tmp, 'metrics'),
+                   SECRET_KEY='bench', GRADING_WORKERS='0',
+                   MAIL_POLL_INTERVAL='60')
+        env.pop('GOOGLE_API_KEY', None)
+        out = subprocess.run([sys.executable, '-c', CHILD, mode], cwd=ROOT, env=env,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            sys.exit(f'{mode} run failed:\n{out.stderr}')
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ('cold', 'preload'):
+        runs = [run_once(mode) for _ in range(args.runs)]
+        results[mode] = {name: statistics.median(r[name] for r in runs) * 1000 for name in runs[0]}
+
+    names = list(results['preload'])
+    print(f'median of {args.runs} runs, no network, no API key')
+    print(f"{'ms':<24}{'cold':>10}{'preload':>10}")
+    for name in names:
+        cold = results['cold'].get(name)
+        print(f"{name:<24}{'-' if cold is None else f'{cold:.1f}':>10}{results['preload'][name]:>10.1f}")
+    for mode in ('cold', 'preload'):
+        ready = results[mode]['worker: first page'] + results[mode]['worker: first LLM use']
+        print(f'{mode}: forked worker serving and grading after {ready:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
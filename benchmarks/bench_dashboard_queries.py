@@ -0,0 +1,136 @@
+"""Check that the dashboard pages run a fixed number of SQL queries.
+
+Renders every dashboard page through the Flask test client against a small
+and a large seeded SQLite database, counts the statements each request
+executes, and fails if a page needs more than its budget or if the count grows
+with the amount of data (an N+1 query). Also prints the mean render time.
+
+    python benchmarks/bench_dashboard_queries.py [--scale 20] [--requests 50]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its configuration at import time
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp.name, 'dashboard.db')}"
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ['GRADING_WORKERS'] = '0'
+# Queries are counted per rendered page, so cached responses must not answer them
+os.environ['PAGE_CACHE_BACKEND'] = ''
+os.environ['METRICS_DIR'] = os.path.join(_tmp.name, 'metrics')
+
+from sqlalchemy import event, insert
+
+from app import create_app
+from models import db, User, Space, SpaceMember, Assignment, Submission, GradingJob
+
+# Maximum statements per page; the session lookups of Flask-SQLAlchemy are included
+QUERY_BUDGET = {
+    'master dashboard': 1,
+    'pupil dashboard': 1,
+    'space detail (master)': 3,
+    'space detail (pupil)': 3,
+    'assignment detail (pupil)': 2,
+}
+
+
+def seed(scale):
+    """One master, one space with `scale` assignments and `5 * scale` pupils who all submitted."""
+    db.drop_all()
+    db.create_all()
+    pupils = 5 * scale
+    db.session.execute(insert(User), [
+        {'id': i, 'google_id': f'g{i}', 'name': f'User {i}', 'email': f'u{i}@example.com',
+         'role': 'master' if i == 1 else 'pupil'} for i in range(1, pupils + 2)])
+    db.session.execute(insert(Space), [
+        {'id': i, 'unique_code': f'code{i}', 'name': f'Space {i}', 'master_id': 1} for i in range(1, scale + 1)])
+    db.session.execute(insert(SpaceMember), [
+        {'space_id': space_id, 'user_id': user_id}
+        for user_id in range(2, pupils + 2) for space_id in range(1, scale + 1)])
+    db.session.execute(insert(Assignment), [
+        {'id': i, 'space_id': 1, 'title': f'Assignment {i}'} for i in range(1, scale + 1)])
+    submissions = [{'id': i + 1, 'assignment_id': a, 'pupil_id': p, 'file_path': 'uploads/x.pdf'}
+                   for i, (a, p) in enumerate((a, p) for a in range(1, scale + 1) for p in range(2, pupils + 2))]
+    db.session.execute(insert(Submission), submissions)
+    db.session.execute(insert(GradingJob), [
+        {'submission_id': s['id'], 'status': 'done' if s['id'] % 2 else 'pending', 'attempts': 1}
+        for s in submissions])
+    db.session.commit()
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        self._thread = None
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        # Background senders share the engine; only count the request's own statements
+        if threading.get_ident() == self._thread:
+            self.count += 1
+
+    def measure(self, fn):
+        self.count, self._thread = 0, threading.get_ident()
+        fn()
+        return self.count
+
+
+def measure_pages(client, counter, repeats):
+    pages = {
+        'master dashboard': ('master', '/master_dashboard'),
+        'pupil dashboard': ('pupil', '/pupil_dashboard'),
+        'space detail (master)': ('master', '/space/1'),
+        'space detail (pupil)': ('pupil', '/space/1'),
+        'assignment detail (pupil)': ('pupil', '/assignment/1'),
+    }
+    results = {}
+    for name, (role, url) in pages.items():
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1 if role == 'master' else 2
+            sess['role'] = role
+
+        def get():
+            response = client.get(url)
+            assert response.status_code == 200, f'{url}: {response.status_code}'
+
+        queries = counter.measure(get)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            get()
+        results[name] = (queries, (time.perf_counter() - start) / repeats * 1e3)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=20, help='Assignments (and spaces) in the large run.')
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per page.')
+    args = parser.parse_args()
+
+    app = create_app()
+    client = app.test_client()
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+        seed(2)
+        small = measure_pages(client, counter, args.requests)
+        seed(args.scale)
+        large = measure_pages(client, counter, args.requests)
+
+    print(f"{'page':<30}{'queries (small)':>17}{'queries (large)':>17}{'budget':>8}{'ms (large)':>12}")
+    failures = []
+    for name, budget in QUERY_BUDGET.items():
+        print(f'{name:<30}{small[name][0]:>17}{large[name][0]:>17}{budget:>8}{large[name][1]:>12.2f}')
+        if large[name][0] != small[name][0] or large[name][0] > budget:
+            failures.append(name)
+    if failures:
+        sys.exit(f"Query count over budget or growing with data: {', '.join(failures)}")
+
+
+if __name__ == '__main__':
+    main()
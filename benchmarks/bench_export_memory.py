@@ -0,0 +1,149 @@
+"""Check that the ZIP export streams in constant memory.
+
+Seeds a small and a large synthetic class (every pupil submitted a file and
+has feedback), downloads /assignment/<id>/export.zip for each through the
+Flask test client without buffering, and tracks peak Python memory with
+tracemalloc while the archive is consumed. Fails if the peak grows with the
+class by more than zipfile's central directory record per entry (the ZIP
+format needs one ZipInfo per file until the archive is closed), if it is more
+than a few copy buffers for the small class, or if the small archive does not
+unzip to the expected files. Also reports the time to the first byte.
+
+    python benchmarks/bench_export_memory.py [--small 50] [--pupils 2000] [--file-kb 256]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its configuration at import time
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp.name, 'export.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(_tmp.name, 'uploads')
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ['GRADING_WORKERS'] = '0'
+os.environ['PAGE_CACHE_PATH'] = os.path.join(_tmp.name, 'page_cache.sqlite')
+os.environ['METRICS_DIR'] = os.path.join(_tmp.name, 'metrics')
+
+from sqlalchemy import insert
+
+from app import create_app
+from models import db, User, Space, Assignment, Submission, GradingJob
+from storage import CHUNK_SIZE
+
+DISTINCT_FILES = 16
+BYTES_PER_ENTRY = 512  # bound on the ZipInfo zipfile keeps per entry for the central directory
+
+
+def make_files(directory, size):
+    """Half incompressible .pdf files (stored), half Python sources (deflated), shared by all pupils."""
+    rng = random.Random(0)
+    paths = []
+    for i in range(DISTINCT_FILES):
+        if i % 2:
+            path = os.path.join(directory, f'answer{i}.pdf')
+            data = rng.randbytes(size)
+        else:
+            path = os.path.join(directory, f'answer{i}.py')
+            line = f'total = sum(value * {i} for value in range(100))  # pupil answer\n'.encode()
+            data = (line * (size // len(line) + 1))[:size]
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def seed(pupils, files):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(User), [
+        {'id': i, 'google_id': f'g{i}', 'name': f'Pupil {i}', 'email': f'u{i}@school.test',
+         'role': 'master' if i == 1 else 'pupil'} for i in range(1, pupils + 2)])
+    db.session.execute(insert(Space), [{'id': 1, 'unique_code': 'code', 'name': 'Space', 'master_id': 1}])
+    db.session.execute(insert(Assignment), [{'id': 1, 'space_id': 1, 'title': 'Assignment'}])
+    db.session.execute(insert(Submission), [
+        {'id': i, 'assignment_id': 1, 'pupil_id': i + 1, 'file_path': files[i % len(files)],
+         'original_filename': os.path.basename(files[i % len(files)])} for i in range(1, pupils + 1)])
+    db.session.execute(insert(GradingJob), [
+        {'submission_id': i, 'status': 'done', 'attempts': 1, 'feedback': f'Feedback for pupil {i}. ' * 50}
+        for i in range(1, pupils + 1)])
+    db.session.commit()
+
+
+def download(client, out=None):
+    """Consumes the export; returns (bytes, seconds to first chunk, seconds total, peak traced bytes)."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    response = client.get('/assignment/1/export.zip', buffered=False)
+    assert response.status_code == 200, response.status_code
+    first, total = None, 0
+    for chunk in response.response:
+        if first is None:
+            first = time.perf_counter() - start
+        total += len(chunk)
+        if out is not None:
+            out.write(chunk)
+    response.close()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return total, first, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--small', type=int, default=50, help='Pupils in the small class.')
+    parser.add_argument('--pupils', type=int, default=2000, help='Pupils in the large class.')
+    parser.add_argument('--file-kb', type=int, default=256, help='Size of each submitted file.')
+    args = parser.parse_args()
+
+    app = create_app()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'], sess['role'] = 1, 'master'
+    files = make_files(_tmp.name, args.file_kb * 1024)
+
+    results = {}
+    with app.app_context():
+        for label, pupils in (('small', args.small), ('large', args.pupils)):
+            seed(pupils, files)
+            db.session.remove()
+            if label == 'small':
+                archive_path = os.path.join(_tmp.name, 'small.zip')
+                with open(archive_path, 'wb') as out:
+                    results[label] = (pupils,) + download(client, out)
+                with zipfile.ZipFile(archive_path) as archive:
+                    names = archive.namelist()
+                    bad = archive.testzip()
+                if len(names) != 2 * pupils or bad is not None:
+                    sys.exit(f'Small archive is wrong: {len(names)} entries, first bad entry {bad}')
+            else:
+                results[label] = (pupils,) + download(client)
+
+    print(f"{'class':<8}{'pupils':>8}{'archive MB':>12}{'first byte ms':>15}{'seconds':>9}{'MB/s':>8}{'peak KB':>9}")
+    for label, (pupils, size, first, elapsed, peak) in results.items():
+        print(f'{label:<8}{pupils:>8}{size / 1e6:>12.1f}{first * 1000:>15.1f}{elapsed:>9.2f}'
+              f'{size / 1e6 / elapsed:>8.1f}{peak / 1024:>9.0f}')
+
+    small, large = results['small'], results['large']
+    # Two entries per pupil: the submission and its feedback
+    allowed = small[4] + 2 * BYTES_PER_ENTRY * (large[0] - small[0])
+    print(f'peak growth {(large[4] - small[4]) / 1024:.0f} KB for {large[0] - small[0]} more pupils '
+          f'(allowed {(allowed - small[4]) / 1024:.0f} KB for the central directory); '
+          f'archive grew {large[1] / small[1]:.0f}x')
+    if large[4] > allowed:
+        sys.exit('Peak memory grows with the class size')
+    if small[4] > 8 * CHUNK_SIZE:
+        sys.exit('Peak memory is larger than a few copy buffers')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Benchmark the hot lookup queries with and without the schema indexes.
+
+Seeds a throwaway SQLite database with 100k submissions, times the queries the
+dashboards and submit/join routes run, then does the same on a copy of the
+schema without the indexes and unique constraints added for those paths.
+
+    python benchmarks/bench_indexes.py [--submissions 100000] [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import MetaData, UniqueConstraint, create_engine, insert, select
+
+from models import db
+
+# Indexes and constraints introduced for the hot paths; dropped for the baseline run
+HOT_PATH_INDEXES = {'ix_space_master_id', 'ix_space_member_user_id', 'ix_assignment_space_id',
+                    'ix_submission_pupil_id'}
+HOT_PATH_CONSTRAINTS = {'uq_space_member_space_user', 'uq_submission_assignment_pupil'}
+
+
+def baseline_metadata():
+    metadata = MetaData()
+    for table in db.metadata.sorted_tables:
+        copy = table.to_metadata(metadata)
+        for index in list(copy.indexes):
+            if index.name in HOT_PATH_INDEXES:
+                copy.indexes.discard(index)
+        for constraint in list(copy.constraints):
+            if isinstance(constraint, UniqueConstraint) and constraint.name in HOT_PATH_CONSTRAINTS:
+                copy.constraints.discard(constraint)
+    return metadata
+
+
+def seed(engine, metadata, submissions, rng):
+    tables = metadata.tables
+    spaces, assignments_per_space, memberships_per_pupil = 50, 20, 5
+    assignments = spaces * assignments_per_space
+    pupils = max(submissions // assignments, 1) * 20
+    with engine.begin() as conn:
+        conn.execute(insert(tables['user']), [
+            {'id': i, 'google_id': f'g{i}', 'name': f'User {i}', 'email': f'u{i}@example.com',
+             'role': 'master' if i <= 10 else 'pupil'} for i in range(1, pupils + 11)])
+        conn.execute(insert(tables['space']), [
+            {'id': i, 'unique_code': f'code{i}', 'name': f'Space {i}', 'master_id': (i % 10) + 1}
+            for i in range(1, spaces + 1)])
+        conn.execute(insert(tables['space_member']), [
+            {'space_id': space_id, 'user_id': user_id}
+            for user_id in range(11, pupils + 11)
+            for space_id in rng.sample(range(1, spaces + 1), memberships_per_pupil)])
+        conn.execute(insert(tables['assignment']), [
+            {'id': i, 'space_id': (i - 1) // assignments_per_space + 1, 'title': f'Assignment {i}'}
+            for i in range(1, assignments + 1)])
+        rows, seen = [], set()
+        while len(rows) < submissions:
+            key = (rng.randint(1, assignments), rng.randint(11, pupils + 10))
+            if key not in seen:
+                seen.add(key)
+                rows.append({'assignment_id': key[0], 'pupil_id': key[1], 'file_path': 'uploads/x.pdf'})
+        conn.execute(insert(tables['submission']), rows)
+    return pupils, spaces, assignments
+
+
+def time_queries(engine, metadata, pupils, spaces, assignments, lookups, rng):
+    t = metadata.tables
+    queries = {
+        'already joined (space_id, user_id)': lambda: select(t['space_member']).where(
+            t['space_member'].c.space_id == rng.randint(1, spaces),
+            t['space_member'].c.user_id == rng.randint(11, pupils + 10)).limit(1),
+        'pupil dashboard (user_id)': lambda: select(t['space_member']).where(
+            t['space_member'].c.user_id == rng.randint(11, pupils + 10)),
+        'already submitted (assignment_id, pupil_id)': lambda: select(t['submission']).where(
+            t['submission'].c.assignment_id == rng.randint(1, assignments),
+            t['submission'].c.pupil_id == rng.randint(11, pupils + 10)).limit(1),
+        'space detail (space_id)': lambda: select(t['assignment']).where(
+            t['assignment'].c.space_id == rng.randint(1, spaces)),
+        'master dashboard (master_id)': lambda: select(t['space']).where(
+            t['space'].c.master_id == rng.randint(1, 10)),
+        'assignment submissions (assignment_id)': lambda: select(t['submission']).where(
+            t['submission'].c.assignment_id == rng.randint(1, assignments)),
+    }
+    results = {}
+    with engine.connect() as conn:
+        for name, build in queries.items():
+            start = time.perf_counter()
+            for _ in range(lookups):
+                conn.execute(build()).fetchall()
+            results[name] = (time.perf_counter() - start) / lookups * 1e6
+    return results
+
+
+def run(metadata, path, submissions, lookups):
+    engine = create_engine(f'sqlite:///{path}')
+    metadata.create_all(engine)
+    rng = random.Random(42)
+    pupils, spaces, assignments = seed(engine, metadata, submissions, rng)
+    return time_queries(engine, metadata, pupils, spaces, assignments, lookups, random.Random(7))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = run(baseline_metadata(), os.path.join(tmp, 'before.db'), args.submissions, args.lookups)
+        after = run(db.metadata, os.path.join(tmp, 'after.db'), args.submissions, args.lookups)
+
+    print(f'{args.submissions} submissions, {args.lookups} lookups per query, mean latency in microseconds')
+    print(f"{'query':<45}{'no index':>12}{'indexed':>12}{'speedup':>10}")
+    for name in before:
+        print(f'{name:<45}{before[name]:>12.1f}{after[name]:>12.1f}{before[name] / after[name]:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Measure the cached space, assignment and dashboard pages, and check they stay fresh.
+
+Serves the cached pages through the Flask test client against one seeded
+SQLite database with the page cache off, with the in-process memory backend
+and with the shared SQLite backend, and reports requests per second for full
+renders, cache hits and 304 revalidations. It then performs the writes that
+change those pages (a new assignment, a submission, finished grading) with the
+cache on and fails if any page still shows the old content afterwards, if a
+pending flash message is cached, if one pupil's page is served to another, or
+if a grading job of one pupil drops another pupil's cached pages.
+
+    python benchmarks/bench_page_cache.py [--scale 20] [--requests 300]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its configuration at import time
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp.name, 'page_cache.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(_tmp.name, 'uploads')
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ['GRADING_WORKERS'] = '0'
+os.environ['MAIL_POLL_INTERVAL'] = '60'
+os.environ['METRICS_DIR'] = os.path.join(_tmp.name, 'metrics')
+
+from sqlalchemy import insert
+
+from app import create_app
+from grading import claim_job, finish_job
+from models import db, User, Space, SpaceMember, Assignment, Submission, GradingJob
+from page_cache import PAGE_CACHE
+
+MASTER, PUPIL, OTHER_PUPIL = 1, 2, 3
+PAGES = {
+    'master dashboard': (MASTER, 'master', '/master_dashboard'),
+    'space detail (master)': (MASTER, 'master', '/space/1'),
+    'space detail (pupil)': (PUPIL, 'pupil', '/space/1'),
+    'assignment detail (pupil)': (PUPIL, 'pupil', '/assignment/1'),
+}
+BACKENDS = ('', 'memory', 'sqlite')
+
+
+def seed(scale):
+    """One master, `scale` spaces, `scale` assignments in the first one and `5 * scale` pupils who all submitted."""
+    db.drop_all()
+    db.create_all()
+    pupils = 5 * scale
+    db.session.execute(insert(User), [
+        {'id': i, 'google_id': f'g{i}', 'name': f'User {i}', 'email': f'u{i}@example.com',
+         'role': 'master' if i == MASTER else 'pupil'} for i in range(1, pupils + 2)])
+    db.session.execute(insert(Space), [
+        {'id': i, 'unique_code': f'code{i}', 'name': f'Space {i}', 'master_id': MASTER} for i in range(1, scale + 1)])
+    db.session.execute(insert(SpaceMember), [
+        {'space_id': space_id, 'user_id': user_id}
+        for user_id in range(2, pupils + 2) for space_id in range(1, scale + 1)])
+    db.session.execute(insert(Assignment), [
+        {'id': i, 'space_id': 1, 'title': f'Assignment {i}'} for i in range(1, scale + 1)])
+    submissions = [{'id': i + 1, 'assignment_id': a, 'pupil_id': p, 'file_path': 'uploads/x.pdf'}
+                   for i, (a, p) in enumerate((a, p) for a in range(1, scale + 1) for p in range(2, pupils + 2))]
+    db.session.execute(insert(Submission), submissions)
+    db.session.execute(insert(GradingJob), [
+        {'submission_id': s['id'], 'status': 'done' if s['id'] % 2 else 'pending', 'attempts': 1,
+         'feedback': 'Well done.' if s['id'] % 2 else None}
+        for s in submissions])
+    db.session.commit()
+
+
+def build_app(backend):
+    return create_app({'PAGE_CACHE_BACKEND': backend,
+                       'PAGE_CACHE_PATH': os.path.join(_tmp.name, f'page_cache-{backend}.sqlite')})
+
+
+def sign_in(client, user_id, role):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['role'] = role
+
+
+def rate(client, url, requests, headers=None, status=200):
+    client.get(url)  # fills the cache, if there is one
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(url, headers=headers)
+        assert response.status_code == status, f'{url}: {response.status_code}'
+    return requests / (time.perf_counter() - start)
+
+
+def measure(backend, requests):
+    client = build_app(backend).test_client()
+    results = {}
+    for name, (user_id, role, url) in PAGES.items():
+        sign_in(client, user_id, role)
+        full = rate(client, url, requests)
+        revalidated = None
+        etag = client.get(url).headers.get('ETag')
+        if etag:
+            revalidated = rate(client, url, requests, headers={'If-None-Match': etag}, status=304)
+        results[name] = (full, revalidated)
+    return results
+
+
+def cache_hits():
+    return sum(value for (_, outcome), value in PAGE_CACHE.snapshot() if outcome == 'hit')
+
+
+def check_freshness(backend):
+    """Returns a list of problems found after writes that should change the cached pages."""
+    app = build_app(backend)
+    client = app.test_client()
+    problems = []
+
+    def page(user_id, role, url):
+        sign_in(client, user_id, role)
+        response = client.get(url)
+        if response.status_code != 200:
+            problems.append(f'{url}: status {response.status_code}')
+        return response.get_data(as_text=True)
+
+    # Warm every page involved, then change what they show
+    page(MASTER, 'master', '/master_dashboard')
+    page(MASTER, 'master', '/space/1')
+    client.post('/create_assignment/1', data={'title': 'Fresh assignment', 'description': ''})
+    if 'Fresh assignment' not in page(MASTER, 'master', '/space/1'):
+        problems.append('new assignment missing from the cached space page')
+    with app.app_context():
+        assignment_id = db.session.query(Assignment.id).filter_by(title='Fresh assignment').scalar()
+    url = f'/assignment/{assignment_id}'
+
+    before = page(PUPIL, 'pupil', url)
+    page(OTHER_PUPIL, 'pupil', url)
+    sign_in(client, PUPIL, 'pupil')
+    client.post(f'/submit_assignment/{assignment_id}',
+                data={'file': (io.BytesIO(b'print(42)\n'), 'answer.py')}, content_type='multipart/form-data')
+    flashed = page(PUPIL, 'pupil', url)
+    after = page(PUPIL, 'pupil', url)
+    if 'Submission successful' not in flashed:
+        problems.append('page after submitting does not show the flash message')
+    if 'Submission successful' in after:
+        problems.append('flash message was cached')
+    if 'answer.py' not in after or after == before:
+        problems.append('submission missing from the cached assignment page')
+    if 'answer.py' in page(OTHER_PUPIL, 'pupil', url):
+        problems.append("another pupil's submission served from the cache")
+
+    # Pages that do not show this pupil's grading must survive its job transitions
+    untouched = [(OTHER_PUPIL, 'pupil', url), (OTHER_PUPIL, 'pupil', '/space/1'), (MASTER, 'master', '/master_dashboard')]
+    for args in untouched:
+        page(*args)
+    if '1 submitted &middot; 0 graded' not in page(MASTER, 'master', '/space/1'):
+        problems.append("new submission missing from the master's cached space page")
+    with app.app_context():
+        job = (GradingJob.query.join(Submission)
+               .filter(Submission.assignment_id == assignment_id, Submission.pupil_id == PUPIL).one())
+        claim_job(job.id, 'bench')
+        finish_job(job, 'bench', feedback='Cached feedback is fresh.')
+    if 'Cached feedback is fresh.' not in page(PUPIL, 'pupil', url):
+        problems.append('finished grading missing from the cached assignment page')
+    if 'feedback ready' not in page(PUPIL, 'pupil', '/space/1'):
+        problems.append("finished grading missing from the pupil's cached space page")
+    if '1 submitted &middot; 1 graded' not in page(MASTER, 'master', '/space/1'):
+        problems.append("finished grading missing from the master's cached space page")
+    for args in untouched if backend else ():
+        hits = cache_hits()
+        page(*args)
+        if cache_hits() != hits + 1:
+            problems.append(f"{args[2]} for user {args[0]} was dropped by another pupil's grading job")
+
+    sign_in(client, PUPIL, 'pupil')
+    etag = client.get(url).headers.get('ETag')
+    if backend and client.get(url, headers={'If-None-Match': etag}).status_code != 304:
+        problems.append('unchanged page not answered with 304')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=20, help='Spaces and assignments to seed.')
+    parser.add_argument('--requests', type=int, default=300, help='Timed requests per page.')
+    args = parser.parse_args()
+
+    with build_app('').app_context():
+        seed(args.scale)
+    results = {backend: measure(backend, args.requests) for backend in BACKENDS}
+
+    header = ''.join(f"{(backend or 'off') + ' req/s':>16}" for backend in BACKENDS)
+    print(f"{'page':<30}{header}{'304 req/s':>14}")
+    for name in PAGES:
+        row = ''.join(f'{results[backend][name][0]:>16.0f}' for backend in BACKENDS)
+        print(f"{name:<30}{row}{results['sqlite'][name][1]:>14.0f}")
+
+    failures = []
+    for backend in BACKENDS:
+        with build_app('').app_context():
+            seed(2)
+        failures += [f"{backend or 'off'}: {problem}" for problem in check_freshness(backend)]
+    if failures:
+        sys.exit('Stale or shared cached pages:\n  ' + '\n  '.join(failures))
+    print('Cached pages stayed fresh after every write.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Stress concurrent writes to a local SQLite file from several processes.
+
+Each writer process repeats what submit_assignment does (check for an existing
+submission, insert the submission and its grading job, commit) while reader
+processes run the pupil dashboard query, the way several gunicorn workers
+share one database file near a deadline. Runs once with SQLAlchemy's default
+engine settings and once with the engine profile from database.py (WAL,
+busy_timeout, synchronous=NORMAL), and reports committed writes per second,
+"database is locked" failures, commits that waited over a second for the lock
+and commit latency.
+
+Every process connects first and then waits on a shared barrier, so all of
+them run concurrently; each one times its own window from the barrier to its
+deadline, and rates are the sum of the per-process rates.
+
+    python benchmarks/bench_sqlite_writes.py [--writers 8] [--readers 4] [--seconds 10]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.exc import OperationalError
+
+from database import apply_sqlite_pragmas
+from models import db
+
+PUPILS, ASSIGNMENTS = 2000, 50
+SLOW_COMMIT = 1.0  # seconds; commits slower than this spent most of their time waiting for the lock
+
+
+def make_engine(path, tuned):
+    engine = create_engine(f'sqlite:///{path}')
+    if tuned:
+        apply_sqlite_pragmas(engine)
+    return engine
+
+
+def seed(path):
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    t = db.metadata.tables
+    with engine.begin() as conn:
+        conn.execute(insert(t['user']), [
+            {'id': i, 'google_id': f'g{i}', 'name': f'User {i}', 'email': f'u{i}@example.com',
+             'role': 'master' if i == 1 else 'pupil'} for i in range(1, PUPILS + 2)])
+        conn.execute(insert(t['space']), [{'id': 1, 'unique_code': 'code', 'name': 'Space', 'master_id': 1}])
+        conn.execute(insert(t['space_member']), [{'space_id': 1, 'user_id': i} for i in range(2, PUPILS + 2)])
+        conn.execute(insert(t['assignment']), [
+            {'id': i, 'space_id': 1, 'title': f'Assignment {i}'} for i in range(1, ASSIGNMENTS + 1)])
+    engine.dispose()
+
+
+def is_locked(error):
+    return 'database is locked' in str(error)
+
+
+def start_together(engine, barrier, seconds):
+    """Opens a connection so start-up is not timed, waits for every process, returns the start and deadline."""
+    engine.connect().close()
+    barrier.wait()
+    start = time.perf_counter()
+    return start, start + seconds
+
+
+def writer(path, tuned, index, writers, barrier, seconds, results):
+    engine = make_engine(path, tuned)
+    t = db.metadata.tables
+    submission, job = t['submission'], t['grading_job']
+    latencies, errors = [], 0
+    # Each writer owns a disjoint slice of (assignment, pupil) pairs so every insert is new
+    pairs = ((a, p) for p in range(2 + index, PUPILS + 2, writers) for a in range(1, ASSIGNMENTS + 1))
+    started, deadline = start_together(engine, barrier, seconds)
+    for assignment_id, pupil_id in pairs:
+        if time.perf_counter() >= deadline:
+            break
+        start = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                existing = conn.execute(select(submission.c.id).where(
+                    submission.c.assignment_id == assignment_id, submission.c.pupil_id == pupil_id)).first()
+                if existing is None:
+                    submission_id = conn.execute(insert(submission).values(
+                        assignment_id=assignment_id, pupil_id=pupil_id, file_path='uploads/x.pdf')).inserted_primary_key[0]
+                    conn.execute(insert(job).values(submission_id=submission_id, status='pending', attempts=0))
+        except OperationalError as e:
+            if not is_locked(e):
+                raise
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    results.put((latencies, errors, time.perf_counter() - started))
+    engine.dispose()
+
+
+def reader(path, tuned, barrier, seconds, results):
+    engine = make_engine(path, tuned)
+    t = db.metadata.tables
+    reads, errors = 0, 0
+    query = (select(t['assignment'].c.id, func.count(t['submission'].c.id))
+             .join(t['submission'], t['submission'].c.assignment_id == t['assignment'].c.id, isouter=True)
+             .where(t['assignment'].c.space_id == 1).group_by(t['assignment'].c.id))
+    started, deadline = start_together(engine, barrier, seconds)
+    while time.perf_counter() < deadline:
+        try:
+            with engine.connect() as conn:
+                conn.execute(query).fetchall()
+            reads += 1
+        except OperationalError as e:
+            if not is_locked(e):
+                raise
+            errors += 1
+    results.put((reads, errors, time.perf_counter() - started))
+    engine.dispose()
+
+
+def run(path, tuned, writers, readers, seconds):
+    seed(path)
+    if tuned:
+        # journal_mode=WAL is stored in the file, so set it once before the workers start
+        make_engine(path, tuned).connect().close()
+    ctx = multiprocessing.get_context('spawn')
+    write_results, read_results = ctx.Queue(), ctx.Queue()
+    barrier = ctx.Barrier(writers + readers)
+    procs = [ctx.Process(target=writer, args=(path, tuned, i, writers, barrier, seconds, write_results))
+             for i in range(writers)]
+    procs += [ctx.Process(target=reader, args=(path, tuned, barrier, seconds, read_results))
+              for _ in range(readers)]
+    for p in procs:
+        p.start()
+    latencies, write_errors, write_rate, read_errors, read_rate = [], 0, 0.0, 0, 0.0
+    for _ in range(writers):
+        lat, err, window = write_results.get()
+        latencies.extend(lat)
+        write_errors += err
+        write_rate += len(lat) / window
+    for _ in range(readers):
+        count, err, window = read_results.get()
+        read_errors += err
+        read_rate += count / window
+    for p in procs:
+        p.join()
+        if p.exitcode:
+            sys.exit(f'a benchmark process failed with exit code {p.exitcode}')
+    latencies.sort()
+    p = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else float('nan')
+    return {
+        'writes/s': write_rate,
+        'locked writes': write_errors,
+        f'commits > {SLOW_COMMIT:g}s': sum(1 for latency in latencies if latency > SLOW_COMMIT),
+        'reads/s': read_rate,
+        'locked reads': read_errors,
+        'commit p50 ms': p(0.5),
+        'commit p99 ms': p(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        default = run(os.path.join(tmp, 'default.db'), False, args.writers, args.readers, args.seconds)
+        tuned = run(os.path.join(tmp, 'tuned.db'), True, args.writers, args.readers, args.seconds)
+
+    print(f'{args.writers} writer and {args.readers} reader processes, {args.seconds:g}s each')
+    print(f"{'':<16}{'default':>12}{'WAL profile':>14}")
+    for name in default:
+        print(f'{name:<16}{default[name]:>12.1f}{tuned[name]:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Measure submission uploads and check that rejected uploads leave no temp files.
+
+Posts submissions of a few sizes through the Flask test client and reports
+uploads per second and MB/s for the single-pass hash-and-rename path. Then
+posts an oversized file, a file with a disallowed extension and a body cut
+off before its declared length, and fails if any of them leaves a file in
+UPLOAD_FOLDER/tmp or a blob behind, or if the oversized one is not rejected.
+
+    python benchmarks/bench_uploads.py [--uploads 50] [--max-kb 100]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its configuration at import time
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp.name, 'uploads.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(_tmp.name, 'uploads')
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ['GRADING_WORKERS'] = '0'
+os.environ['MAIL_POLL_INTERVAL'] = '60'
+os.environ['PAGE_CACHE_BACKEND'] = ''
+os.environ['METRICS_DIR'] = os.path.join(_tmp.name, 'metrics')
+
+from sqlalchemy import insert
+
+from app import create_app
+from models import db, User, Space, SpaceMember, Assignment
+
+SIZES_KB = (4, 64)
+
+
+def seed(pupils, assignments):
+    db.create_all()
+    db.session.execute(insert(User), [
+        {'id': i, 'google_id': f'g{i}', 'name': f'User {i}', 'email': f'u{i}@example.com',
+         'role': 'master' if i == 1 else 'pupil'} for i in range(1, pupils + 2)])
+    db.session.execute(insert(Space), [{'id': 1, 'unique_code': 'code1', 'name': 'Space', 'master_id': 1}])
+    db.session.execute(insert(SpaceMember), [{'space_id': 1, 'user_id': i} for i in range(2, pupils + 2)])
+    db.session.execute(insert(Assignment), [
+        {'id': i, 'space_id': 1, 'title': f'Assignment {i}'} for i in range(1, assignments + 1)])
+    db.session.commit()
+
+
+def sign_in(client, user_id):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['role'] = 'pupil'
+
+
+def submit(client, assignment_id, body, filename='answer.py'):
+    return client.post(f'/submit_assignment/{assignment_id}', data={'file': (io.BytesIO(body), filename)},
+                       content_type='multipart/form-data')
+
+
+def leftovers(upload_folder):
+    """Files in the upload temp directory and the number of stored blobs."""
+    tmp_dir = os.path.join(upload_folder, 'tmp')
+    blob_dir = os.path.join(upload_folder, 'blobs')
+    temp_files = os.listdir(tmp_dir) if os.path.isdir(tmp_dir) else []
+    blobs = sum(len(files) for _, _, files in os.walk(blob_dir))
+    return temp_files, blobs
+
+
+def measure(client, uploads):
+    results = {}
+    for assignment_id, size_kb in enumerate(SIZES_KB, start=1):
+        start = time.perf_counter()
+        for pupil in range(2, uploads + 2):
+            sign_in(client, pupil)
+            # Distinct bodies, so every upload is hashed and stored as a new blob
+            body = pupil.to_bytes(4, 'big') * (size_kb * 256)
+            response = submit(client, assignment_id, body)
+            assert response.status_code == 302, response.status_code
+        elapsed = time.perf_counter() - start
+        results[size_kb] = (uploads / elapsed, uploads * size_kb / 1024 / elapsed)
+    return results
+
+
+def check_rejected(app, client, assignment_id, max_size):
+    """Returns a list of problems found after uploads that must not be stored."""
+    problems = []
+    folder = app.config['UPLOAD_FOLDER']
+    _, blobs_before = leftovers(folder)
+    sign_in(client, 2)
+
+    response = submit(client, assignment_id, b'x' * (max_size + 20 * 1024))
+    if response.status_code != 302 or 'File too large' not in client.get('/').get_data(as_text=True):
+        problems.append(f'oversized upload was not rejected (status {response.status_code})')
+    temp_files, blobs = leftovers(folder)
+    if temp_files:
+        problems.append(f'oversized upload left temp files: {temp_files}')
+
+    submit(client, assignment_id, b'MZ' * 1000, filename='answer.exe')
+    temp_files, blobs = leftovers(folder)
+    if temp_files:
+        problems.append(f'upload with a disallowed extension left temp files: {temp_files}')
+
+    body = (b'--b\r\nContent-Disposition: form-data; name="file"; filename="answer.py"\r\n'
+            b'Content-Type: text/x-python\r\n\r\n' + b'y' * 50000)
+    client.post(f'/submit_assignment/{assignment_id}', input_stream=io.BytesIO(body),
+                headers={'Content-Type': 'multipart/form-data; boundary=b', 'Content-Length': str(len(body) + 10000)})
+    temp_files, blobs = leftovers(folder)
+    if temp_files:
+        problems.append(f'cut-off upload left temp files: {temp_files}')
+    if blobs != blobs_before:
+        problems.append(f'rejected uploads were stored as {blobs - blobs_before} blob(s)')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=50, help='Timed uploads per file size.')
+    parser.add_argument('--max-kb', type=int, default=100, help='MAX_UPLOAD_SIZE for the rejection checks.')
+    args = parser.parse_args()
+
+    app = create_app({'MAX_UPLOAD_SIZE': args.max_kb * 1024})
+    with app.app_context():
+        seed(args.uploads, len(SIZES_KB) + 1)
+    client = app.test_client()
+
+    print(f"{'file size':>10}{'uploads/s':>12}{'MB/s':>10}")
+    for size_kb, (per_second, mb_per_second) in measure(client, args.uploads).items():
+        print(f'{size_kb:>7} KB{per_second:>12.0f}{mb_per_second:>10.1f}')
+
+    problems = check_rejected(app, client, len(SIZES_KB) + 1, args.max_kb * 1024)
+    if problems:
+        sys.exit('Rejected uploads were not cleaned up:\n  ' + '\n  '.join(problems))
+    print('Rejected uploads left nothing in the upload folder.')
+
+
+if __name__ == '__main__':
+    main()
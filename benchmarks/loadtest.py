@@ -0,0 +1,276 @@
+"""Offline load test of the whole app against stubbed Gemini, Google sign-in and SMTP.
+
+Builds the Flask app with create_app() and serves it on a local threaded WSGI server with a fake
+Gemini client, a fake OIDC provider and a fake SMTP server (see stubs.py),
+seeds a space with pupils, assignments and graded submissions, then drives:
+
+    login            every pupil signs in through the full OIDC redirect flow
+    dashboard        pupils browse dashboard, space and assignment pages
+    deadline         every pupil submits the same assignment at once
+    bulk-grading     grading of all deadline submissions, until the queue drains
+    edit-fanout      the master edits an assignment; time until every pupil's email is delivered
+
+and reports requests per second and p50/p99 latency per scenario. Save a run
+with --save and compare later runs against it with --baseline.
+
+    python benchmarks/loadtest.py [--pupils 200] [--concurrency 32] [--llm-latency 0.5]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from werkzeug.datastructures import FileStorage
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from stubs import FakeGeminiClient, FakeIdentityProvider, FakeSMTPServer
+
+MASTER_EMAIL = 'master@school.test'
+CLIENT_ID = 'loadtest'
+
+
+def configure_environment(tmp, args, smtp):
+    # The app reads its configuration at import time
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmp, 'loadtest.db')}",
+        'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+        'PAGE_CACHE_PATH': os.path.join(tmp, 'page_cache.sqlite'),
+        'METRICS_DIR': os.path.join(tmp, 'metrics'),
+        'SECRET_KEY': 'loadtest',
+        'GOOGLE_CLIENT_ID': CLIENT_ID,
+        'GOOGLE_CLIENT_SECRET': 'loadtest',
+        'GOOGLE_DISCOVERY_URL': 'https://idp.test/.well-known/openid-configuration',
+        'MASTER_EMAILS': MASTER_EMAIL,
+        'GRADING_WORKERS': str(args.grading_workers),
+        'GRADING_POLL_INTERVAL': '0.5',
+        'GEMINI_REQUESTS_PER_MINUTE': '0',
+        'GEMINI_TOKENS_PER_MINUTE': '0',
+        'SMTP_SERVER': '127.0.0.1',
+        'SMTP_PORT': str(smtp.port),
+        'SMTP_STARTTLS': '0',
+        'MAIL_FROM': 'lms@school.test',
+        'MAIL_POLL_INTERVAL': '0.5',
+    })
+
+
+def submission_source(rng, pupil):
+    """A small Python file that differs per pupil, so similarity and the LLM cache see distinct inputs."""
+    ops = ['+', '-', '*']
+    lines = [f'# Pupil {pupil}', 'def solve(values):', '    total = 0', '    for value in values:']
+    for i in range(rng.randint(3, 8)):
+        lines.append(f'        total = total {rng.choice(ops)} value * {rng.randint(1, 99)}  # step {i}')
+    lines += ['    return total', '', f'print(solve(range({rng.randint(5, 500)})))']
+    return '\n'.join(lines) + '\n'
+
+
+def seed(app, pupils, assignments, graded):
+    """One master and space, `pupils` members, `assignments` assignments and `graded` graded submissions."""
+    from sqlalchemy import insert
+    from blueprints.assignments import store_upload as store
+    from models import db, User, Space, SpaceMember, Assignment, Submission, GradingJob
+
+    rng = random.Random(1)
+    with app.app_context():
+        db.create_all()
+        emails = [MASTER_EMAIL] + [f'pupil{i}@school.test' for i in range(pupils)]
+        db.session.execute(insert(User), [
+            {'id': i + 1, 'google_id': FakeIdentityProvider.subject(email), 'name': email.split('@')[0],
+             'email': email, 'role': 'master' if i == 0 else 'pupil'} for i, email in enumerate(emails)])
+        db.session.execute(insert(Space), [{'id': 1, 'unique_code': 'loadtest', 'name': 'Load test', 'master_id': 1}])
+        db.session.execute(insert(SpaceMember), [{'space_id': 1, 'user_id': i} for i in range(2, pupils + 2)])
+        solution = store(FileStorage(BytesIO(b'def solve(values):\n    return sum(values)\n'), filename='solution.txt'))
+        db.session.execute(insert(Assignment), [
+            {'id': i, 'space_id': 1, 'title': f'Assignment {i}', 'description': 'Write solve().',
+             'solution_file_path': solution.path, 'solution_filename': 'solution.txt',
+             'solution_sha256': solution.sha256} for i in range(1, assignments + 1)])
+        rows, jobs = [], []
+        for assignment_id in range(1, min(graded, assignments) + 1):
+            for pupil_id in range(2, pupils + 2):
+                blob = store(FileStorage(BytesIO(submission_source(rng, pupil_id).encode()), filename='answer.py'))
+                rows.append({'id': len(rows) + 1, 'assignment_id': assignment_id, 'pupil_id': pupil_id,
+                             'file_path': blob.path, 'original_filename': 'answer.py',
+                             'file_sha256': blob.sha256, 'file_size': blob.size})
+                jobs.append({'submission_id': len(rows), 'status': 'done', 'feedback': 'Seeded feedback.',
+                             'attempts': 1})
+        if rows:
+            db.session.execute(insert(Submission), rows)
+            db.session.execute(insert(GradingJob), jobs)
+        db.session.commit()
+    return emails
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def request(self, session, method, url, expect=(200, 302), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, allow_redirects=False, timeout=120, **kwargs)
+            ok = response.status_code in expect
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.append(elapsed)
+            if not ok:
+                self.errors += 1
+        return response
+
+    def summary(self, wall, **extra):
+        latencies = sorted(self.latencies)
+        pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+        return {'requests': len(latencies), 'errors': self.errors, 'rps': len(latencies) / wall if wall else 0.0,
+                'p50_ms': pick(0.5), 'p99_ms': pick(0.99), 'wall_s': wall, **extra}
+
+
+def login(recorder, base, email):
+    session = requests.Session()
+    response = recorder.request(session, 'GET', f'{base}/login')
+    query = parse_qs(urlparse(response.headers['Location']).query) if response is not None else {}
+    code = f"{email}|{query.get('nonce', [''])[0]}"
+    recorder.request(session, 'GET', f'{base}/authorize', params={'code': code, 'state': query.get('state', [''])[0]})
+    return session
+
+
+def run_concurrently(concurrency, fn, items):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(fn, items))
+
+
+def wait_for_grading(base, master, assignment_id, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        progress = master.get(f'{base}/assignment/{assignment_id}/grading_progress').json()
+        if not progress['pending'] and not progress['running']:
+            return progress
+        time.sleep(0.2)
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pupils', type=int, default=200)
+    parser.add_argument('--assignments', type=int, default=20)
+    parser.add_argument('--graded', type=int, default=3, help='Assignments seeded with graded submissions.')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent simulated users.')
+    parser.add_argument('--browse', type=int, default=5, help='Page views per pupil in the dashboard scenario.')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Mean fake Gemini latency in seconds.')
+    parser.add_argument('--llm-output-tokens', type=int, default=600)
+    parser.add_argument('--smtp-latency', type=float, default=0.01, help='Fake SMTP delay per message in seconds.')
+    parser.add_argument('--grading-workers', type=int, default=4)
+    parser.add_argument('--save', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare against results saved earlier with --save.')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='loadtest-')
+    smtp = FakeSMTPServer(latency=args.smtp_latency).start()
+    configure_environment(tmp, args, smtp)
+
+    from app import create_app
+    from services import get_services
+    app = create_app()
+    services = get_services(app)
+    gemini = FakeGeminiClient(latency=args.llm_latency, jitter=args.llm_latency / 2,
+                              output_tokens=args.llm_output_tokens)
+    services.llm_options['client'] = gemini
+    idp = FakeIdentityProvider(CLIENT_ID)
+    services.google_oidc.session.mount(idp.issuer, idp)
+    services.google_oidc.adapter = idp
+
+    emails = seed(app, args.pupils, args.assignments, args.graded)
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    results = {}
+
+    # login: the full redirect flow, two requests per user
+    recorder, start = Recorder(), time.perf_counter()
+    sessions = run_concurrently(args.concurrency, lambda email: login(recorder, base, email), emails)
+    results['login'] = recorder.summary(time.perf_counter() - start, idp_requests=idp.requests)
+    master, pupils = sessions[0], sessions[1:]
+
+    # dashboard: a mix of the pages a pupil opens while browsing
+    rng = random.Random(2)
+    pages = ['/pupil_dashboard', '/space/1', '/space/1?page=2'] + [f'/assignment/{i}' for i in range(1, args.graded + 1)]
+    views = [(session, rng.choice(pages)) for session in pupils for _ in range(args.browse)]
+    recorder, start = Recorder(), time.perf_counter()
+    run_concurrently(args.concurrency, lambda view: recorder.request(view[0], 'GET', base + view[1], expect=(200,)),
+                     views)
+    results['dashboard'] = recorder.summary(time.perf_counter() - start)
+
+    # deadline: every pupil submits the same, not yet submitted, assignment at once
+    deadline_assignment = args.graded + 1
+    rng = random.Random(3)
+    files = [submission_source(rng, i).encode() for i in range(len(pupils))]
+    recorder, start = Recorder(), time.perf_counter()
+    calls_before = gemini.calls
+    run_concurrently(args.concurrency, lambda i: recorder.request(
+        pupils[i], 'POST', f'{base}/submit_assignment/{deadline_assignment}', expect=(302,),
+        files={'file': ('answer.py', files[i], 'text/x-python')}), range(len(pupils)))
+    results['deadline'] = recorder.summary(time.perf_counter() - start)
+
+    # bulk-grading: the submissions above are graded by the worker pool; time until the queue drains
+    progress = wait_for_grading(base, master, deadline_assignment, timeout=600)
+    wall = time.perf_counter() - start
+    results['bulk-grading'] = {'requests': 0, 'errors': progress['failed'], 'rps': progress['done'] / wall,
+                               'p50_ms': 0.0, 'p99_ms': 0.0, 'wall_s': wall, 'graded': progress['done'],
+                               'llm_calls': gemini.calls - calls_before}
+
+    # edit-fanout: one edit notifies every pupil; time until the stub SMTP server has every message
+    messages_before, connections_before = len(smtp.messages), smtp.connections
+    recorder, start = Recorder(), time.perf_counter()
+    recorder.request(master, 'POST', f'{base}/edit_assignment/1', expect=(302,),
+                     data={'title': 'Assignment 1 (updated)', 'description': 'Write solve().'})
+    while len(smtp.messages) - messages_before < len(pupils) and time.perf_counter() - start < 120:
+        time.sleep(0.05)
+    results['edit-fanout'] = recorder.summary(time.perf_counter() - start,
+                                              delivered=len(smtp.messages) - messages_before,
+                                              smtp_connections=smtp.connections - connections_before)
+
+    server.shutdown()
+    services.grading_pool.stop(timeout=5)
+    services.mail_sender.stop(timeout=5)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(f'{args.pupils} pupils, concurrency {args.concurrency}, fake LLM latency {args.llm_latency}s')
+    print(f"{'scenario':<14}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>9}{'p99 ms':>9}{'wall s':>8}  notes")
+    for name, r in results.items():
+        notes = ', '.join(f'{k}={v}' for k, v in r.items()
+                          if k not in ('requests', 'errors', 'rps', 'p50_ms', 'p99_ms', 'wall_s'))
+        if name in baseline and baseline[name]['p99_ms']:
+            notes += f"{', ' if notes else ''}p99 vs baseline {r['p99_ms'] / baseline[name]['p99_ms']:.2f}x"
+        elif name in baseline and baseline[name]['wall_s']:
+            notes += f"{', ' if notes else ''}wall vs baseline {r['wall_s'] / baseline[name]['wall_s']:.2f}x"
+        print(f"{name:<14}{r['requests']:>9}{r['errors']:>8}{r['rps']:>9.1f}{r['p50_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['wall_s']:>8.2f}  {notes}")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Offline stand-ins for the external services the app talks to.
+
+- FakeGeminiClient replaces google.genai.Client (pass it to GeminiService as
+  `client`): configurable latency and token counts, streaming included.
+- FakeIdentityProvider is a requests transport adapter that serves an OIDC
+  discovery document, a JWKS and a token endpoint issuing signed ID tokens.
+- FakeSMTPServer is a minimal threaded SMTP server that accepts and counts
+  messages, with an optional per-message delay.
+"""
+import json
+import random
+import socketserver
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+
+class FakeGeminiClient:
+    def __init__(self, latency=0.5, jitter=0.25, input_tokens=3000, output_tokens=600, chunks=8, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.chunks = chunks
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = SimpleNamespace(generate_content=self._generate_content,
+                                      generate_content_stream=self._generate_content_stream)
+        self.files = SimpleNamespace(upload=self._upload)
+
+    def _delay(self):
+        with self._lock:
+            self.calls += 1
+            return max(self.latency + self._rng.uniform(-self.jitter, self.jitter), 0)
+
+    def _usage(self):
+        return SimpleNamespace(prompt_token_count=self.input_tokens, candidates_token_count=self.output_tokens,
+                               total_token_count=self.input_tokens + self.output_tokens)
+
+    def _text(self):
+        # Roughly four characters per token
+        return ('Feedback: the approach is sound; see the notes on edge cases. ' * (self.output_tokens // 15))[:self.output_tokens * 4]
+
+    def _generate_content(self, model, contents, config=None):
+        time.sleep(self._delay())
+        return SimpleNamespace(text=self._text(), usage_metadata=self._usage())
+
+    def _generate_content_stream(self, model, contents, config=None):
+        delay, text = self._delay(), self._text()
+        size = -(-len(text) // self.chunks)
+        for i in range(self.chunks):
+            time.sleep(delay / self.chunks)
+            last = i == self.chunks - 1
+            yield SimpleNamespace(text=text[i * size:(i + 1) * size], usage_metadata=self._usage() if last else None)
+
+    def _upload(self, file, config=None):
+        time.sleep(self._delay() / 4)
+        return SimpleNamespace(uri=f'https://files.test/{abs(hash(file))}', expiration_time=None)
+
+
+class FakeIdentityProvider(BaseAdapter):
+    """OIDC provider at `issuer`; the authorization code is `<email>|<nonce>`."""
+
+    def __init__(self, client_id, issuer='https://idp.test', latency=0.0):
+        super().__init__()
+        self.client_id = client_id
+        self.issuer = issuer
+        self.latency = latency
+        self.requests = 0
+        self._key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self._key.public_key()))
+        jwk.update(kid='stub-key', alg='RS256', use='sig')
+        self._jwks = {'keys': [jwk]}
+
+    @property
+    def discovery_url(self):
+        return f'{self.issuer}/.well-known/openid-configuration'
+
+    @staticmethod
+    def subject(email):
+        return f'sub-{email}'
+
+    def _token(self, body):
+        form = parse_qs(body.decode() if isinstance(body, bytes) else body)
+        email, _, nonce = form['code'][0].partition('|')
+        now = int(time.time())
+        id_token = jwt.encode({'iss': self.issuer, 'aud': self.client_id, 'sub': self.subject(email),
+                               'email': email, 'email_verified': True, 'name': email.split('@')[0], 'nonce': nonce,
+                               'iat': now, 'exp': now + 3600},
+                              self._key, algorithm='RS256', headers={'kid': 'stub-key'})
+        return {'access_token': 'stub', 'token_type': 'Bearer', 'expires_in': 3600, 'id_token': id_token}
+
+    def send(self, request, **kwargs):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        path = urlparse(request.url).path
+        if path == '/.well-known/openid-configuration':
+            data = {'issuer': self.issuer, 'authorization_endpoint': f'{self.issuer}/auth',
+                    'token_endpoint': f'{self.issuer}/token', 'userinfo_endpoint': f'{self.issuer}/userinfo',
+                    'jwks_uri': f'{self.issuer}/jwks'}
+        elif path == '/jwks':
+            data = self._jwks
+        elif path == '/token':
+            data = self._token(request.body)
+        else:
+            data = {'error': 'not_found'}
+        response = Response()
+        response.status_code = 404 if 'error' in data else 200
+        response._content = json.dumps(data).encode()
+        response.headers = CaseInsensitiveDict({'Content-Type': 'application/json',
+                                                'Cache-Control': 'public, max-age=3600'})
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self._reply('220 stub ESMTP')
+        data = None
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if data is not None:
+                if line.rstrip(b'\r\n') == b'.':
+                    if server.latency:
+                        time.sleep(server.latency)
+                    with server.lock:
+                        server.messages.append(data.getvalue())
+                    data = None
+                    self._reply('250 OK')
+                else:
+                    data.write(line)
+                continue
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self._reply('250-stub')
+                self._reply('250 8BITMIME')
+            elif command == b'DATA':
+                data = BytesIO()
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+            elif command == b'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('250 OK')
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        super().__init__((host, port), _SMTPHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-smtp', daemon=True).start()
+        return self
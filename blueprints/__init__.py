@@ -0,0 +1,7 @@
+"""Route groups registered by create_app(): sign-in, spaces and dashboards, assignments and grading, LLM tools."""
+from blueprints.assignments import bp as assignments_bp
+from blueprints.auth import bp as auth_bp
+from blueprints.llm import bp as llm_bp
+from blueprints.spaces import bp as spaces_bp
+
+ALL = (auth_bp, spaces_bp, assignments_bp, llm_bp)
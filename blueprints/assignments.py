@@ -0,0 +1,263 @@
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, flash, jsonify, redirect, render_template, request, session, stream_with_context, url_for
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from dashboard import assignment_with_submission
+from downloads import send_blob
+from export import stream_assignment_zip
+from grading import enqueue_grading, grade_assignment as queue_assignment_grading, assignment_grading_progress, stream_feedback_events
+from mailer import queue_emails
+from metrics import record_upload
+from models import db, User, SpaceMember, Space, Assignment, Submission, SimilarityFlag
+from page_cache import cached_page, invalidate_assignment, invalidate_space
+from services import get_services
+
+bp = Blueprint('assignments', __name__)
+
+# Allowed file extensions for pupil submissions
+ALLOWED_SUBMISSION_EXTENSIONS = {'pdf', 'py'}
+# How long a browser waits before reopening a feedback stream that ended while grading was pending
+FEEDBACK_STREAM_RETRY_MS = 3000
+
+
+def allowed_file(filename: str, allowed_extensions: set) -> bool:
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+
+
+def store_upload(file_storage):
+    blob = get_services().blob_store.save(file_storage)
+    record_upload(blob.size)
+    # Text extraction (pypdf on up to MAX_UPLOAD_SIZE of PDF) is left to the grading workers,
+    # which run extraction.ingest() on first use, so uploads return as soon as the file is stored
+    return blob
+
+
+@bp.route('/create_assignment/<int:space_id>', methods=['POST'])
+def create_assignment(space_id):
+    if session.get('role') != 'master':
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    space = Space.query.get_or_404(space_id)
+    title = request.form.get('title')
+    description = request.form.get('description')
+    due_date = request.form.get('due_date')
+    solution_file = request.files.get('solution')
+
+    assignment = Assignment(space_id=space.id, title=title, description=description)
+    if due_date:
+        try:
+            assignment.due_date = datetime.fromisoformat(due_date)
+        except ValueError:
+            flash('Invalid due date format.')
+    db.session.add(assignment)
+    db.session.commit()
+
+    if solution_file and allowed_file(solution_file.filename, {'pdf', 'py', 'txt'}):
+        blob = store_upload(solution_file)
+        assignment.solution_file_path = blob.path
+        assignment.solution_filename = solution_file.filename
+        assignment.solution_sha256 = blob.sha256
+        db.session.commit()
+
+    invalidate_space(space)
+    return redirect(url_for('spaces.space_detail', space_id=space.id))
+
+
+@bp.route('/edit_assignment/<int:assignment_id>', methods=['GET', 'POST'])
+def edit_assignment(assignment_id):
+    if session.get('role') != 'master':
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    assignment = Assignment.query.get_or_404(assignment_id)
+    space = assignment.space
+    if request.method == 'POST':
+        assignment.title = request.form.get('title')
+        assignment.description = request.form.get('description')
+        due_date = request.form.get('due_date')
+        if due_date:
+            try:
+                assignment.due_date = datetime.fromisoformat(due_date)
+            except ValueError:
+                flash('Invalid due date format.')
+        else:
+            assignment.due_date = None
+        solution_file = request.files.get('solution')
+        if solution_file and allowed_file(solution_file.filename, {'pdf', 'py', 'txt'}):
+            if assignment.solution_file_path:
+                get_services().invalidate_solution(assignment.solution_file_path)
+            blob = store_upload(solution_file)
+            assignment.solution_file_path = blob.path
+            assignment.solution_filename = solution_file.filename
+            assignment.solution_sha256 = blob.sha256
+
+        # notify pupils: one query for the addresses, queued in the same commit as the edit
+        recipients = [email for (email,) in db.session.query(User.email)
+                      .join(SpaceMember, SpaceMember.user_id == User.id)
+                      .filter(SpaceMember.space_id == space.id)]
+        queue_emails(recipients, f'Assignment updated: {assignment.title}',
+                     f'The assignment "{assignment.title}" has been updated.')
+        invalidate_assignment(assignment)
+        flash('Assignment updated and pupils notified.')
+        return redirect(url_for('spaces.space_detail', space_id=space.id))
+    return render_template('edit_assignment.html', assignment=assignment, space=space)
+
+@bp.route('/submit_assignment/<int:assignment_id>', methods=['POST'])
+def submit_assignment(assignment_id):
+    if session.get('role') != 'pupil':
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    user_id = session['user_id']
+    existing = Submission.query.filter_by(assignment_id=assignment_id, pupil_id=user_id).first()
+    if existing:
+        flash('You have already submitted this assignment.')
+        return redirect(url_for('assignments.assignment_detail', assignment_id=assignment_id))
+    file = request.files.get('file')
+    if not file or not allowed_file(file.filename, ALLOWED_SUBMISSION_EXTENSIONS):
+        flash('Invalid or missing file. Allowed types: pdf, py')
+        return redirect(url_for('assignments.assignment_detail', assignment_id=assignment_id))
+    blob = store_upload(file)
+    submission = Submission(assignment_id=assignment_id, pupil_id=user_id, file_path=blob.path, attempted=True,
+                            original_filename=file.filename, file_sha256=blob.sha256, file_size=blob.size)
+    db.session.add(submission)
+    try:
+        enqueue_grading(submission)
+    except IntegrityError:
+        # A concurrent request from the same pupil won the unique (assignment_id, pupil_id) insert
+        db.session.rollback()
+        flash('You have already submitted this assignment.')
+        return redirect(url_for('assignments.assignment_detail', assignment_id=assignment_id))
+    flash('Submission successful. Feedback will appear here once grading finishes.')
+    return redirect(url_for('assignments.assignment_detail', assignment_id=assignment_id))
+
+def _assignment_page_versions(assignment_id):
+    # A pupil's page also shows their own submission and its grading status
+    if session.get('role') == 'pupil':
+        return f'assignment:{assignment_id}', f"pupil:{session.get('user_id')}:assignment:{assignment_id}"
+    return f'assignment:{assignment_id}'
+
+
+@bp.route('/assignment/<int:assignment_id>')
+@cached_page(_assignment_page_versions)
+def assignment_detail(assignment_id):
+    pupil_id = session['user_id'] if session.get('role') == 'pupil' else None
+    assignment, submission = assignment_with_submission(assignment_id, pupil_id)
+    return render_template('assignment_detail.html', assignment=assignment, submission=submission)
+
+
+@bp.route('/submission/<int:submission_id>/feedback')
+def submission_feedback(submission_id):
+    submission = Submission.query.get_or_404(submission_id)
+    user_id = session.get('user_id')
+    if user_id is None or (submission.pupil_id != user_id and submission.assignment.space.master_id != user_id):
+        return jsonify(error='Access denied.'), 403
+    job = submission.grading_job
+    if not job:
+        return jsonify(submission_id=submission.id, status='not_queued', feedback=None, error=None)
+    return jsonify(submission_id=submission.id, status=job.status, feedback=job.feedback, error=job.error,
+                   attempts=job.attempts, finished_at=job.finished_at.isoformat() if job.finished_at else None)
+
+
+@bp.route('/submission/<int:submission_id>/feedback/stream')
+def stream_submission_feedback(submission_id):
+    """Server-Sent Events relay of the feedback text the grading workers have written so far."""
+    submission = Submission.query.get_or_404(submission_id)
+    user_id = session.get('user_id')
+    if user_id is None or (submission.pupil_id != user_id and submission.assignment.space.master_id != user_id):
+        return jsonify(error='Access denied.'), 403
+    # Browsers send the id of the last event they saw when they reconnect
+    offset = request.headers.get('Last-Event-ID', 0, type=int)
+    wait = current_app.config['FEEDBACK_STREAM_WAIT']
+
+    def events():
+        yield f"retry: {FEEDBACK_STREAM_RETRY_MS}\n\n"
+        for event, data in stream_feedback_events(submission.id, offset=offset, wait_timeout=wait):
+            event_id = f"id: {data['offset']}\n" if 'offset' in data else ''
+            yield f"{event_id}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    # X-Accel-Buffering stops nginx from holding chunks back until the response ends
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/grade_assignment/<int:assignment_id>', methods=['POST'])
+def grade_assignment(assignment_id):
+    if session.get('role') != 'master':
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    assignment = Assignment.query.get_or_404(assignment_id)
+    if assignment.space.master_id != session['user_id']:
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    counts = queue_assignment_grading(assignment.id, regrade=bool(request.form.get('regrade')))
+    flash(f"Grading queued for {counts['queued']} submissions ({counts['skipped']} already queued or graded).")
+    return redirect(url_for('spaces.space_detail', space_id=assignment.space_id))
+
+
+@bp.route('/assignment/<int:assignment_id>/export.zip')
+def export_submissions(assignment_id):
+    """All submissions of the assignment and their feedback as a ZIP, streamed as it is built."""
+    assignment = Assignment.query.get_or_404(assignment_id)
+    if session.get('role') != 'master' or assignment.space.master_id != session.get('user_id'):
+        return jsonify(error='Access denied.'), 403
+    filename = f"{secure_filename(assignment.title) or 'assignment'}-{assignment.id}-submissions.zip"
+    return Response(stream_with_context(stream_assignment_zip(assignment.id)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/assignment/<int:assignment_id>/grading_progress')
+def grading_progress(assignment_id):
+    assignment = Assignment.query.get_or_404(assignment_id)
+    if session.get('role') != 'master' or assignment.space.master_id != session.get('user_id'):
+        return jsonify(error='Access denied.'), 403
+    return jsonify(assignment_grading_progress(assignment.id))
+
+
+@bp.route('/assignment/<int:assignment_id>/similarity')
+def assignment_similarity(assignment_id):
+    assignment = Assignment.query.get_or_404(assignment_id)
+    if session.get('role') != 'master' or assignment.space.master_id != session.get('user_id'):
+        return jsonify(error='Access denied.'), 403
+    flags = (SimilarityFlag.query.filter_by(assignment_id=assignment.id)
+             .order_by(SimilarityFlag.score.desc()).all())
+    return jsonify(flags=[{
+        'submission_id': f.submission_id,
+        'pupil': f.submission.pupil.name,
+        'other_submission_id': f.other_submission_id,
+        'other_pupil': f.other_submission.pupil.name,
+        'score': round(f.score, 3),
+        'method': f.method,
+        'status': f.status,
+        'explanation': f.explanation,
+    } for f in flags])
+
+
+def _can_view_space(space, user_id):
+    if user_id is None:
+        return False
+    return space.master_id == user_id or db.session.query(
+        SpaceMember.query.filter_by(space_id=space.id, user_id=user_id).exists()).scalar()
+
+
+@bp.route('/assignment/<int:assignment_id>/solution')
+def download_solution(assignment_id):
+    assignment = Assignment.query.get_or_404(assignment_id)
+    if not _can_view_space(assignment.space, session.get('user_id')):
+        return jsonify(error='Access denied.'), 403
+    if not assignment.solution_file_path:
+        return jsonify(error='No solution file.'), 404
+    return send_blob(assignment.solution_file_path, assignment.solution_filename, assignment.solution_sha256,
+                     root=get_services().blob_store.root)
+
+
+@bp.route('/submission/<int:submission_id>/file')
+def download_submission(submission_id):
+    submission = Submission.query.get_or_404(submission_id)
+    user_id = session.get('user_id')
+    if user_id is None or (submission.pupil_id != user_id and submission.assignment.space.master_id != user_id):
+        return jsonify(error='Access denied.'), 403
+    return send_blob(submission.file_path, submission.original_filename, submission.file_sha256,
+                     root=get_services().blob_store.root)
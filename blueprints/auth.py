@@ -0,0 +1,88 @@
+import os
+
+from flask import Blueprint, current_app, flash, redirect, render_template, request, session, url_for
+from requests_oauthlib import OAuth2Session
+
+from metrics import outbound
+from models import db, User
+from oidc import IDTokenError
+from roster import claim_roster_user
+from services import get_services
+
+bp = Blueprint('auth', __name__)
+
+
+def get_google_provider_cfg():
+    return get_services().google_oidc.metadata()
+
+
+@bp.route('/')
+def index():
+    return render_template('index.html')
+
+@bp.route('/login')
+def login():
+    google = OAuth2Session(current_app.config['GOOGLE_CLIENT_ID'], redirect_uri=url_for('auth.authorize', _external=True),
+                           scope=['openid', 'email', 'profile'])
+    nonce = os.urandom(16).hex()
+    authorization_url, state = google.authorization_url(get_google_provider_cfg()['authorization_endpoint'], access_type='offline', prompt='consent', nonce=nonce)
+    session['oauth_state'] = state
+    session['oauth_nonce'] = nonce
+    return redirect(authorization_url)
+
+@bp.route('/authorize')
+def authorize():
+    google_oidc = get_services().google_oidc
+    google = OAuth2Session(current_app.config['GOOGLE_CLIENT_ID'], state=session['oauth_state'],
+                           redirect_uri=url_for('auth.authorize', _external=True))
+    # Reuse the provider's pooled connections for the code exchange
+    google.mount('https://', google_oidc.adapter)
+    provider_cfg = get_google_provider_cfg()
+    with outbound('oauth', 'token'):
+        token = google.fetch_token(provider_cfg['token_endpoint'], client_secret=current_app.config['GOOGLE_CLIENT_SECRET'],
+                                   authorization_response=request.url)
+    session['oauth_token'] = token
+
+    # Identity comes from the signed ID token; userinfo is only a fallback if none was returned
+    if token.get('id_token'):
+        try:
+            userinfo = google_oidc.verify_id_token(token['id_token'], nonce=session.pop('oauth_nonce', None))
+        except IDTokenError as e:
+            print(e)
+            flash('Login failed, please try again.')
+            return redirect(url_for('auth.index'))
+    else:
+        with outbound('oauth', 'userinfo'):
+            userinfo = google.get(provider_cfg['userinfo_endpoint']).json()
+    google_id = userinfo['sub']
+    email = userinfo['email']
+    name = userinfo.get('name', '')
+
+    emails = os.getenv('MASTER_EMAILS', '').split(',')
+    role = 'master' if email in emails else 'pupil'
+
+    # Create or get user; only a verified address may take over a pupil imported from a roster
+    user = User.query.filter_by(google_id=google_id).first()
+    if user is None and userinfo.get('email_verified') in (True, 'true'):
+        user = claim_roster_user(google_id, email, name, role)
+    if not user:
+        if User.query.filter(db.func.lower(User.email) == email.lower()).first():
+            flash('An account with this email address already exists. Verify the address with Google and sign in again.')
+            return redirect(url_for('auth.index'))
+        # Default role assignment logic can be improved later
+        user = User(google_id=google_id, name=name, email=email, role=role)
+        db.session.add(user)
+        db.session.commit()
+    session['user_id'] = user.id
+    session['role'] = user.role
+
+    # Redirect based on role
+    if user.role == 'master':
+        return redirect(url_for('spaces.master_dashboard'))
+    return redirect(url_for('spaces.pupil_dashboard'))
+
+@bp.route('/logout')
+def logout():
+    session.clear()
+    flash('You have been logged out.')
+    return redirect(url_for('auth.index'))
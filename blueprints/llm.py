@@ -0,0 +1,29 @@
+"""LLM cache and routing statistics for masters.
+
+The direct Gemini tools of the original demo app (upload_assignment,
+check_integrity, class_insights) are not served: they called the model inside
+the request against fixed sample files, wrote uploads around the blob store
+and rendered templates that do not exist. Grading, similarity checks and their
+LLM calls run in the grading workers instead.
+"""
+from flask import Blueprint, jsonify, session
+
+from services import get_services
+
+bp = Blueprint('llm', __name__)
+
+
+@bp.before_request
+def require_master():
+    if session.get('role') != 'master':
+        return jsonify(error='Access denied.'), 403
+
+
+@bp.route('/llm_cache_stats')
+def llm_cache_stats():
+    return jsonify(get_services().llm_cache.stats())
+
+
+@bp.route('/llm_routing_stats')
+def llm_routing_stats():
+    return jsonify(get_services().model_router.stats())
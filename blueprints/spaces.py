@@ -0,0 +1,111 @@
+import os
+
+from flask import Blueprint, current_app, flash, jsonify, redirect, render_template, request, session, url_for
+from sqlalchemy.exc import IntegrityError
+
+from dashboard import master_spaces, pupil_spaces, space_assignments
+from models import db, Space, SpaceMember
+from page_cache import cached_page, invalidate_space
+from roster import import_roster, parse_csv, parse_json
+
+bp = Blueprint('spaces', __name__)
+
+
+@bp.route('/master_dashboard')
+@cached_page(lambda: f"master:{session.get('user_id')}")
+def master_dashboard():
+    if session.get('role') != 'master':
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    spaces = master_spaces(session['user_id'])
+    return render_template('master_dashboard.html', spaces=spaces)
+
+@bp.route('/pupil_dashboard')
+def pupil_dashboard():
+    if session.get('role') != 'pupil':
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    spaces = pupil_spaces(session['user_id'])
+    return render_template('pupil_dashboard.html', spaces=spaces)
+
+@bp.route('/create_space', methods=['POST'])
+def create_space():
+    if session.get('role') != 'master':
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    name = request.form.get('name')
+    code = os.urandom(4).hex()
+    space = Space(name=name, unique_code=code, master_id=session['user_id'])
+    db.session.add(space)
+    db.session.commit()
+    invalidate_space(space)
+    return redirect(url_for('spaces.master_dashboard'))
+
+
+def _space_page_versions(space_id):
+    # Masters see submission counts, pupils their own grading status (see page_cache.invalidate_submission)
+    if session.get('role') == 'master':
+        return f'space:{space_id}', f'progress:space:{space_id}'
+    return f'space:{space_id}', f"pupil:{session.get('user_id')}:space:{space_id}"
+
+
+@bp.route('/space/<int:space_id>')
+@cached_page(_space_page_versions)
+def space_detail(space_id):
+    space = Space.query.get_or_404(space_id)
+    assignments = space_assignments(space.id, page=request.args.get('page', 1, type=int),
+                                    per_page=current_app.config['PAGE_SIZE'],
+                                    master=session.get('role') == 'master', pupil_id=session.get('user_id'))
+    return render_template('space_detail.html', space=space, assignments=assignments)
+
+
+@bp.route('/join_space', methods=['POST'])
+def join_space():
+    if session.get('role') != 'pupil':
+        flash('Access denied.')
+        return redirect(url_for('auth.index'))
+    code = request.form.get('code')
+    space = Space.query.filter_by(unique_code=code).first()
+    if not space:
+        flash('Invalid code.')
+        return redirect(url_for('spaces.pupil_dashboard'))
+    # The unique (space_id, user_id) constraint makes a repeated or racing join a no-op
+    db.session.add(SpaceMember(space_id=space.id, user_id=session['user_id']))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+    else:
+        invalidate_space(space)
+    return redirect(url_for('spaces.pupil_dashboard'))
+
+
+@bp.route('/space/<int:space_id>/roster', methods=['POST'])
+def import_space_roster(space_id):
+    """Enrols a roster of pupils: a CSV file upload (email[,name]) or a JSON body."""
+    space = Space.query.get_or_404(space_id)
+    if session.get('role') != 'master' or space.master_id != session.get('user_id'):
+        return jsonify(error='Access denied.'), 403
+    try:
+        if request.is_json:
+            entries = parse_json(request.get_json())
+        else:
+            roster_file = request.files.get('roster')
+            if not roster_file:
+                flash('Choose a roster file to import.')
+                return redirect(url_for('spaces.space_detail', space_id=space.id))
+            entries = parse_csv(roster_file.read().decode('utf-8-sig'))
+    except ValueError as e:  # includes UnicodeDecodeError
+        if request.is_json:
+            return jsonify(error=f'Invalid roster: {e}'), 400
+        flash(f'Invalid roster: {e}')
+        return redirect(url_for('spaces.space_detail', space_id=space.id))
+    result = import_roster(space.id, entries)
+    if result.inserted:
+        invalidate_space(space)
+    if request.is_json:
+        return jsonify(inserted=result.inserted, skipped=result.skipped, created_users=result.created_users,
+                       invalid=result.invalid)
+    flash(f'Roster imported: {result.inserted} pupils added, {result.skipped} already enrolled or listed twice'
+          + (f', {len(result.invalid)} rows without a valid email skipped.' if result.invalid else '.'))
+    return redirect(url_for('spaces.space_detail', space_id=space.id))
@@ -4,4 +4,88 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'a-very-secret-key'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///site.db'
     # Add your API key here
-    GEMINI_API_KEY = os.environ.get('GOOGLE_API_KEY')
\ No newline at end of file
+    GEMINI_API_KEY = os.environ.get('GOOGLE_API_KEY')
+    # Uploads are stored content-addressed under UPLOAD_FOLDER/blobs; larger files are rejected
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', str(20 * 1024 * 1024)))
+    # Background grading: worker threads per process (0 disables the in-process pool),
+    # how often idle workers poll for jobs, and when a 'running' job is considered abandoned
+    GRADING_WORKERS = int(os.environ.get('GRADING_WORKERS', '2'))
+    GRADING_POLL_INTERVAL = float(os.environ.get('GRADING_POLL_INTERVAL', '5'))
+    GRADING_STALE_AFTER = int(os.environ.get('GRADING_STALE_AFTER', '600'))
+    GRADING_MAX_ATTEMPTS = int(os.environ.get('GRADING_MAX_ATTEMPTS', '3'))
+    # Seconds a feedback stream waits for new text before telling the browser to reconnect later;
+    # streams only relay what the grading workers write, so keep this short
+    FEEDBACK_STREAM_WAIT = float(os.environ.get('FEEDBACK_STREAM_WAIT', '5'))
+    # Gemini quotas per API key (0 = unlimited) and retries on 429/5xx responses. With
+    # GEMINI_QUOTA_BACKEND 'sqlite' every worker process on the host draws from buckets in one
+    # file (GEMINI_QUOTA_PATH defaults to the instance folder); 'memory' gives each process the
+    # full quota. Several hosts sharing one key should each be given their share of the quota
+    GEMINI_QUOTA_BACKEND = os.environ.get('GEMINI_QUOTA_BACKEND', 'sqlite').lower()
+    GEMINI_QUOTA_PATH = os.environ.get('GEMINI_QUOTA_PATH')
+    GEMINI_REQUESTS_PER_MINUTE = int(os.environ.get('GEMINI_REQUESTS_PER_MINUTE', '60'))
+    GEMINI_TOKENS_PER_MINUTE = int(os.environ.get('GEMINI_TOKENS_PER_MINUTE', '1000000'))
+    GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', '5'))
+    # Cache of Gemini results keyed on input file hashes; entries expire after
+    # LLM_CACHE_TTL seconds and the least recently used are evicted past LLM_CACHE_MAX_ENTRIES
+    LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', str(30 * 24 * 3600)))
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '10000'))
+    # Submission pairs whose estimated similarity reaches this are flagged for review
+    SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD', '0.6'))
+    # Flagged pairs explained by the LLM per assignment, highest scores first (0 = no limit);
+    # the rest are listed with their score only
+    SIMILARITY_MAX_EXPLANATIONS = int(os.environ.get('SIMILARITY_MAX_EXPLANATIONS', '20'))
+    # Outgoing mail is queued in the database and sent by a background sender over one
+    # SMTP connection per batch; without SMTP_SERVER messages are printed instead.
+    # SMTP_STARTTLS=0 and empty credentials allow a plain local test server.
+    SMTP_SERVER = os.environ.get('SMTP_SERVER')
+    SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+    SMTP_USER = os.environ.get('SMTP_USER')
+    SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+    SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+    MAIL_FROM = os.environ.get('MAIL_FROM') or os.environ.get('SMTP_USER')
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', '100'))
+    MAIL_POLL_INTERVAL = float(os.environ.get('MAIL_POLL_INTERVAL', '5'))
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', '5'))
+    # Rows per page on paginated lists such as a space's assignments
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', '20'))
+    # Requests slower than this many seconds are logged with their SQL statements (0 disables);
+    # when METRICS_TOKEN is set, /metrics requires "Authorization: Bearer <token>"
+    SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '0'))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Each worker process writes its metric totals to METRICS_DIR (default: the instance folder)
+    # every METRICS_INTERVAL seconds and /metrics sums them; METRICS_DIR= (empty) reports per process
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_INTERVAL = float(os.environ.get('METRICS_INTERVAL', '5'))
+    # Connection pool per process (shared by request threads, grading workers and the mail sender);
+    # PostgreSQL/MySQL connections are also pre-pinged and recycled after DB_POOL_RECYCLE seconds.
+    # SQLite files use WAL and wait up to SQLITE_BUSY_TIMEOUT ms for the write lock (see database.py)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '15000'))
+    # Model tiers for routing by task and input size (see model_routing.py); inputs above
+    # GEMINI_LARGE_INPUT_TOKENS use the larger tier. GEMINI_HEDGING=1 re-sends calls slower than
+    # their model's p95 to the fast tier (never feedback grading)
+    GEMINI_MODEL_FAST = os.environ.get('GEMINI_MODEL_FAST', 'gemini-2.0-flash-lite')
+    GEMINI_MODEL_STANDARD = os.environ.get('GEMINI_MODEL_STANDARD', 'gemini-2.0-flash')
+    GEMINI_MODEL_QUALITY = os.environ.get('GEMINI_MODEL_QUALITY', 'gemini-2.5-pro')
+    GEMINI_TIMEOUT_FAST = float(os.environ.get('GEMINI_TIMEOUT_FAST', '30'))
+    GEMINI_TIMEOUT_STANDARD = float(os.environ.get('GEMINI_TIMEOUT_STANDARD', '60'))
+    GEMINI_TIMEOUT_QUALITY = float(os.environ.get('GEMINI_TIMEOUT_QUALITY', '180'))
+    GEMINI_LARGE_INPUT_TOKENS = int(os.environ.get('GEMINI_LARGE_INPUT_TOKENS', '8000'))
+    GEMINI_HEDGING = os.environ.get('GEMINI_HEDGING', '0') == '1'
+    # Downloads are authorised by the app and, with DOWNLOAD_OFFLOAD set, then sent by the front
+    # proxy: 'x-accel' (nginx; DOWNLOAD_ACCEL_PREFIX is an internal location aliased to UPLOAD_FOLDER)
+    # or 'x-sendfile' (Apache, lighttpd). Empty sends files from Python (see downloads.py)
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '').lower()
+    DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-uploads/')
+    # Space, assignment and master dashboard pages are cached per user and dropped by the writes
+    # that change them (see page_cache.py). PAGE_CACHE_BACKEND is 'sqlite' (one file shared by all
+    # worker processes on the host; PAGE_CACHE_PATH defaults to the instance folder), 'memory'
+    # (per process: other workers may serve a page up to PAGE_CACHE_TTL seconds old) or empty
+    PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'sqlite').lower()
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', '300'))
+    PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', '5000'))
+    PAGE_CACHE_PATH = os.environ.get('PAGE_CACHE_PATH')
@@ -0,0 +1,103 @@
+"""Read model for the dashboard pages.
+
+Each page is served by a fixed number of queries regardless of how many
+spaces, assignments or pupils are involved: counts come from correlated
+subqueries on indexed columns, and a pupil's own submission and grading job
+are outer-joined onto the assignment rows instead of being loaded one by one.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import joinedload
+
+from models import db, Assignment, GradingJob, Space, SpaceMember, Submission
+
+
+@dataclass
+class SpaceSummary:
+    space: Space
+    assignments: int
+    members: int = 0    # filled in for masters
+    submitted: int = 0  # filled in for pupils: their own submissions in the space
+
+
+@dataclass
+class AssignmentSummary:
+    assignment: Assignment
+    submitted: int = 0  # filled in for masters
+    graded: int = 0
+    submission: Optional[Submission] = None  # filled in for pupils
+    job: Optional[GradingJob] = None
+
+    @property
+    def status(self):
+        """A pupil's status: 'not_submitted', 'pending', 'running', 'done' or 'failed'."""
+        if self.submission is None:
+            return 'not_submitted'
+        return self.job.status if self.job else 'pending'
+
+
+def _assignment_count():
+    return (select(func.count(Assignment.id)).where(Assignment.space_id == Space.id)
+            .correlate(Space).scalar_subquery())
+
+
+def master_spaces(master_id):
+    """The master's spaces with assignment and member counts, in one query."""
+    members = (select(func.count(SpaceMember.id)).where(SpaceMember.space_id == Space.id)
+               .correlate(Space).scalar_subquery())
+    rows = (db.session.query(Space, _assignment_count(), members)
+            .filter(Space.master_id == master_id).order_by(Space.id).all())
+    return [SpaceSummary(space, assignments, members=member_count) for space, assignments, member_count in rows]
+
+
+def pupil_spaces(pupil_id):
+    """Spaces the pupil has joined with assignment counts and how many they submitted, in one query."""
+    submitted = (select(func.count(Submission.id))
+                 .join(Assignment, Assignment.id == Submission.assignment_id)
+                 .where(Assignment.space_id == Space.id, Submission.pupil_id == pupil_id)
+                 .correlate(Space).scalar_subquery())
+    rows = (db.session.query(Space, _assignment_count(), submitted)
+            .join(SpaceMember, SpaceMember.space_id == Space.id)
+            .filter(SpaceMember.user_id == pupil_id).order_by(Space.id).all())
+    return [SpaceSummary(space, assignments, submitted=count) for space, assignments, count in rows]
+
+
+def space_assignments(space_id, page=1, per_page=20, master=False, pupil_id=None):
+    """One page of a space's assignments with per-assignment counts (master) or status (pupil).
+
+    Two queries: the page itself and the total count for the pagination links.
+    Returns the Pagination object with its items replaced by AssignmentSummary rows.
+    """
+    if master:
+        submitted = (select(func.count(Submission.id)).where(Submission.assignment_id == Assignment.id)
+                     .correlate(Assignment).scalar_subquery())
+        graded = (select(func.count(GradingJob.id))
+                  .join(Submission, Submission.id == GradingJob.submission_id)
+                  .where(Submission.assignment_id == Assignment.id, GradingJob.status == 'done')
+                  .correlate(Assignment).scalar_subquery())
+        query = db.session.query(Assignment, submitted, graded)
+    else:
+        query = (db.session.query(Assignment, Submission, GradingJob)
+                 .outerjoin(Submission, and_(Submission.assignment_id == Assignment.id,
+                                             Submission.pupil_id == pupil_id))
+                 .outerjoin(GradingJob, GradingJob.submission_id == Submission.id))
+    pagination = (query.filter(Assignment.space_id == space_id).order_by(Assignment.id)
+                  .paginate(page=page, per_page=per_page, error_out=False))
+    if master:
+        pagination.items = [AssignmentSummary(a, submitted=s, graded=g) for a, s, g in pagination.items]
+    else:
+        pagination.items = [AssignmentSummary(a, submission=s, job=j) for a, s, j in pagination.items]
+    return pagination
+
+
+def assignment_with_submission(assignment_id, pupil_id=None):
+    """The assignment (with its space) and the pupil's submission (with its grading job), or None."""
+    assignment = (Assignment.query.options(joinedload(Assignment.space))
+                  .filter_by(id=assignment_id).first_or_404())
+    submission = None
+    if pupil_id is not None:
+        submission = (Submission.query.options(joinedload(Submission.grading_job))
+                      .filter_by(assignment_id=assignment_id, pupil_id=pupil_id).first())
+    return assignment, submission
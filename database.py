@@ -0,0 +1,49 @@
+"""Engine settings for the configured database.
+
+Server databases (PostgreSQL, MySQL) get a sized connection pool with
+pre-ping and recycling, so connections dropped by the server or a proxy are
+replaced instead of failing a request. SQLite files get WAL journaling, a
+busy timeout and synchronous=NORMAL on every new connection: readers no longer
+block the writer, and a writer waits for the lock instead of failing at once
+with "database is locked" when several server processes commit together.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def engine_options(uri, config):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`, from the DB_* settings in `config`."""
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        if not is_sqlite_file(uri):
+            return {}  # in-memory databases use a single static connection
+        # Connections to a local file never go stale, so no pre-ping or recycling
+        return {'pool_size': config['DB_POOL_SIZE'], 'max_overflow': config['DB_MAX_OVERFLOW'],
+                'pool_timeout': config['DB_POOL_TIMEOUT']}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def apply_sqlite_pragmas(engine, busy_timeout_ms=15000):
+    """Sets WAL, busy_timeout and synchronous=NORMAL on each new connection of a SQLite engine."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+        # Safe with WAL: a power loss can lose the last commits but never corrupts the file
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
@@ -0,0 +1,65 @@
+"""Sending stored uploads to users who may read them.
+
+Views check access and then call send_blob(). With DOWNLOAD_OFFLOAD set, the
+response has no body, only a header naming the file, and the front proxy
+streams it (range requests included), so the worker is free as soon as the
+check is done:
+
+    x-accel     X-Accel-Redirect: <DOWNLOAD_ACCEL_PREFIX><path under UPLOAD_FOLDER>    (nginx)
+    x-sendfile  X-Sendfile: <absolute path>                    (Apache mod_xsendfile, lighttpd)
+
+For nginx the prefix is an internal location aliased to the upload folder,
+which keeps the app's ETag instead of generating its own:
+
+    location /protected-uploads/ {
+        internal;
+        alias /srv/synapseai/uploads/;
+        etag off;
+        add_header ETag $upstream_http_etag;
+    }
+
+Blobs are content-addressed, so the SHA-256 stored with each row is a strong
+ETag: a matching If-None-Match is answered with 304 before the file is
+touched. Without offload the file is sent from Python with Range and If-Range
+support.
+"""
+import os
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.utils import send_file
+
+from metrics import Counter, REGISTRY
+from storage import blob_digest
+
+OFFLOAD_MODES = ('', 'x-accel', 'x-sendfile')
+
+DOWNLOADS = Counter('downloads_total', 'File downloads by how they were answered.', ('mode',))
+REGISTRY.append(DOWNLOADS)
+
+
+def send_blob(path, download_name=None, sha256=None, root=None):
+    """Response for the stored file at `path`; `root` is the upload folder it lives under."""
+    config = current_app.config
+    offload = config['DOWNLOAD_OFFLOAD']
+    etag = sha256 or blob_digest(path)
+    if etag and request.if_none_match.contains(etag):
+        DOWNLOADS.inc(mode='not_modified')
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    # Offloaded responses skip conditional handling: the proxy answers ranges itself
+    response = send_file(os.path.abspath(path), request.environ, download_name=download_name or os.path.basename(path),
+                         etag=etag or True, conditional=not offload, use_x_sendfile=bool(offload),
+                         response_class=current_app.response_class)
+    # Uploads are private to a space; clients may keep them but must revalidate
+    response.cache_control.private = True
+    if offload == 'x-accel':
+        relative = os.path.relpath(path, root or config['UPLOAD_FOLDER']).replace(os.sep, '/')
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = config['DOWNLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + quote(relative)
+    DOWNLOADS.inc(mode=offload or 'direct')
+    return response
@@ -0,0 +1,95 @@
+"""Streaming ZIP export of an assignment's submissions and feedback.
+
+The archive is produced while it is sent: zipfile writes into a sink that
+only ever holds the bytes since the last yield, files are copied in
+CHUNK_SIZE pieces, and submissions are read from the database in batches.
+Memory use therefore does not depend on the size of the files. The only
+state that grows with the class is what the ZIP format requires for its
+closing central directory: zipfile keeps a ZipInfo of about 400 bytes per
+entry. Nothing is written to disk, and the first bytes go out as soon as the
+first entry starts.
+
+Layout: one folder per submission, `<pupil name>-<submission id>/`, holding
+the submitted file under its original name and, once graded, `feedback.txt`.
+"""
+import os
+import zipfile
+from datetime import datetime
+
+from sqlalchemy import select
+from werkzeug.utils import secure_filename
+
+from models import db, GradingJob, Submission, User
+from storage import CHUNK_SIZE
+
+ROWS_PER_BATCH = 200
+# Already compressed formats are stored as they are instead of spending CPU on deflate
+_STORED_EXTENSIONS = {'.pdf', '.zip', '.png', '.jpg', '.jpeg', '.gz'}
+
+
+class _StreamSink:
+    """Write-only file for ZipFile that hands out what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _submission_rows(assignment_id):
+    query = (select(Submission.id, Submission.file_path, Submission.original_filename, Submission.timestamp,
+                    User.name, GradingJob.status, GradingJob.feedback)
+             .join(User, User.id == Submission.pupil_id)
+             .outerjoin(GradingJob, GradingJob.submission_id == Submission.id)
+             .where(Submission.assignment_id == assignment_id)
+             .order_by(Submission.id)
+             .execution_options(yield_per=ROWS_PER_BATCH))
+    return db.session.execute(query)
+
+
+def stream_assignment_zip(assignment_id):
+    """The ZIP archive of every submission of the assignment, as an iterator of byte chunks."""
+    return (chunk for chunk in _zip_chunks(assignment_id) if chunk)
+
+
+def _zip_chunks(assignment_id):
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for row in _submission_rows(assignment_id):
+            folder = f"{secure_filename(row.name) or 'pupil'}-{row.id}"
+            timestamp = (row.timestamp or datetime.utcnow()).timetuple()[:6]
+            name = secure_filename(row.original_filename or '') or os.path.basename(row.file_path)
+            info = zipfile.ZipInfo(f'{folder}/{name}', date_time=timestamp)
+            if os.path.splitext(name)[1].lower() not in _STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            try:
+                source = open(row.file_path, 'rb')
+            except OSError:
+                archive.writestr(zipfile.ZipInfo(f'{folder}/MISSING.txt', date_time=timestamp),
+                                 f'The submitted file {row.original_filename or name} could not be read.\n')
+            else:
+                with source:
+                    # Known up front so zipfile can decide on ZIP64 without seeking back
+                    info.file_size = os.fstat(source.fileno()).st_size
+                    with archive.open(info, 'w') as entry:
+                        yield sink.drain()
+                        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                            entry.write(chunk)
+                            yield sink.drain()
+            if row.status == 'done' and row.feedback:
+                info = zipfile.ZipInfo(f'{folder}/feedback.txt', date_time=timestamp)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, row.feedback)
+            yield sink.drain()
+    # Closing the archive wrote the central directory
+    yield sink.drain()
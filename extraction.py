@@ -0,0 +1,113 @@
+"""Text extraction for uploaded submissions and solutions.
+
+Runs once per stored file, lazily on first use by a grading worker, and
+writes the result next to the blob as `<digest>.extract.json`, so the LLM layer
+can send compact text instead of raw PDF bytes on every call. PDF pages with
+little or no extractable text (scans, photos of handwriting) are collected
+into a small `<digest>.pages.pdf` that is still sent as a document.
+"""
+import json
+import os
+import re
+import threading
+import unicodedata
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # extraction is an optimisation; without pypdf raw PDFs are sent as before
+    PdfReader = PdfWriter = None
+
+EXTRACT_VERSION = 1
+# Pages with less extracted text than this are treated as image pages
+MIN_PAGE_CHARS = 200
+SOURCE_EXTENSIONS = {'.py': 'python', '.txt': None}
+
+
+def sidecar_path(file_path):
+    return os.path.splitext(file_path)[0] + '.extract.json'
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKC', text or '').replace('\x00', '')
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+
+def normalize_source(text):
+    # Indentation is meaningful in code, so only line endings and trailing spaces are touched
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+
+def _tmp_name(path):
+    # Grading worker threads may extract the same solution at once, so the name is per thread
+    return f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+
+
+def _write_json_atomic(path, data):
+    tmp = _tmp_name(path)
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _extract_pdf(file_path):
+    reader = PdfReader(file_path)
+    pages = [normalize_text(page.extract_text()) for page in reader.pages]
+    image_pages = [i for i, text in enumerate(pages) if len(text) < MIN_PAGE_CHARS]
+    image_pdf = None
+    if image_pages and len(image_pages) < len(pages):
+        image_pdf = os.path.splitext(file_path)[0] + '.pages.pdf'
+        writer = PdfWriter()
+        for i in image_pages:
+            writer.add_page(reader.pages[i])
+        tmp = _tmp_name(image_pdf)
+        with open(tmp, 'wb') as f:
+            writer.write(f)
+        os.replace(tmp, image_pdf)
+    elif image_pages:
+        # Nothing but scans: the original file is the smallest faithful input
+        image_pdf = file_path
+    return {'kind': 'pdf', 'pages': pages, 'image_pages': image_pages, 'image_pdf': image_pdf}
+
+
+def ingest(file_path):
+    """Extracts a stored file once and returns the extraction, or None if unsupported or failed."""
+    path = sidecar_path(file_path)
+    if os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == EXTRACT_VERSION:
+                return data
+        except (OSError, ValueError):
+            pass
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if ext in SOURCE_EXTENSIONS:
+            with open(file_path, encoding='utf-8', errors='replace') as f:
+                data = {'kind': 'source', 'language': SOURCE_EXTENSIONS[ext], 'text': normalize_source(f.read())}
+        elif ext == '.pdf' and PdfReader is not None:
+            data = _extract_pdf(file_path)
+        else:
+            return None
+    except Exception as e:
+        print(f"Error extracting {file_path}: {e}")
+        return None
+    data['version'] = EXTRACT_VERSION
+    try:
+        _write_json_atomic(path, data)
+    except OSError as e:
+        print(f"Error caching extraction for {file_path}: {e}")
+    return data
+
+
+def extracted_text(file_path):
+    """Plain text of a stored file (pages joined), or '' if nothing could be extracted."""
+    data = ingest(file_path)
+    if not data:
+        return ''
+    if data['kind'] == 'source':
+        return data['text']
+    return '\n\n'.join(data['pages'])
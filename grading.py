@@ -0,0 +1,385 @@
+"""Background grading of pupil submissions.
+
+Each submission gets a GradingJob row. A pool of worker threads claims pending
+jobs from the database, asks Gemini for feedback and stores the result, so the
+submit request only has to commit two rows and return. Because the queue lives
+in the database, a crashed or restarted process simply picks up where it left
+off.
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import selectinload
+
+from models import db, Assignment, GradingJob, SimilarityFlag, Submission
+from page_cache import invalidate_assignment, invalidate_submission
+from similarity import index_submission
+
+_wakeup = threading.Event()
+
+
+def enqueue_grading(submission):
+    """Queues a submission for grading and commits it together with the job."""
+    job = GradingJob(submission=submission, status='pending')
+    db.session.add(job)
+    db.session.commit()
+    _wakeup.set()
+    invalidate_submission(submission, progress=True)
+    return job
+
+
+def claim_job(job_id, worker_id):
+    """Atomically moves a pending job to 'running'; returns False if someone else has it."""
+    claimed = GradingJob.query.filter_by(id=job_id, status='pending').update(
+        {'status': 'running', 'worker_id': worker_id, 'started_at': datetime.utcnow(),
+         'attempts': GradingJob.attempts + 1},
+        synchronize_session=False)
+    db.session.commit()
+    if claimed:
+        invalidate_submission(db.session.get(GradingJob, job_id).submission)
+    return bool(claimed)
+
+
+def _update_owned(job, worker_id, values):
+    """Updates a job only while `worker_id` is still running it; returns False if the job was taken away."""
+    updated = GradingJob.query.filter_by(id=job.id, worker_id=worker_id, status='running').update(
+        values, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+
+def heartbeat(job, worker_id):
+    """Marks a running job as alive so it is not requeued as stale; returns False if it was taken away."""
+    return _update_owned(job, worker_id, {'started_at': datetime.utcnow()})
+
+
+def release_job(job, worker_id, error=None, delay=0):
+    """Hands a claimed job back to the queue, optionally not before `delay` seconds.
+
+    Does nothing and returns False if the job is no longer `worker_id`'s.
+    """
+    released = _update_owned(job, worker_id, {
+        'status': 'pending', 'error': error,
+        'feedback': None,  # drops partial text written while it ran
+        'worker_id': None,
+        'available_at': datetime.utcnow() + timedelta(seconds=delay) if delay else None})
+    if not released:
+        print(f"Grading job {job.id} was taken over by another worker; not releasing it")
+        return False
+    _wakeup.set()
+    invalidate_submission(job.submission)
+    return True
+
+
+def finish_job(job, worker_id, feedback=None, error=None):
+    """Stores a job's outcome; the outcome is dropped, returning False, if the job is no longer `worker_id`'s."""
+    finished = _update_owned(job, worker_id, {
+        'status': 'failed' if error else 'done', 'feedback': feedback, 'error': error,
+        'finished_at': datetime.utcnow()})
+    if not finished:
+        print(f"Grading job {job.id} was taken over by another worker; dropping this result")
+        return False
+    # Only a graded job changes the master's counts; a failed one only shows on the pupil's pages
+    invalidate_submission(job.submission, progress=not error)
+    return True
+
+
+def index_for_similarity(submission, threshold):
+    """Adds a submission to the near-duplicate index; failures never block grading."""
+    try:
+        flags = index_submission(submission, threshold=threshold)
+    except Exception as e:
+        print(f"Error indexing submission {submission.id} for similarity: {e}")
+        db.session.rollback()
+        return
+    if flags:
+        print(f"Submission {submission.id} flagged as similar to {[f.other_submission_id for f in flags]}")
+        _wakeup.set()
+
+
+def stream_feedback_events(submission_id, offset=0, wait_timeout=5, poll_interval=0.5):
+    """Yields (event, data) pairs for a Server-Sent Events feedback stream.
+
+    Only relays what the background workers write: the text a worker has
+    stored so far for the job (from character `offset` on, so a reconnecting
+    client resumes where it stopped), then new text as it appears. The job is
+    never claimed here. If it is not finished within `wait_timeout` seconds a
+    'pending' event ends the stream and the client reconnects later.
+    """
+    # Loaded here rather than passed in: the generator outlives the view's session
+    submission = db.session.get(Submission, submission_id)
+    job = submission.grading_job
+    if job is None:
+        job = enqueue_grading(submission)
+    deadline = time.monotonic() + wait_timeout
+    while True:
+        if job.status == 'failed':
+            yield 'error', {'error': job.error}
+            return
+        text = (job.feedback or '') if job.status in ('running', 'done') else ''
+        if offset > len(text):
+            # The job was handed back and restarted; what the client has is no longer valid
+            yield 'reset', {'offset': 0}
+            offset = 0
+        if len(text) > offset:
+            yield 'chunk', {'text': text[offset:], 'offset': len(text)}
+            offset = len(text)
+        if job.status == 'done':
+            yield 'done', {'status': job.status}
+            return
+        if time.monotonic() > deadline:
+            yield 'pending', {'status': job.status, 'offset': offset}
+            return
+        time.sleep(poll_interval)
+        db.session.refresh(job)
+
+
+def _reset(job):
+    job.status = 'pending'
+    job.feedback = None
+    job.error = None
+    job.attempts = 0
+    job.worker_id = None
+    job.available_at = None
+    job.finished_at = None
+
+
+def grade_assignment(assignment_id, regrade=False):
+    """Queues every submission of an assignment for grading.
+
+    Submissions that are already queued, running or graded are left alone (unless
+    `regrade` is set for graded ones), so calling this again after a crash only
+    fills in the gaps. Failed jobs are retried. Returns queued/skipped counts.
+    """
+    submissions = (Submission.query.filter_by(assignment_id=assignment_id)
+                   .options(selectinload(Submission.grading_job)).all())
+    queued = skipped = 0
+    for submission in submissions:
+        job = submission.grading_job
+        if job is None:
+            db.session.add(GradingJob(submission=submission, status='pending'))
+        elif job.status == 'failed' or (regrade and job.status == 'done'):
+            _reset(job)
+        else:
+            skipped += 1
+            continue
+        queued += 1
+    db.session.commit()
+    _wakeup.set()
+    if queued:
+        invalidate_assignment(db.session.get(Assignment, assignment_id))
+    return {'queued': queued, 'skipped': skipped}
+
+
+def assignment_grading_progress(assignment_id):
+    """Returns the number of grading jobs per status for an assignment."""
+    rows = (db.session.query(GradingJob.status, func.count(GradingJob.id))
+            .join(Submission, GradingJob.submission_id == Submission.id)
+            .filter(Submission.assignment_id == assignment_id)
+            .group_by(GradingJob.status).all())
+    progress = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+    progress.update(dict(rows))
+    return progress
+
+
+class _JobLost(Exception):
+    """The job being processed was requeued as stale and may now belong to another worker."""
+
+
+class GradingWorkerPool:
+    def __init__(self, app, workers=2, poll_interval=5.0, stale_after=600, max_attempts=3, partial_interval=1.0):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        # How often text generated so far is written to the job for feedback streams to relay
+        self.partial_interval = partial_interval
+        self._threads = []
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+        self._started_pid = None
+
+    def ensure_started(self):
+        """Starts the worker threads once per process (safe to call on every request)."""
+        if self._started_pid == os.getpid() or self.workers <= 0:
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._stopped.clear()
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'grading-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._started_pid = os.getpid()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        _wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._started_pid = None
+
+    def run_forever(self):
+        """Runs the pool in the foreground, e.g. from a dedicated worker process."""
+        self.ensure_started()
+        try:
+            while not self._stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def _run(self):
+        worker_id = f'{os.getpid()}-{threading.current_thread().name}-{uuid.uuid4().hex[:6]}'
+        with self.app.app_context():
+            while not self._stopped.is_set():
+                try:
+                    job_id = self._claim(worker_id)
+                    if job_id is None:
+                        # Explaining flagged pairs is lower priority than grading
+                        if self._explain_next_flag():
+                            continue
+                        _wakeup.wait(self.poll_interval)
+                        _wakeup.clear()
+                        continue
+                    self._process(job_id, worker_id)
+                except Exception as e:
+                    print(f"Grading worker {worker_id} error: {e}")
+                    db.session.rollback()
+                    self._stopped.wait(self.poll_interval)
+                finally:
+                    db.session.remove()
+
+    def _requeue_stale(self):
+        """Requeues jobs whose worker stopped sending heartbeats; a job that used all its attempts fails.
+
+        Running workers refresh started_at with every stored chunk of text and
+        before every retry, so only a dead or stuck worker's job goes stale.
+        """
+        now = datetime.utcnow()
+        stale = GradingJob.query.filter(GradingJob.status == 'running',
+                                        GradingJob.started_at < now - timedelta(seconds=self.stale_after))
+        submissions = [job.submission for job in stale.options(selectinload(GradingJob.submission))]
+        if not submissions:
+            return
+        # A job that kills its worker on every attempt would otherwise be requeued forever
+        stale.filter(GradingJob.attempts >= self.max_attempts).update(
+            {'status': 'failed', 'worker_id': None, 'feedback': None, 'finished_at': now,
+             'error': f'Abandoned by its worker on all {self.max_attempts} attempts.'},
+            synchronize_session=False)
+        stale.update({'status': 'pending', 'worker_id': None, 'feedback': None}, synchronize_session=False)
+        db.session.commit()
+        for submission in submissions:
+            invalidate_submission(submission)
+
+    def _claim(self, worker_id):
+        """Atomically moves the oldest runnable pending job to 'running' and returns its id."""
+        self._requeue_stale()
+        while True:
+            now = datetime.utcnow()
+            job = (GradingJob.query.filter_by(status='pending')
+                   .filter(or_(GradingJob.available_at.is_(None), GradingJob.available_at <= now))
+                   .order_by(GradingJob.id).first())
+            if job is None:
+                return None
+            if claim_job(job.id, worker_id):
+                return job.id
+
+    def _process(self, job_id, worker_id):
+        # Imported here so that importing this module (and booting the app) does not load the Gemini SDK
+        from llm_service import is_retryable, retry_listener
+
+        job = db.session.get(GradingJob, job_id)
+        submission = job.submission
+        index_for_similarity(submission, self.app.config['SIMILARITY_THRESHOLD'])
+        assignment = submission.assignment
+        if not assignment.solution_file_path:
+            finish_job(job, worker_id, error='Assignment has no solution file to grade against.')
+            return
+        attempts = job.attempts
+        listener = retry_listener.set(lambda attempt, error: self._beat(job, worker_id))
+        try:
+            service = self._service()
+            feedback = self._generate_feedback(job, worker_id, service.stream_assignment_feedback(
+                student_submission_pdf_path=submission.file_path,
+                professor_solution_pdf_path=assignment.solution_file_path,
+                course_name=assignment.space.name,
+            ))
+        except Exception as e:
+            # The service wraps errors raised inside the stream, including a lost heartbeat during a retry
+            if isinstance(e, _JobLost) or isinstance(e.__cause__, _JobLost):
+                print(f"Grading job {job_id} was taken over by another worker; stopped generating")
+                return
+            print(f"Error grading submission {submission.id}: {e}")
+            if is_retryable(e) and attempts < self.max_attempts:
+                # The service already backed off within the call; wait longer before the next attempt
+                release_job(job, worker_id, error=str(e), delay=60 * 2 ** (attempts - 1))
+            else:
+                finish_job(job, worker_id, error=str(e))
+            return
+        finally:
+            retry_listener.reset(listener)
+        finish_job(job, worker_id, feedback=feedback)
+
+    def _beat(self, job, worker_id):
+        if not heartbeat(job, worker_id):
+            raise _JobLost()
+
+    def _service(self):
+        # services imports this module, so the app's Services are looked up here
+        from services import get_services
+        return get_services(self.app).gemini()
+
+    def _generate_feedback(self, job, worker_id, chunks):
+        """Joins the streamed feedback, storing the text so far on the job for open feedback streams.
+
+        Each store is also the job's heartbeat; if another worker has taken the
+        job over, generation stops with _JobLost.
+        """
+        text = ''
+        stored_at = time.monotonic()
+        for chunk in chunks:
+            text += chunk
+            if time.monotonic() - stored_at >= self.partial_interval:
+                if not _update_owned(job, worker_id, {'feedback': text, 'started_at': datetime.utcnow()}):
+                    raise _JobLost()
+                stored_at = time.monotonic()
+        return text
+
+    def _explain_next_flag(self):
+        """Asks the LLM to explain one flagged pair, closest first; returns False when there is none."""
+        flag = (SimilarityFlag.query.filter_by(status='pending')
+                .order_by(SimilarityFlag.score.desc(), SimilarityFlag.id).first())
+        if flag is None:
+            return False
+        cap = self.app.config['SIMILARITY_MAX_EXPLANATIONS']
+        if cap and SimilarityFlag.query.filter(
+                SimilarityFlag.assignment_id == flag.assignment_id,
+                SimilarityFlag.status.in_(('running', 'done', 'failed'))).count() >= cap:
+            SimilarityFlag.query.filter_by(assignment_id=flag.assignment_id, status='pending').update(
+                {'status': 'skipped'}, synchronize_session=False)
+            db.session.commit()
+            return True
+        claimed = SimilarityFlag.query.filter_by(id=flag.id, status='pending').update(
+            {'status': 'running'}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return True
+        db.session.refresh(flag)
+        try:
+            service = self._service()
+            flag.explanation = service.explain_similarity(flag.submission.file_path,
+                                                          flag.other_submission.file_path, flag.score)
+            flag.status = 'done'
+        except Exception as e:
+            print(f"Error explaining similarity flag {flag.id}: {e}")
+            flag.explanation = str(e)
+            flag.status = 'failed'
+        db.session.commit()
+        return True
@@ -0,0 +1,38 @@
+"""gunicorn settings, picked up from the working directory: `gunicorn` or `gunicorn -c gunicorn.conf.py`.
+
+The app is built and warmed once in the master (see app.warm_up) and workers
+fork from it, so a new or restarted worker serves its first request without
+importing the Gemini SDK or compiling templates again. Each worker still opens
+its own database connections and starts its own grading and mail threads.
+
+Workers are threaded (gthread). The default sync worker serves one request
+at a time and is killed after `timeout` seconds on a single request, which
+would cut off feedback streams and large ZIP exports part way through. With
+gthread, `timeout` only bounds how long a worker's main loop may go silent, so
+a slow response occupies one thread rather than the whole worker. Keep
+WEB_THREADS plus GRADING_WORKERS plus one below DB_POOL_SIZE + DB_MAX_OVERFLOW.
+"""
+import os
+
+wsgi_app = 'app:create_app()'
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', '8'))
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+# Idle keep-alive connections hold a thread, so they are closed quickly
+keepalive = 5
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is built and before any worker forks
+    if server.cfg.preload_app:
+        from app import warm_up
+        warm_up(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app import after_fork
+        after_fork(server.app.wsgi())
@@ -0,0 +1,153 @@
+"""Persistent cache for Gemini results.
+
+Keys are derived from the content of the inputs (SHA-256 of each file) plus the
+task, model name and prompt text, so re-submitting the same file or re-running
+a check never reaches the model twice, while changing the prompt or model
+naturally produces new keys.
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from models import db, LLMCacheEntry
+from storage import blob_digest
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_cache_key(kind, model_name, prompt, file_digests):
+    h = hashlib.sha256()
+    for part in (kind, model_name, hashlib.sha256(prompt.encode('utf-8')).hexdigest(), *file_digests):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, ttl=30 * 24 * 3600, max_entries=10000, touch_interval=30):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Hit counts and last-use times are batched and written by a background thread on its own
+        # connection, so a cache read never commits the caller's session or waits for the write lock
+        self.touch_interval = touch_interval
+        self._touches = {}  # key -> [hits, last used]
+        self._touched_at = time.monotonic()
+        self._flushing = False
+
+    def key_for(self, kind, model_name, prompt, file_paths):
+        # Content-addressed uploads carry their digest in the path, so only legacy files are re-read
+        return make_cache_key(kind, model_name, prompt, [blob_digest(p) or file_sha256(p) for p in file_paths])
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """Returns the cached result for `key`, or None on a miss or expired entry."""
+        with db.session.no_autoflush:
+            entry = db.session.execute(select(LLMCacheEntry.result, LLMCacheEntry.created_at)
+                                       .where(LLMCacheEntry.key == key)).first()
+        now = datetime.utcnow()
+        if entry is None or (self.ttl and entry.created_at < now - timedelta(seconds=self.ttl)):
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        with self._lock:
+            touch = self._touches.setdefault(key, [0, now])
+            touch[0] += 1
+            touch[1] = now
+            due = not self._flushing and time.monotonic() - self._touched_at >= self.touch_interval
+            if due:
+                self._flushing = True
+        if due:
+            threading.Thread(target=self._flush_in_background, args=(db.engine,), daemon=True).start()
+        return entry.result
+
+    def _flush_in_background(self, engine):
+        try:
+            self.flush_touches(engine)
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def flush_touches(self, engine=None):
+        """Writes the batched hit counts and last-use times in one short transaction of their own."""
+        with self._lock:
+            touches, self._touches = self._touches, {}
+            self._touched_at = time.monotonic()
+        if not touches:
+            return
+        try:
+            with (engine or db.engine).begin() as conn:
+                for key, (hits, last_used) in touches.items():
+                    conn.execute(update(LLMCacheEntry).where(LLMCacheEntry.key == key).values(
+                        hit_count=func.coalesce(LLMCacheEntry.hit_count, 0) + hits, last_used_at=last_used))
+        except SQLAlchemyError as e:
+            print(f'LLM cache: could not record hits, will retry: {e}')
+            with self._lock:
+                for key, (hits, last_used) in touches.items():
+                    touch = self._touches.setdefault(key, [0, last_used])
+                    touch[0] += hits
+                    touch[1] = max(touch[1], last_used)
+
+    def put(self, key, kind, model_name, result):
+        entry = db.session.get(LLMCacheEntry, key)
+        now = datetime.utcnow()
+        if entry is None:
+            entry = LLMCacheEntry(key=key, kind=kind, model=model_name, hit_count=0)
+            db.session.add(entry)
+        entry.result = result
+        entry.created_at = now
+        entry.last_used_at = now
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same result first
+            db.session.rollback()
+            return
+        self.evict()
+
+    def evict(self):
+        """Drops expired entries, then the least recently used ones beyond max_entries."""
+        self.flush_touches()
+        if self.ttl:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+            LLMCacheEntry.query.filter(LLMCacheEntry.created_at < cutoff).delete(synchronize_session=False)
+        if self.max_entries:
+            excess = LLMCacheEntry.query.count() - self.max_entries
+            if excess > 0:
+                oldest = db.session.query(LLMCacheEntry.key).order_by(LLMCacheEntry.last_used_at).limit(excess)
+                LLMCacheEntry.query.filter(LLMCacheEntry.key.in_(oldest.scalar_subquery())).delete(
+                    synchronize_session=False)
+        db.session.commit()
+
+    def stats(self):
+        """Hit/miss counters for this process plus totals stored in the database."""
+        self.flush_touches()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        entries, saved_calls = db.session.query(func.count(LLMCacheEntry.key),
+                                                func.coalesce(func.sum(LLMCacheEntry.hit_count), 0)).one()
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': entries,
+            'saved_calls': int(saved_calls),
+        }
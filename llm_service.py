@@ -1,14 +1,254 @@
 from google import genai
+from google.genai import errors as genai_errors
 from google.genai import types
 import base64
+import contextvars
 import mimetypes
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import os
+import random
+import threading
+import time
+
+import httpx
+
+from extraction import ingest
+from model_routing import ModelRouter
+from metrics import llm_operation, record_llm_usage
+from rate_limit import RateLimiter
+
+# Rough token estimate for a file part when budgeting against the tokens-per-minute quota;
+# the bucket is corrected with the real usage once the response arrives
+ESTIMATED_FILE_PART_TOKENS = 2000
+
+# Optional callable(attempt, error) run before each retry's backoff sleep; the grading workers
+# set it to refresh their job's heartbeat while a call is retried
+retry_listener = contextvars.ContextVar('llm_retry_listener', default=None)
+
+SAFETY_SETTINGS = [
+    types.SafetySetting(category=category, threshold='BLOCK_NONE')
+    for category in ('HARM_CATEGORY_HARASSMENT', 'HARM_CATEGORY_HATE_SPEECH',
+                     'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'HARM_CATEGORY_DANGEROUS_CONTENT')
+]
+
+
+class LLMError(Exception):
+    """Raised when a Gemini call fails; `retryable` marks quota and server-side errors."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def is_retryable(error):
+    if isinstance(error, LLMError):
+        return error.retryable
+    if isinstance(error, genai_errors.APIError):
+        return error.code == 429 or (error.code or 0) >= 500
+    # Per-call timeouts surface as httpx timeouts from the SDK's transport
+    return isinstance(error, (ConnectionError, TimeoutError, httpx.TimeoutException))
+
+
+class SolutionArtifactCache:
+    """Uploads each solution file once and reuses the returned handle until it expires.
+
+    `upload` is a callable `(file_path, mime_type) -> handle` where the handle has a
+    `uri` and optionally an `expiration_time`; the Gemini Files API client in
+    production, or any local stand-in. Entries are keyed on the file's path, size
+    and mtime, so a replaced solution is uploaded again automatically.
+    """
+
+    def __init__(self, upload, ttl=47 * 3600, safety_margin=600):
+        self._upload = upload
+        self.ttl = ttl
+        self.safety_margin = safety_margin
+        self._entries = {}  # abs path -> (fingerprint, part, expires_at)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(file_path):
+        st = os.stat(file_path)
+        return st.st_size, st.st_mtime_ns
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_part(self, file_path, mime_type):
+        key = os.path.abspath(file_path)
+        fingerprint = self._fingerprint(file_path)
+        # Serialise per file so concurrent graders of one assignment share a single upload
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry and entry[0] == fingerprint and entry[2] > time.time() + self.safety_margin:
+                return entry[1]
+            handle = self._upload(file_path, mime_type)
+            part = types.Part.from_uri(file_uri=handle.uri, mime_type=mime_type)
+            expiration = getattr(handle, 'expiration_time', None)
+            expires_at = expiration.timestamp() if expiration else time.time() + self.ttl
+            self._entries[key] = (fingerprint, part, expires_at)
+            return part
+
+    def invalidate(self, file_path):
+        with self._lock:
+            self._entries.pop(os.path.abspath(file_path), None)
+
 
 class GeminiService:
-    def __init__(self, api_key):
-        # API key is now passed directly to the Client constructor
-        self.client = genai.Client(api_key=api_key) # <- Changed initialization
-        self.model = self.client.models.get('gemini-pro-vision') # Or 'gemini-1.5-flash' etc.
+    def __init__(self, api_key, cache=None, limiter=None, max_retries=5, backoff_base=1.0, backoff_max=60.0,
+                 summary_batch_tokens=30000, summary_concurrency=4, client=None, router=None):
+        # The client is thread-safe, so one service is shared by all grading threads of a process.
+        # Any object with the same `models` and `files` methods can be passed as `client` (e.g. an
+        # offline stub); otherwise a genai.Client is created on the first call
+        self.api_key = api_key
+        self._client = client
+        self._client_lock = threading.Lock()
+        # The router picks a model per task and input size (see model_routing.py); without one
+        # every call goes to a single model, as before
+        self.router = router or ModelRouter.single('gemini-pro-vision')
+        self.model_name = self.router.tiers['standard'].model
+        self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='gemini-call')
+        # Optional llm_cache.ResultCache; identical inputs are then answered without a model call
+        self.cache = cache
+        self.solution_cache = SolutionArtifactCache(self._upload_file)
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Class summaries are split into map/reduce batches of at most this many estimated tokens
+        self.summary_batch_tokens = summary_batch_tokens
+        self.summary_concurrency = summary_concurrency
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    @staticmethod
+    def _estimate_tokens(contents):
+        if isinstance(contents, str):
+            contents = [contents]
+        return sum(len(c) // 4 if isinstance(c, str) else ESTIMATED_FILE_PART_TOKENS for c in contents)
+
+    @staticmethod
+    def _with_timeout(config, timeout):
+        http_options = types.HttpOptions(timeout=int(timeout * 1000))
+        if config is None:
+            return types.GenerateContentConfig(http_options=http_options)
+        return config.model_copy(update={'http_options': http_options})
+
+    def _call(self, tier, contents, config, estimated):
+        """One model call on `tier` within the rate limits and the tier's timeout."""
+        self.limiter.acquire(estimated)
+        start = time.monotonic()
+        try:
+            response = self.client.models.generate_content(model=tier.model, contents=contents,
+                                                           config=self._with_timeout(config, tier.timeout))
+        except Exception:
+            self.router.observe(tier, time.monotonic() - start, ok=False)
+            raise
+        self.router.observe(tier, time.monotonic() - start, ok=True)
+        usage = getattr(response, 'usage_metadata', None)
+        record_llm_usage(usage)
+        if usage and usage.total_token_count:
+            self.limiter.settle(estimated, usage.total_token_count)
+        return response
+
+    def _call_hedged(self, route, contents, config, estimated):
+        """Calls the routed tier; if it is slower than its p95, also asks the hedge tier and takes the first answer.
+
+        The slower request cannot be cancelled and finishes in the background; its result is discarded.
+        """
+        delay = self.router.hedge_delay(route.tier) if route.hedge else None
+        if delay is None:
+            return self._call(route.tier, contents, config, estimated)
+        # Calls run in copies of this context so metrics stay attributed to the calling operation
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, self._call,
+                                          route.tier, contents, config, estimated)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        hedge = self._hedge_pool.submit(contextvars.copy_context().run, self._call,
+                                        route.hedge, contents, config, estimated)
+        pending, error = {primary: route.tier, hedge: route.hedge}, None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tier = pending.pop(future)
+                if future.exception() is None:
+                    self.router.record_hedge(route, winner=tier.name)
+                    return future.result()
+                error = future.exception()
+        self.router.record_hedge(route, winner='none')
+        raise error
+
+    def _generate(self, contents, config=None, task='other'):
+        """Calls the routed model within the rate limits, retrying 429/5xx and timeouts with exponential backoff."""
+        estimated = self._estimate_tokens(contents)
+        route = self.router.route(task, estimated)
+        attempt = 0
+        while True:
+            try:
+                return self._call_hedged(route, contents, config, estimated)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                self._backoff(attempt, e)
+                attempt += 1
+
+    def _generate_stream(self, contents, config=None, task='other'):
+        """Streaming variant of _generate that yields text chunks as they arrive.
+
+        Retries only happen before the first chunk; once text has been yielded an
+        error is raised to the caller. Streams are routed but never hedged.
+        """
+        estimated = self._estimate_tokens(contents)
+        tier = self.router.route(task, estimated).tier
+        attempt = 0
+        while True:
+            self.limiter.acquire(estimated)
+            started = False
+            usage = None
+            start = time.monotonic()
+            try:
+                for chunk in self.client.models.generate_content_stream(
+                        model=tier.model, contents=contents, config=self._with_timeout(config, tier.timeout)):
+                    usage = getattr(chunk, 'usage_metadata', None) or usage
+                    if chunk.text:
+                        started = True
+                        yield chunk.text
+            except Exception as e:
+                self.router.observe(tier, time.monotonic() - start, ok=False)
+                if started or not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                self._backoff(attempt, e)
+                attempt += 1
+                continue
+            self.router.observe(tier, time.monotonic() - start, ok=True)
+            record_llm_usage(usage)
+            if usage and usage.total_token_count:
+                self.limiter.settle(estimated, usage.total_token_count)
+            return
+
+    def _backoff(self, attempt, error):
+        listener = retry_listener.get()
+        if listener is not None:
+            listener(attempt, error)
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+        print(f"Gemini call failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    def _upload_file(self, file_path, mime_type):
+        return self.client.files.upload(file=file_path, config=types.UploadFileConfig(mime_type=mime_type))
+
+    def _cache_key(self, kind, prompt, file_paths):
+        if self.cache is None:
+            return None
+        return self.cache.key_for(kind, self.router.signature, prompt, file_paths)
 
     def _prepare_pdf_part(self, file_path):
         """Prepares a PDF file as a Google Generative AI Part object."""
@@ -20,18 +260,51 @@ class GeminiService:
             with open(file_path, 'rb') as f:
                 file_bytes = f.read()
 
-            # Direct instantiation with keyword arguments for types.Part
-            return types.Part(data=file_bytes, mime_type=mime_type) # <- Changed Part creation
+            return types.Part.from_bytes(data=file_bytes, mime_type=mime_type)
         except Exception as e:
             print(f"Error preparing PDF part: {e}")
             raise
 
-    def get_assignment_feedback(self, student_submission_pdf_path, professor_solution_pdf_path, course_name=""):
-        """
-        Generates feedback for a student's assignment.
-        Assumes PDF paths are accessible locally on the server.
+    def _prepare_solution_part(self, file_path):
+        """Returns a reference to the uploaded solution, falling back to inline bytes."""
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if not mime_type or not mime_type.startswith('application/pdf'):
+            raise ValueError(f"File {file_path} is not a PDF or MIME type is unknown.")
+        try:
+            return self.solution_cache.get_part(file_path, mime_type)
+        except Exception as e:
+            print(f"Error uploading solution file, sending it inline: {e}")
+            return self._prepare_pdf_part(file_path)
+
+    def _prepare_document_parts(self, file_path, label, upload=False):
+        """Parts for one input document: its extracted text, plus a PDF of any scanned pages.
+
+        Files that could not be extracted are sent as the raw PDF, as before. With
+        `upload`, PDF parts go through the Files API cache (used for solutions, which
+        every submission of an assignment shares).
         """
-        prompt = f"""
+        prepare_pdf = self._prepare_solution_part if upload else self._prepare_pdf_part
+        data = ingest(file_path)
+        if data is None:
+            return [f"{label}: the attached PDF.", prepare_pdf(file_path)]
+        if data['kind'] == 'source':
+            return [f"{label} (source file):\n```{data['language'] or ''}\n{data['text']}\n```"]
+        image_pages = set(data['image_pages'])
+        sections = [f"{label} (text extracted from a {len(data['pages'])}-page PDF):"]
+        for i, text in enumerate(data['pages']):
+            if i in image_pages:
+                sections.append(f"--- Page {i + 1}: scanned, see the attached PDF ---")
+            else:
+                sections.append(f"--- Page {i + 1} ---\n{text}")
+        parts = ['\n'.join(sections)]
+        if data['image_pdf']:
+            pages = ', '.join(str(i + 1) for i in sorted(image_pages))
+            parts += [f"{label}, scanned pages {pages}:", prepare_pdf(data['image_pdf'])]
+        return parts
+
+    @staticmethod
+    def _feedback_prompt(course_name):
+        return f"""
         You are an AI teaching assistant for the course {course_name}.
         Your task is to compare a student's submitted assignment with the provided correct solution.
         Please provide detailed feedback to the student based on the comparison.
@@ -45,35 +318,71 @@ class GeminiService:
 
         ---
         **Input:**
-        Student Submission: [First PDF provided]
-        Correct Solution: [Second PDF provided]
+        Student Submission: [provided below, labelled "Student Submission"]
+        Correct Solution: [provided below, labelled "Correct Solution"]
         ---
         **Feedback Report:**
         """
+
+    def _feedback_contents(self, prompt, student_submission_pdf_path, professor_solution_pdf_path):
+        return [
+            prompt,
+            *self._prepare_document_parts(student_submission_pdf_path, 'Student Submission'),
+            *self._prepare_document_parts(professor_solution_pdf_path, 'Correct Solution', upload=True),
+        ]
+
+    @llm_operation('feedback')
+    def get_assignment_feedback(self, student_submission_pdf_path, professor_solution_pdf_path, course_name=""):
+        """
+        Generates feedback for a student's assignment.
+        Assumes PDF paths are accessible locally on the server.
+        """
+        prompt = self._feedback_prompt(course_name)
         try:
-            student_pdf_part = self._prepare_pdf_part(student_submission_pdf_path)
-            solution_pdf_part = self._prepare_pdf_part(professor_solution_pdf_path)
-
-            contents = [
-                prompt,
-                student_pdf_part,
-                solution_pdf_part
-            ]
-
-            response = self.model.generate_content(
-                contents,
-                safety_settings={
-                    "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
-                    "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
-                    "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
-                    "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
-                }
-            )
+            cache_key = self._cache_key('feedback', prompt, [student_submission_pdf_path, professor_solution_pdf_path])
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+            contents = self._feedback_contents(prompt, student_submission_pdf_path, professor_solution_pdf_path)
+            response = self._generate(contents, config=types.GenerateContentConfig(safety_settings=SAFETY_SETTINGS),
+                                      task='feedback')
+            if cache_key:
+                self.cache.put(cache_key, 'feedback', self.model_name, response.text)
             return response.text
         except Exception as e:
             print(f"Error generating assignment feedback: {e}")
-            return f"An error occurred while generating feedback: {e}"
+            raise LLMError(f"An error occurred while generating feedback: {e}", retryable=is_retryable(e)) from e
 
+    @llm_operation('feedback_stream')
+    def stream_assignment_feedback(self, student_submission_pdf_path, professor_solution_pdf_path, course_name=""):
+        """
+        Same as get_assignment_feedback, but yields the feedback text in chunks as the
+        model generates it. The complete text is cached once the stream finishes.
+        """
+        prompt = self._feedback_prompt(course_name)
+        try:
+            cache_key = self._cache_key('feedback', prompt, [student_submission_pdf_path, professor_solution_pdf_path])
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    yield cached
+                    return
+
+            contents = self._feedback_contents(prompt, student_submission_pdf_path, professor_solution_pdf_path)
+            chunks = []
+            for text in self._generate_stream(contents, task='feedback',
+                                              config=types.GenerateContentConfig(safety_settings=SAFETY_SETTINGS)):
+                chunks.append(text)
+                yield text
+            if cache_key:
+                self.cache.put(cache_key, 'feedback', self.model_name, ''.join(chunks))
+        except Exception as e:
+            print(f"Error streaming assignment feedback: {e}")
+            raise LLMError(f"An error occurred while generating feedback: {e}", retryable=is_retryable(e)) from e
+
+    @llm_operation('integrity_check')
     def perform_integrity_check(self, student_submission_pdf_path):
         """
         Performs a basic integrity check on a single student's submission.
@@ -90,21 +399,131 @@ class GeminiService:
         Provide a concise report indicating any flags, with explanations. If no flags are found, state so clearly.
         """
         try:
-            student_pdf_part = self._prepare_pdf_part(student_submission_pdf_path)
-            contents = [prompt, student_pdf_part]
-            response = self.model.generate_content(contents)
+            cache_key = self._cache_key('integrity', prompt, [student_submission_pdf_path])
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+            contents = [prompt, *self._prepare_document_parts(student_submission_pdf_path, 'Student Submission')]
+            response = self._generate(contents, task='integrity')
+            if cache_key:
+                self.cache.put(cache_key, 'integrity', self.model_name, response.text)
             return response.text
         except Exception as e:
             print(f"Error performing integrity check: {e}")
-            return f"An error occurred during integrity check: {e}"
+            raise LLMError(f"An error occurred during integrity check: {e}", retryable=is_retryable(e)) from e
+
+    @llm_operation('explain_similarity')
+    def explain_similarity(self, submission_a_path, submission_b_path, score):
+        """
+        Explains a pair of submissions flagged by the local similarity index.
+        Only flagged pairs reach the model, so this runs a handful of times per assignment.
+        """
+        prompt = f"""
+        An automated check flagged two students' submissions for the same assignment as unusually similar
+        (estimated overlap: {score:.0%}).
+        Compare the two submissions and explain:
+        -   Which parts are substantially the same (wording, structure, code logic, distinctive mistakes).
+        -   Whether the overlap is plausibly explained by the assignment itself (shared template, standard method, short answers).
+        -   How likely it is that one was copied from the other or both from a common source.
 
+        Provide a concise report for the professor. Do not draw conclusions beyond what the submissions show.
+        """
+        try:
+            cache_key = self._cache_key('similarity', prompt, [submission_a_path, submission_b_path])
+            if cache_key:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+            contents = [prompt,
+                        *self._prepare_document_parts(submission_a_path, 'Submission A'),
+                        *self._prepare_document_parts(submission_b_path, 'Submission B')]
+            response = self._generate(contents, task='similarity')
+            if cache_key:
+                self.cache.put(cache_key, 'similarity', self.model_name, response.text)
+            return response.text
+        except Exception as e:
+            print(f"Error explaining similarity: {e}")
+            raise LLMError(f"An error occurred while explaining similarity: {e}", retryable=is_retryable(e)) from e
+
+    def _cached_generate_many(self, kind, prompts):
+        """Runs independent text prompts in parallel and returns their texts in order.
+
+        Cache lookups and writes stay on the calling thread (they need its app
+        context); only the model calls are fanned out.
+        """
+        results = [None] * len(prompts)
+        keys = [self._cache_key(kind, prompt, []) for prompt in prompts]
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                missing.append(i)
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.summary_concurrency, len(missing))) as pool:
+                # Each call runs in its own copy of this thread's context so token usage is attributed
+                # to the calling operation
+                contexts = {i: contextvars.copy_context() for i in missing}
+                texts = pool.map(lambda i: contexts[i].run(self._generate, prompts[i], task=kind).text, missing)
+                for i, text in zip(missing, texts):
+                    results[i] = text
+                    if keys[i]:
+                        self.cache.put(keys[i], kind, self.model_name, text)
+        return results
+
+    def _pack(self, texts):
+        """Greedily packs texts, in order, into batches of at most summary_batch_tokens.
+
+        Packing is sequential, so appending a text only changes the last batch and
+        every other batch keeps its cache key.
+        """
+        batches, current, used = [], [], 0
+        for text in texts:
+            cost = self._estimate_tokens(text)
+            if current and used + cost > self.summary_batch_tokens:
+                batches.append(current)
+                current, used = [], 0
+            current.append(text)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    @llm_operation('class_summary')
     def get_class_performance_summary(self, individual_reports: list):
         """
         Generates a summary of class performance from a list of individual student reports.
-        `individual_reports` would be strings of the feedback generated earlier.
+        `individual_reports` would be strings of the feedback generated earlier; pass them in
+        a stable order (e.g. by submission id) so partial summaries can be reused.
+
+        Small classes are summarised in one call. Larger ones are packed into token-budgeted
+        batches that are summarised in parallel (map) and then combined (reduce), repeating
+        the reduce step until the partial summaries fit in a single prompt.
         """
+        try:
+            batches = self._pack(individual_reports)
+            if len(batches) <= 1:
+                return self._cached_generate_many('class_summary', [self._class_summary_prompt(individual_reports)])[0]
+            partials = self._cached_generate_many(
+                'class_batch', [self._batch_summary_prompt(batch) for batch in batches])
+            while True:
+                groups = self._pack(partials)
+                # Also stop when packing no longer merges anything, rather than looping
+                if len(groups) <= 1 or len(groups) == len(partials):
+                    return self._cached_generate_many('class_summary', [self._reduce_prompt(partials)])[0]
+                partials = self._cached_generate_many('class_reduce', [self._reduce_prompt(g) for g in groups])
+        except Exception as e:
+            print(f"Error generating class summary: {e}")
+            raise LLMError(f"An error occurred while generating class summary: {e}", retryable=is_retryable(e)) from e
+
+    @staticmethod
+    def _class_summary_prompt(individual_reports):
         combined_reports = "\n---\n".join(individual_reports)
-        prompt = f"""
+        return f"""
         Here are individual feedback reports for a class's assignment.
         Please analyze these reports and provide an overall summary of the class's performance.
         Identify:
@@ -119,9 +538,40 @@ class GeminiService:
         ---
         Class Performance Summary:
         """
-        try:
-            response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            print(f"Error generating class summary: {e}")
-            return f"An error occurred while generating class summary: {e}"
\ No newline at end of file
+
+    @staticmethod
+    def _batch_summary_prompt(individual_reports):
+        combined_reports = "\n---\n".join(individual_reports)
+        return f"""
+        Here are {len(individual_reports)} individual feedback reports from one group of students in a class.
+        Summarize this group's performance so it can later be merged with other groups' summaries.
+        Identify, with approximate numbers of students where possible:
+        -   Common areas of strength.
+        -   Common areas where students struggled (e.g., specific topics, types of problems).
+        -   Recurring mistakes or misconceptions.
+
+        ---
+        Individual Student Reports:
+        {combined_reports}
+        ---
+        Group Summary:
+        """
+
+    @staticmethod
+    def _reduce_prompt(partial_summaries):
+        combined_summaries = "\n---\n".join(partial_summaries)
+        return f"""
+        Here are summaries of a class's performance on an assignment, each covering a different group of students.
+        Please combine them into an overall summary of the class's performance, weighting each group by its size.
+        Identify:
+        -   Common areas of strength.
+        -   Common areas where students struggled (e.g., specific topics, types of problems).
+        -   Any noticeable trends or patterns across the class.
+        -   Suggestions for the professor based on these insights (e.g., topics to revisit, common misconceptions).
+
+        ---
+        Group Summaries:
+        {combined_summaries}
+        ---
+        Class Performance Summary:
+        """
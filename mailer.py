@@ -0,0 +1,201 @@
+"""Outgoing email through a database outbox.
+
+Requests only insert OutboundEmail rows, so notifying a whole space costs one
+INSERT. A background sender claims pending rows in batches and delivers each
+batch over a single authenticated SMTP connection, instead of a STARTTLS
+handshake and login per message. Temporary failures are retried with backoff;
+rejected addresses are marked failed. Delivery is at-least-once: a sender that
+dies mid-batch has its claimed rows requeued after `stale_after` seconds.
+"""
+import os
+import smtplib
+import threading
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import insert, or_
+
+from models import db, OutboundEmail
+from metrics import outbound
+
+_wakeup = threading.Event()
+
+
+def queue_emails(addresses, subject, body):
+    """Queues one message per address and commits it together with any pending changes."""
+    now = datetime.utcnow()
+    rows = [{'to_address': a, 'subject': subject, 'body': body, 'status': 'pending', 'attempts': 0, 'created_at': now}
+            for a in dict.fromkeys(addresses) if a]
+    if rows:
+        db.session.execute(insert(OutboundEmail), rows)
+    db.session.commit()
+    if rows:
+        _wakeup.set()
+    return len(rows)
+
+
+def _permanent(error):
+    # 5xx replies mean the server will never accept this message; anything else may pass later
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    code = getattr(error, 'smtp_code', None)
+    return code is not None and code >= 500
+
+
+class OutboxSender:
+    def __init__(self, app, batch_size=100, poll_interval=5.0, max_attempts=5, stale_after=600):
+        self.app = app
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self._thread = None
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+        self._started_pid = None
+
+    def ensure_started(self):
+        """Starts the sender thread once per process (safe to call on every request)."""
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='mail-sender', daemon=True)
+            self._thread.start()
+            self._started_pid = os.getpid()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        _wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._started_pid = None
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stopped.is_set():
+                try:
+                    if not self.send_pending():
+                        _wakeup.wait(self.poll_interval)
+                        _wakeup.clear()
+                except Exception as e:
+                    print(f"Mail sender error: {e}")
+                    db.session.rollback()
+                    self._stopped.wait(self.poll_interval)
+                finally:
+                    db.session.remove()
+
+    def send_pending(self):
+        """Delivers everything currently due, batch by batch; returns the number of messages sent."""
+        worker_id = f'{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        sent = 0
+        while not self._stopped.is_set():
+            batch = self._claim_batch(worker_id)
+            if not batch:
+                break
+            sent += self._deliver(batch)
+        return sent
+
+    def _claim_batch(self, worker_id):
+        now = datetime.utcnow()
+        OutboundEmail.query.filter(
+            OutboundEmail.status == 'sending',
+            OutboundEmail.claimed_at < now - timedelta(seconds=self.stale_after),
+        ).update({'status': 'pending', 'worker_id': None}, synchronize_session=False)
+        due = (db.session.query(OutboundEmail.id).filter_by(status='pending')
+               .filter(or_(OutboundEmail.available_at.is_(None), OutboundEmail.available_at <= now))
+               .order_by(OutboundEmail.id).limit(self.batch_size))
+        # The status check in the UPDATE makes the claim atomic against other senders
+        OutboundEmail.query.filter(OutboundEmail.id.in_(due.scalar_subquery()),
+                                   OutboundEmail.status == 'pending').update(
+            {'status': 'sending', 'worker_id': worker_id, 'claimed_at': now,
+             'attempts': OutboundEmail.attempts + 1},
+            synchronize_session=False)
+        db.session.commit()
+        return (OutboundEmail.query.filter_by(status='sending', worker_id=worker_id)
+                .order_by(OutboundEmail.id).all())
+
+    def _connect(self):
+        config = self.app.config
+        with outbound('smtp', 'connect'):
+            server = smtplib.SMTP(config['SMTP_SERVER'], config['SMTP_PORT'], timeout=30)
+            try:
+                if config['SMTP_STARTTLS']:
+                    server.starttls()
+                if config['SMTP_USER'] and config['SMTP_PASSWORD']:
+                    server.login(config['SMTP_USER'], config['SMTP_PASSWORD'])
+            except Exception:
+                server.close()
+                raise
+        return server
+
+    def _message(self, email):
+        msg = EmailMessage()
+        msg['Subject'] = email.subject
+        msg['From'] = self.app.config['MAIL_FROM']
+        msg['To'] = email.to_address
+        msg.set_content(email.body)
+        return msg
+
+    def _mark_sent(self, email):
+        email.status = 'sent'
+        email.error = None
+        email.sent_at = datetime.utcnow()
+        db.session.commit()
+
+    def _mark_failed(self, email, error, permanent=False):
+        email.error = str(error)
+        email.worker_id = None
+        if permanent or email.attempts >= self.max_attempts:
+            email.status = 'failed'
+        else:
+            email.status = 'pending'
+            email.available_at = datetime.utcnow() + timedelta(seconds=30 * 2 ** (email.attempts - 1))
+        db.session.commit()
+
+    def _requeue(self, emails, error):
+        # The connection is gone: this and the rest of the batch go back to the queue
+        print(f"SMTP connection lost: {error}")
+        for email in emails:
+            self._mark_failed(email, error)
+
+    def _deliver(self, batch):
+        if not self.app.config['SMTP_SERVER']:
+            for email in batch:
+                print(f"Email to {email.to_address}: {email.subject}\n{email.body}")
+                self._mark_sent(email)
+            return len(batch)
+        try:
+            server = self._connect()
+        except OSError as e:  # includes SMTPException
+            print(f"Could not connect to SMTP server: {e}")
+            for email in batch:
+                self._mark_failed(email, e)
+            return 0
+        sent = 0
+        try:
+            for i, email in enumerate(batch):
+                try:
+                    with outbound('smtp', 'send'):
+                        server.send_message(self._message(email))
+                except smtplib.SMTPException as e:
+                    if isinstance(e, smtplib.SMTPServerDisconnected):
+                        self._requeue(batch[i:], e)
+                        break
+                    print(f"Failed to send email to {email.to_address}: {e}")
+                    self._mark_failed(email, e, permanent=_permanent(e))
+                    continue
+                except OSError as e:
+                    self._requeue(batch[i:], e)
+                    break
+                self._mark_sent(email)
+                sent += 1
+        finally:
+            try:
+                server.quit()
+            except OSError:
+                server.close()
+        return sent
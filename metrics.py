@@ -0,0 +1,363 @@
+"""Request instrumentation exposed in the Prometheus text format.
+
+For every request we record latency, the number of SQL statements and the time
+spent in them (from SQLAlchemy cursor events), and upload sizes. GeminiService
+methods record their latency, outcome, error class and token usage; SMTP and
+OAuth calls record their outbound latency.
+
+Metrics are recorded in process memory. With METRICS_DIR set (the default is
+the instance folder), each process also writes a snapshot of its totals to that
+directory every few seconds and /metrics returns the sum over all snapshots, so
+one scrape covers every gunicorn worker whichever worker answers it. Snapshots
+of exited workers are kept so totals never go down; the gunicorn master clears
+the directory when it starts.
+
+When SLOW_REQUEST_SECONDS is set, requests slower than that are printed with
+the SQL statements they ran, which is usually enough to spot an N+1 query.
+"""
+import contextvars
+import functools
+import glob
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+EXTENSION_KEY = 'metrics'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))  # 1 KiB .. 64 MiB
+TOKEN_BUCKETS = (100, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self, snapshots=None):
+        """Text lines for this process, or for the sum of `snapshots` when given."""
+        values = {}
+        for snapshot in [self.snapshot()] if snapshots is None else snapshots:
+            for key, value in snapshot:
+                values[tuple(key)] = values.get(tuple(key), 0) + value
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(series)] for key, series in self._series.items()]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self, snapshots=None):
+        """Text lines for this process, or for the sum of `snapshots` when given."""
+        merged = {}
+        for snapshot in [self.snapshot()] if snapshots is None else snapshots:
+            for key, series in snapshot:
+                total = merged.setdefault(tuple(key), [0] * (len(self.buckets) + 2))
+                for i, value in enumerate(series):
+                    total[i] += value
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for key, series in sorted(merged.items()):
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", bound)])} {count}')
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {series[-2]}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {series[-1]}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency.',
+                            ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram('http_request_sql_queries', 'SQL statements executed per request.',
+                            ('endpoint',), COUNT_BUCKETS)
+REQUEST_QUERY_SECONDS = Histogram('http_request_sql_duration_seconds', 'Time spent in SQL per request.',
+                                  ('endpoint',))
+UPLOAD_BYTES = Histogram('upload_size_bytes', 'Size of stored uploads.', ('endpoint',), SIZE_BUCKETS)
+LLM_SECONDS = Histogram('llm_call_duration_seconds', 'GeminiService method latency, cache hits included.',
+                        ('operation', 'outcome'))
+LLM_ERRORS = Counter('llm_call_errors_total', 'GeminiService failures by error class.', ('operation', 'error'))
+LLM_TOKENS = Histogram('llm_call_tokens', 'Tokens per model call as reported by the API.',
+                       ('operation', 'direction'), TOKEN_BUCKETS)
+OUTBOUND_SECONDS = Histogram('outbound_request_duration_seconds', 'Latency of SMTP and OAuth calls.',
+                             ('service', 'operation', 'outcome'))
+
+REGISTRY = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_QUERY_SECONDS, UPLOAD_BYTES,
+            LLM_SECONDS, LLM_ERRORS, LLM_TOKENS, OUTBOUND_SECONDS]
+
+_llm_operation = contextvars.ContextVar('llm_operation', default='other')
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forgets every recorded value, e.g. in a forked worker that inherited its parent's."""
+    for metric in REGISTRY:
+        metric.reset()
+
+
+class SharedMetrics:
+    """Snapshots of each process's totals in `directory`, summed when scraped.
+
+    Every process rewrites its own `<pid>.json` from a background thread every
+    `interval` seconds, and again just before it answers a scrape.
+    """
+
+    def __init__(self, directory, interval=5.0):
+        self.directory = directory
+        self.interval = interval
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        """Starts the snapshot thread once per process (safe to call on every request)."""
+        if self._started_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._run, name='metrics-snapshot', daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Could not write metrics snapshot: {e}")
+
+    def write(self):
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({metric.name: metric.snapshot() for metric in REGISTRY}, f)
+        os.replace(path + '.tmp', path)
+
+    def render(self):
+        self.write()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # removed or being replaced by its process; counted on the next scrape
+        lines = []
+        for metric in REGISTRY:
+            lines.extend(metric.render([snapshot.get(metric.name, []) for snapshot in snapshots]))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """Removes every snapshot; for a server master before it starts its workers."""
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            os.remove(path)
+
+
+@contextmanager
+def outbound(service, operation):
+    """Times an outgoing call, e.g. `with outbound('smtp', 'send'): ...`."""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        OUTBOUND_SECONDS.observe(time.perf_counter() - start, service=service, operation=operation, outcome=outcome)
+
+
+def llm_operation(name):
+    """Decorator for GeminiService methods: latency, outcome and error class under `name`.
+
+    Works for generator methods too, timing until the caller stops iterating.
+    """
+    def record(start, error):
+        outcome = 'error' if error else 'ok'
+        LLM_SECONDS.observe(time.perf_counter() - start, operation=name, outcome=outcome)
+        if error:
+            # GeminiService wraps failures in LLMError; the underlying class is more telling
+            LLM_ERRORS.inc(operation=name, error=type(error.__cause__ or error).__name__)
+
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                # A suspended generator may be finished from another context, so the previous
+                # value is restored with set() rather than reset(token)
+                previous = _llm_operation.get()
+                _llm_operation.set(name)
+                start, error = time.perf_counter(), None
+                try:
+                    yield from fn(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    record(start, error)
+                    _llm_operation.set(previous)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                token = _llm_operation.set(name)
+                start, error = time.perf_counter(), None
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    record(start, error)
+                    _llm_operation.reset(token)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(usage):
+    """Records a response's usage_metadata against the operation in progress."""
+    if usage is None:
+        return
+    operation = _llm_operation.get()
+    if usage.prompt_token_count:
+        LLM_TOKENS.observe(usage.prompt_token_count, operation=operation, direction='input')
+    if usage.candidates_token_count:
+        LLM_TOKENS.observe(usage.candidates_token_count, operation=operation, direction='output')
+
+
+def record_upload(size):
+    if has_request_context():
+        UPLOAD_BYTES.observe(size, endpoint=_endpoint())
+
+
+def _endpoint():
+    # The view name rather than the path keeps label cardinality bounded
+    return request.endpoint or 'unmatched'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    # Worker threads have no request context; their queries are not attributed to a request
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+        if g.sql_log is not None:
+            g.sql_log.append((elapsed, statement))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _execute_failed(context):
+    # after_cursor_execute does not run for a failed statement; drop its start time so the list on
+    # the pooled connection does not grow with every handled IntegrityError
+    conn = context.connection
+    if conn is not None and context.execution_context is not None and conn.info.get('query_start'):
+        conn.info['query_start'].pop()
+
+
+def instrument_app(app):
+    """Adds the per-request hooks and the /metrics endpoint to `app`."""
+    slow_after = app.config.get('SLOW_REQUEST_SECONDS') or 0
+    directory = app.config.get('METRICS_DIR')
+    if directory is None:
+        directory = os.path.join(app.instance_path, 'metrics')
+    shared = SharedMetrics(directory, app.config.get('METRICS_INTERVAL', 5.0)) if directory else None
+    app.extensions[EXTENSION_KEY] = shared
+
+    @app.before_request
+    def _start_request_metrics():
+        if shared:
+            shared.ensure_started()
+        g.request_start = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+        g.sql_log = [] if slow_after else None
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        if 'request_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = _endpoint()
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        REQUEST_QUERIES.observe(g.sql_queries, endpoint=endpoint)
+        REQUEST_QUERY_SECONDS.observe(g.sql_seconds, endpoint=endpoint)
+        if slow_after and elapsed >= slow_after:
+            print(f"Slow request {request.method} {request.path} -> {response.status_code}: {elapsed:.3f}s, "
+                  f"{g.sql_queries} queries in {g.sql_seconds:.3f}s")
+            for seconds, statement in g.sql_log:
+                print(f"  {seconds * 1000:8.1f} ms  {' '.join(statement.split())[:300]}")
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return 'Unauthorized\n', 401, {'Content-Type': 'text/plain'}
+        body = shared.render() if shared else render()
+        return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -0,0 +1,24 @@
+"""index lower(user.email) for case-insensitive roster matching
+
+Revision ID: 5c1d7e2a9b40
+Revises: 370ebf18744f
+Create Date: 2026-10-17 04:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1d7e2a9b40'
+down_revision = '370ebf18744f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_email_lower', 'user', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_email_lower', table_name='user')
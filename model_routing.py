@@ -0,0 +1,119 @@
+"""Model selection for GeminiService calls.
+
+Every call names its task (feedback, integrity, similarity, class summary
+steps) and carries an estimated input size. The router maps the pair to a tier
+(fast, standard or quality model) with its own timeout, and keeps a rolling
+window of observed latencies per model. When hedging is enabled for a task, a
+call still running after its model's p95 latency gets a second request to the
+fast tier, and whichever answers first is used. Feedback grading is never
+hedged, so pupils always get the answer of the model chosen for it.
+"""
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from metrics import Counter, Histogram, REGISTRY
+
+LLM_ROUTES = Counter('llm_route_decisions_total', 'Model chosen per task.', ('task', 'tier', 'model'))
+LLM_HEDGES = Counter('llm_hedged_requests_total', 'Hedged second requests and which tier answered first.',
+                     ('task', 'winner'))
+LLM_MODEL_SECONDS = Histogram('llm_model_call_duration_seconds', 'Latency of single model calls.',
+                              ('model', 'outcome'))
+REGISTRY.extend([LLM_ROUTES, LLM_HEDGES, LLM_MODEL_SECONDS])
+
+FAST, STANDARD, QUALITY = 'fast', 'standard', 'quality'
+
+# task: (tier for small inputs, tier for large inputs, may be hedged to the fast tier)
+TASK_POLICY = {
+    'feedback': (STANDARD, QUALITY, False),
+    'integrity': (FAST, STANDARD, True),
+    'similarity': (FAST, STANDARD, True),
+    'class_batch': (FAST, FAST, True),
+    'class_reduce': (FAST, STANDARD, True),
+    'class_summary': (STANDARD, STANDARD, True),
+}
+DEFAULT_POLICY = (STANDARD, STANDARD, False)
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    name: str
+    model: str
+    timeout: float  # seconds per call
+
+
+@dataclass(frozen=True)
+class Route:
+    task: str
+    tier: ModelTier
+    hedge: Optional[ModelTier] = None
+
+
+class ModelRouter:
+    def __init__(self, tiers, large_input_tokens=8000, hedging=False, hedge_quantile=0.95,
+                 hedge_min_samples=20, window=200):
+        self.tiers = tiers  # tier name -> ModelTier
+        self.large_input_tokens = large_input_tokens
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = {}  # model -> recent successful call durations
+        self._window = window
+        self._recent = deque(maxlen=100)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def single(cls, model, timeout=120):
+        """A router that sends everything to one model, i.e. no routing."""
+        tier = ModelTier(STANDARD, model, timeout)
+        return cls({FAST: tier, STANDARD: tier, QUALITY: tier})
+
+    @property
+    def signature(self):
+        """Identifies the model set, for cache keys: changing any tier's model invalidates results."""
+        return '+'.join(f'{name}={self.tiers[name].model}' for name in sorted(self.tiers))
+
+    def route(self, task, estimated_tokens):
+        small, large, may_hedge = TASK_POLICY.get(task, DEFAULT_POLICY)
+        tier = self.tiers[large if estimated_tokens > self.large_input_tokens else small]
+        hedge = self.tiers[FAST] if self.hedging and may_hedge else None
+        if hedge is not None and hedge.model == tier.model:
+            hedge = None
+        LLM_ROUTES.inc(task=task, tier=tier.name, model=tier.model)
+        with self._lock:
+            self._recent.append({'task': task, 'tier': tier.name, 'model': tier.model,
+                                 'estimated_tokens': estimated_tokens})
+        return Route(task, tier, hedge)
+
+    def hedge_delay(self, tier):
+        """Seconds after which a call to `tier` should be hedged, or None while there is too little data."""
+        with self._lock:
+            samples = sorted(self._latencies.get(tier.model, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(int(self.hedge_quantile * len(samples)), len(samples) - 1)]
+
+    def observe(self, tier, seconds, ok):
+        LLM_MODEL_SECONDS.observe(seconds, model=tier.model, outcome='ok' if ok else 'error')
+        if ok:
+            with self._lock:
+                self._latencies.setdefault(tier.model, deque(maxlen=self._window)).append(seconds)
+
+    def record_hedge(self, route, winner):
+        LLM_HEDGES.inc(task=route.task, winner=winner)
+        with self._lock:
+            self._recent.append({'task': route.task, 'hedged': True, 'winner': winner})
+
+    def stats(self):
+        with self._lock:
+            latencies = {model: sorted(values) for model, values in self._latencies.items()}
+            recent = list(self._recent)
+        pick = lambda values, q: values[min(int(q * len(values)), len(values) - 1)]
+        return {
+            'tiers': {name: {'model': t.model, 'timeout': t.timeout} for name, t in self.tiers.items()},
+            'hedging': self.hedging,
+            'latency': {model: {'samples': len(v), 'p50': pick(v, 0.5), 'p95': pick(v, 0.95)}
+                        for model, v in latencies.items() if v},
+            'recent_decisions': recent[-20:],
+        }
@@ -11,33 +11,110 @@ class User(db.Model):
     role = db.Column(db.String(10), nullable=False)  # 'master' or 'pupil'
     spaces = db.relationship('Space', backref='master', lazy=True)
     submissions = db.relationship('Submission', backref='pupil', lazy=True)
+    # Roster imports match addresses case-insensitively
+    __table_args__ = (db.Index('ix_user_email_lower', db.func.lower(email)),)
 
 class Space(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     unique_code = db.Column(db.String(32), unique=True, nullable=False)
     name = db.Column(db.String(256), nullable=False)
-    master_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    master_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     members = db.relationship('SpaceMember', backref='space', lazy=True)
     assignments = db.relationship('Assignment', backref='space', lazy=True)
 
 class SpaceMember(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     space_id = db.Column(db.Integer, db.ForeignKey('space.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # Also serves lookups by space_id alone (leftmost column of the index)
+    __table_args__ = (db.UniqueConstraint('space_id', 'user_id', name='uq_space_member_space_user'),)
 
 class Assignment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    space_id = db.Column(db.Integer, db.ForeignKey('space.id'), nullable=False)
+    space_id = db.Column(db.Integer, db.ForeignKey('space.id'), nullable=False, index=True)
     title = db.Column(db.String(256), nullable=False)
     description = db.Column(db.Text, nullable=True)
     due_date = db.Column(db.DateTime, nullable=True)
     solution_file_path = db.Column(db.String(512), nullable=True)
+    solution_filename = db.Column(db.String(256), nullable=True)  # name as uploaded
+    solution_sha256 = db.Column(db.String(64), nullable=True)
     submissions = db.relationship('Submission', backref='assignment', lazy=True)
 
 class Submission(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
-    pupil_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    pupil_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     file_path = db.Column(db.String(512), nullable=False)
+    original_filename = db.Column(db.String(256), nullable=True)
+    file_sha256 = db.Column(db.String(64), nullable=True)
+    file_size = db.Column(db.Integer, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    attempted = db.Column(db.Boolean, default=True)
\ No newline at end of file
+    attempted = db.Column(db.Boolean, default=True)
+    grading_job = db.relationship('GradingJob', backref='submission', uselist=False, lazy=True)
+    # One submission per pupil and assignment; also serves lookups by assignment_id alone
+    __table_args__ = (db.UniqueConstraint('assignment_id', 'pupil_id', name='uq_submission_assignment_pupil'),)
+
+class GradingJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), unique=True, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # 'pending', 'running', 'done' or 'failed'
+    feedback = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker_id = db.Column(db.String(64), nullable=True)
+    available_at = db.Column(db.DateTime, nullable=True)  # earliest time a retried job may run again
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class LLMCacheEntry(db.Model):
+    key = db.Column(db.String(64), primary_key=True)  # SHA-256 over task, model, prompt and input file digests
+    kind = db.Column(db.String(32), nullable=False)  # 'feedback' or 'integrity'
+    model = db.Column(db.String(64), nullable=False)
+    result = db.Column(db.Text, nullable=False)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class SubmissionFingerprint(db.Model):
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False, index=True)
+    method = db.Column(db.String(8), nullable=False)  # 'text' (word shingles) or 'ast' (normalised Python)
+    signature = db.Column(db.Text, nullable=False)  # JSON list of MinHash values
+
+class LSHBucket(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
+    bucket = db.Column(db.String(48), nullable=False)  # '<method>:<band>:<band hash>'
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False)
+    __table_args__ = (db.Index('ix_lsh_bucket_lookup', 'assignment_id', 'bucket'),)
+
+class SimilarityFlag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False, index=True)
+    submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False)
+    other_submission_id = db.Column(db.Integer, db.ForeignKey('submission.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)  # estimated Jaccard similarity
+    method = db.Column(db.String(8), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # LLM explanation: 'pending', 'running', 'done', 'failed' or 'skipped' (over the per-assignment cap)
+    explanation = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    submission = db.relationship('Submission', foreign_keys=[submission_id])
+    other_submission = db.relationship('Submission', foreign_keys=[other_submission_id])
+    __table_args__ = (db.UniqueConstraint('submission_id', 'other_submission_id'),)
+
+class OutboundEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    to_address = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # 'pending', 'sending', 'sent' or 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    worker_id = db.Column(db.String(64), nullable=True)
+    available_at = db.Column(db.DateTime, nullable=True)  # earliest time a failed message may be retried
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_outbound_email_status_id', 'status', 'id'),)
@@ -0,0 +1,106 @@
+"""Google sign-in support: cached provider metadata and local ID token checks.
+
+The discovery document and signing keys (JWKS) are fetched once per process
+and kept until their TTL runs out, over one pooled HTTP session. The user's
+identity comes from verifying the ID token returned by the token endpoint, so
+a login needs a single outbound call (the code exchange) instead of fetching
+discovery twice and then calling the userinfo endpoint.
+"""
+import re
+import threading
+import time
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import outbound
+
+# Google publishes both forms of its issuer
+_ISSUER_ALIASES = {'https://accounts.google.com': {'https://accounts.google.com', 'accounts.google.com'}}
+
+
+class IDTokenError(Exception):
+    pass
+
+
+def _max_age(response, default):
+    match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+    return int(match.group(1)) if match else default
+
+
+class OIDCProvider:
+    def __init__(self, discovery_url, client_id, metadata_ttl=3600, jwks_ttl=3600, timeout=10, session=None):
+        self.discovery_url = discovery_url
+        self.client_id = client_id
+        self.metadata_ttl = metadata_ttl
+        self.jwks_ttl = jwks_ttl
+        self.timeout = timeout
+        # Shared by all threads; also mounted into each OAuth2Session so the code exchange
+        # reuses pooled keep-alive connections
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+        self.session = session
+        self._lock = threading.RLock()
+        self._metadata = None
+        self._metadata_expires = 0
+        self._keys = {}
+        self._keys_expires = 0
+        self._keys_fetched = 0
+
+    def _get(self, url, operation):
+        with outbound('oauth', operation):
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+        return response
+
+    def metadata(self):
+        """The provider's discovery document, refreshed after its TTL."""
+        if self._metadata is None or time.monotonic() >= self._metadata_expires:
+            with self._lock:
+                if self._metadata is None or time.monotonic() >= self._metadata_expires:
+                    response = self._get(self.discovery_url, 'discovery')
+                    self._metadata = response.json()
+                    self._metadata_expires = time.monotonic() + _max_age(response, self.metadata_ttl)
+        return self._metadata
+
+    def signing_keys(self, refresh=False):
+        """Signing keys by key id, honouring the JWKS response's Cache-Control max-age.
+
+        A forced refresh is skipped if the keys were fetched in the last minute, so
+        tokens with made-up key ids cannot make us hammer the JWKS endpoint.
+        """
+        def stale():
+            now = time.monotonic()
+            return not self._keys or now >= self._keys_expires or (refresh and now - self._keys_fetched > 60)
+
+        if stale():
+            with self._lock:
+                if stale():
+                    response = self._get(self.metadata()['jwks_uri'], 'jwks')
+                    self._keys = {k.get('kid'): jwt.PyJWK(k) for k in response.json().get('keys', [])}
+                    self._keys_fetched = time.monotonic()
+                    self._keys_expires = self._keys_fetched + _max_age(response, self.jwks_ttl)
+        return self._keys
+
+    def verify_id_token(self, id_token, nonce=None, leeway=60):
+        """Checks the ID token's signature, audience, issuer, expiry and nonce; returns its claims."""
+        try:
+            header = jwt.get_unverified_header(id_token)
+            key = self.signing_keys().get(header.get('kid'))
+            if key is None:
+                # Unknown key id: the provider may have rotated keys since we cached them
+                key = self.signing_keys(refresh=True).get(header.get('kid'))
+            if key is None:
+                raise IDTokenError(f"No signing key matches kid {header.get('kid')!r}")
+            issuer = self.metadata()['issuer']
+            claims = jwt.decode(id_token, key, algorithms=[key.algorithm_name], audience=self.client_id,
+                                issuer=_ISSUER_ALIASES.get(issuer, {issuer}), leeway=leeway)
+        except (jwt.PyJWTError, requests.RequestException, KeyError, ValueError) as e:
+            raise IDTokenError(f'Invalid ID token: {e}') from e
+        if nonce is not None and claims.get('nonce') != nonce:
+            raise IDTokenError('Invalid ID token: nonce mismatch')
+        return claims
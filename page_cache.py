@@ -0,0 +1,229 @@
+"""Cache of rendered pages, dropped by the writes that change them.
+
+The space page, the assignment page and the master dashboard are cached per
+user (and page number) for PAGE_CACHE_TTL seconds. Their keys embed version
+tokens of what they show, and a write replaces the tokens it affects, so
+every cached variant of a page becomes unreachable at once without
+enumerating keys:
+
+    space:<id>, assignment:<id>, master:<id>
+        content: bumped by invalidate_space() and invalidate_assignment() when
+        spaces or assignments are created or edited, pupils join or a roster
+        is imported, and when a whole assignment is queued for grading
+    pupil:<id>:space:<id>, pupil:<id>:assignment:<id>
+        one pupil's submission and grading status on those pages
+    progress:space:<id>
+        the submitted and graded counts on the master's view of a space
+
+Grading job transitions only go through invalidate_submission(), so a burst of
+finished jobs drops the pages of the pupils concerned and the master's space
+page, while every other pupil's pages stay cached.
+
+Each cached page carries a strong ETag of its body and is sent with
+Cache-Control: private, no-cache, so a refresh revalidates and an unchanged
+page is answered with 304 and no body. Requests with pending flash messages
+always render, and only 200 HTML responses are stored.
+
+Backends are byte stores with get/set and a TTL:
+
+    memory   LRU inside each process; fastest, but an invalidation only reaches
+             the process that made the write, so other workers can serve a page
+             up to PAGE_CACHE_TTL seconds old
+    sqlite   a file shared by every worker process on the host, standing in for
+             memcached or Redis; invalidations are seen by all workers at once
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, has_app_context, make_response, request, session
+
+from metrics import Counter, REGISTRY
+
+EXTENSION_KEY = 'page_cache'
+
+PAGE_CACHE = Counter('page_cache_requests_total', 'Cached page lookups by outcome.', ('page', 'outcome'))
+REGISTRY.append(PAGE_CACHE)
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteBackend:
+    def __init__(self, path, max_entries=5000, prune_every=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS page_cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)')
+
+    def _connection(self):
+        # sqlite3 connections are per thread; forked workers get new ones through the pid check
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # losing cache writes in a crash is harmless
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute('SELECT value FROM page_cache WHERE key = ? AND expires > ?',
+                                         (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO page_cache (key, value, expires) VALUES (?, ?, ?)',
+                     (key, value, time.time() + ttl))
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.prune_every == 0
+        if prune:
+            conn.execute('DELETE FROM page_cache WHERE expires <= ?', (time.time(),))
+            conn.execute('DELETE FROM page_cache WHERE key IN (SELECT key FROM page_cache ORDER BY expires DESC '
+                         'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+
+class PageCache:
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        # Version tokens outlive the pages built on them; a lost token only causes misses
+        self.version_ttl = max(ttl * 100, 24 * 3600)
+
+    def version(self, name):
+        token = self.backend.get(f'v:{name}')
+        if token is None:
+            return self.bump(name)
+        return token.decode()
+
+    def bump(self, name):
+        token = uuid.uuid4().hex[:12]
+        self.backend.set(f'v:{name}', token.encode(), self.version_ttl)
+        return token
+
+    def get(self, key):
+        """(etag, body) stored for `key`, or None."""
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        etag, _, body = value.partition(b'\n')
+        return etag.decode(), body
+
+    def set(self, key, etag, body):
+        self.backend.set(key, etag.encode() + b'\n' + body, self.ttl)
+
+
+def make_page_cache(config, instance_path):
+    backend = config['PAGE_CACHE_BACKEND']
+    if not backend:
+        return None
+    if backend == 'memory':
+        return PageCache(MemoryBackend(config['PAGE_CACHE_MAX_ENTRIES']), ttl=config['PAGE_CACHE_TTL'])
+    if backend == 'sqlite':
+        path = config['PAGE_CACHE_PATH'] or os.path.join(instance_path, 'page_cache.sqlite')
+        return PageCache(SQLiteBackend(path, config['PAGE_CACHE_MAX_ENTRIES']), ttl=config['PAGE_CACHE_TTL'])
+    raise ValueError(f"PAGE_CACHE_BACKEND must be 'memory', 'sqlite' or empty, not {backend!r}")
+
+
+def _cache():
+    return current_app.extensions.get(EXTENSION_KEY) if has_app_context() else None
+
+
+def invalidate_space(space):
+    """Drops the cached pages showing `space`: its page and its master's dashboard."""
+    cache = _cache()
+    if cache is not None:
+        cache.bump(f'space:{space.id}')
+        cache.bump(f'master:{space.master_id}')
+
+
+def invalidate_assignment(assignment):
+    cache = _cache()
+    if cache is not None:
+        cache.bump(f'assignment:{assignment.id}')
+        invalidate_space(assignment.space)
+
+
+def invalidate_submission(submission, progress=False):
+    """Drops the submitting pupil's cached pages after its grading status changed.
+
+    With `progress` (a new submission, or one graded) the master's counts on
+    the space page are dropped too.
+    """
+    cache = _cache()
+    if cache is not None:
+        assignment = submission.assignment
+        cache.bump(f'pupil:{submission.pupil_id}:assignment:{assignment.id}')
+        cache.bump(f'pupil:{submission.pupil_id}:space:{assignment.space_id}')
+        if progress:
+            cache.bump(f'progress:space:{assignment.space_id}')
+
+
+def cached_page(depends_on):
+    """Caches a GET view per user; `depends_on(**view_args)` names the version (or versions) the page is built on."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**view_args):
+            cache = _cache()
+            if cache is None or request.method != 'GET' or session.get('_flashes'):
+                return view(**view_args)
+            page = request.endpoint
+            names = depends_on(**view_args)
+            versions = '.'.join(cache.version(name) for name in ((names,) if isinstance(names, str) else names))
+            key = f"page:{page}:{versions}:{session.get('user_id')}:{session.get('role')}:{request.full_path}"
+            cached = cache.get(key)
+            if cached is None:
+                response = make_response(view(**view_args))
+                if response.status_code != 200 or response.mimetype != 'text/html' or response.is_streamed:
+                    return response
+                etag = hashlib.sha256(response.get_data()).hexdigest()
+                cache.set(key, etag, response.get_data())
+                PAGE_CACHE.inc(page=page, outcome='miss')
+            else:
+                etag, body = cached
+                response = current_app.response_class(body, mimetype='text/html')
+                PAGE_CACHE.inc(page=page, outcome='hit')
+            if request.if_none_match.contains(etag):
+                PAGE_CACHE.inc(page=page, outcome='not_modified')
+                response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            # Pages differ per signed-in user; browsers may keep them but must revalidate
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
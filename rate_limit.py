@@ -0,0 +1,160 @@
+"""Token-bucket limiting for the Gemini request and token quotas.
+
+Gemini enforces its quotas per API key, so every process using the key has to
+draw from the same buckets. SQLiteTokenBucket keeps the level in a small SQLite
+file that all worker processes on the host share; TokenBucket is the in-process
+version for a single process.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def take(self, amount):
+        """Blocks until `amount` tokens are available, then removes them.
+
+        Requests larger than the bucket only wait for a full bucket, so a single
+        oversized call cannot deadlock the limiter.
+        """
+        amount = min(float(amount), self.capacity)
+        with self._cond:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                self._cond.wait((amount - self.tokens) / self.refill_per_second)
+
+    def adjust(self, delta):
+        """Removes (positive) or returns (negative) tokens after the real cost is known."""
+        with self._cond:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+            self._cond.notify_all()
+
+
+class SQLiteTokenBucket:
+    """TokenBucket whose level is stored in a SQLite file shared by every process on the host.
+
+    Each take or adjust is one BEGIN IMMEDIATE transaction, so concurrent
+    processes never spend the same tokens. Waiting callers poll the file, since
+    tokens returned by another process cannot wake them.
+    """
+
+    def __init__(self, path, name, capacity, refill_per_second, poll_interval=1.0):
+        self.path = path
+        self.name = name
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections are per thread; forked workers get new ones through the pid check.
+        # The file is only created on the first Gemini call, not when the app boots
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS token_bucket '
+                         '(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _update(self, change):
+        """Applies change(tokens) -> (new_tokens, result) to the refilled level in one transaction."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM token_bucket WHERE name = ?', (self.name,)).fetchone()
+            now = time.time()
+            if row is None:
+                tokens = self.capacity
+            else:
+                tokens = min(self.capacity, row[0] + max(0.0, now - row[1]) * self.refill_per_second)
+            tokens, result = change(tokens)
+            conn.execute('INSERT OR REPLACE INTO token_bucket (name, tokens, updated) VALUES (?, ?, ?)',
+                         (self.name, tokens, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def take(self, amount):
+        """Blocks until `amount` tokens are available, then removes them (see TokenBucket.take)."""
+        amount = min(float(amount), self.capacity)
+
+        def change(tokens):
+            if tokens >= amount:
+                return tokens - amount, 0
+            return tokens, (amount - tokens) / self.refill_per_second
+
+        while True:
+            wait = self._update(change)
+            if not wait:
+                return
+            time.sleep(min(wait, self.poll_interval))
+
+    def adjust(self, delta):
+        """Removes (positive) or returns (negative) tokens after the real cost is known."""
+        self._update(lambda tokens: (min(self.capacity, tokens - delta), None))
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one API key.
+
+    With `path` the buckets live in that SQLite file and are shared by every
+    process that opens it with the same `scope`; without it they only cover the
+    threads of this process. A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, path=None, scope='default'):
+        def bucket(name, per_minute):
+            if not per_minute:
+                return None
+            if path:
+                return SQLiteTokenBucket(path, f'{scope}:{name}', per_minute, per_minute / 60)
+            return TokenBucket(per_minute, per_minute / 60)
+
+        self.requests = bucket('requests', requests_per_minute)
+        self.tokens = bucket('tokens', tokens_per_minute)
+
+    def acquire(self, estimated_tokens):
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(estimated_tokens)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        if self.tokens:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+def make_rate_limiter(config, instance_path):
+    backend = config['GEMINI_QUOTA_BACKEND']
+    requests_per_minute, tokens_per_minute = config['GEMINI_REQUESTS_PER_MINUTE'], config['GEMINI_TOKENS_PER_MINUTE']
+    if backend == 'memory':
+        return RateLimiter(requests_per_minute, tokens_per_minute)
+    if backend == 'sqlite':
+        path = config['GEMINI_QUOTA_PATH'] or os.path.join(instance_path, 'gemini_quota.sqlite')
+        # Apps with different keys on one host keep separate buckets; the key itself is not stored
+        scope = hashlib.sha256((config['GEMINI_API_KEY'] or '').encode()).hexdigest()[:16]
+        return RateLimiter(requests_per_minute, tokens_per_minute, path=path, scope=scope)
+    raise ValueError(f"GEMINI_QUOTA_BACKEND must be 'memory' or 'sqlite', not {backend!r}")
@@ -0,0 +1,130 @@
+"""Bulk enrolment of pupils into a space from a CSV or JSON roster.
+
+The whole roster is applied in one transaction with a fixed number of
+statements per chunk of addresses, however many pupils it lists: one SELECT
+finds the users that already exist, one multi-row INSERT creates the rest, and
+one INSERT ... SELECT adds the memberships that do not exist yet. Pupils
+created here have a placeholder google_id until their first sign-in claims
+the row (see claim_roster_user). Addresses are matched case-insensitively,
+so a roster line for an existing account enrols that account whatever case
+its address was stored in.
+"""
+import csv
+import io
+import re
+from dataclasses import dataclass, field
+
+from sqlalchemy import exists, func, insert, literal, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, SpaceMember
+
+ROSTER_GOOGLE_ID_PREFIX = 'roster:'
+# Keeps every statement under SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+@dataclass
+class RosterResult:
+    inserted: int = 0  # new memberships
+    skipped: int = 0  # already members, or listed twice
+    created_users: int = 0
+    invalid: list = field(default_factory=list)  # rows without a usable email address
+
+
+def parse_csv(text):
+    """(email, name) pairs from CSV text with an optional header row naming the columns."""
+    rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    if rows and not any('@' in cell for cell in rows[0]):
+        header = [cell.strip().lower() for cell in rows.pop(0)]
+        email_col = header.index('email') if 'email' in header else 0
+        name_col = header.index('name') if 'name' in header else None
+    else:
+        email_col, name_col = 0, 1
+    return [(row[email_col] if email_col < len(row) else '',
+             row[name_col] if name_col is not None and name_col < len(row) else '') for row in rows]
+
+
+def parse_json(data):
+    """(email, name) pairs from a list of addresses or {"email", "name"} objects, or {"pupils": [...]}."""
+    if isinstance(data, dict):
+        data = data.get('pupils', [])
+    if not isinstance(data, list):
+        raise ValueError('Expected a list of pupils.')
+    entries = []
+    for entry in data:
+        if isinstance(entry, str):
+            entries.append((entry, ''))
+        elif isinstance(entry, dict):
+            entries.append((str(entry.get('email', '')), str(entry.get('name', ''))))
+        else:
+            raise ValueError(f'Invalid roster entry: {entry!r}')
+    return entries
+
+
+def _chunks(items):
+    for i in range(0, len(items), CHUNK_SIZE):
+        yield items[i:i + CHUNK_SIZE]
+
+
+def import_roster(space_id, entries, retries=3):
+    """Enrols the pupils in `entries` ((email, name) pairs) into the space and commits."""
+    result = RosterResult()
+    names = {}
+    for email, name in entries:
+        email = (email or '').strip().lower()
+        if not _EMAIL.match(email):
+            result.invalid.append(email)
+        elif email in names:
+            result.skipped += 1
+        else:
+            names[email] = (name or '').strip() or email.split('@')[0]
+    emails = list(names)
+
+    for attempt in range(retries):
+        try:
+            created = inserted = 0
+            for chunk in _chunks(emails):
+                known = set(db.session.scalars(select(func.lower(User.email))
+                                               .where(func.lower(User.email).in_(chunk))))
+                new_users = [{'google_id': ROSTER_GOOGLE_ID_PREFIX + email, 'name': names[email],
+                              'email': email, 'role': 'pupil'} for email in chunk if email not in known]
+                if new_users:
+                    db.session.execute(insert(User), new_users)
+                    created += len(new_users)
+                already_member = exists().where(SpaceMember.space_id == space_id, SpaceMember.user_id == User.id)
+                inserted += db.session.execute(
+                    insert(SpaceMember).from_select(
+                        ['space_id', 'user_id'],
+                        select(literal(space_id), User.id).where(func.lower(User.email).in_(chunk),
+                                                                 ~already_member))
+                ).rowcount
+            db.session.commit()
+            break
+        except IntegrityError:
+            # A concurrent import or sign-in created some of the same rows; start over
+            db.session.rollback()
+            if attempt == retries - 1:
+                raise
+    result.created_users = created
+    result.inserted = inserted
+    result.skipped += len(emails) - inserted
+    return result
+
+
+def claim_roster_user(google_id, email, name, role):
+    """The imported placeholder user for `email`, now bound to its Google account, or None.
+
+    Only call this for an address the identity provider has verified. `role` is
+    the one a new account with this address would get, so a master listed in a
+    roster is not left a pupil.
+    """
+    user = User.query.filter_by(google_id=ROSTER_GOOGLE_ID_PREFIX + email.lower()).first()
+    if user is None:
+        return None
+    user.google_id = google_id
+    user.name = name or user.name
+    user.role = role
+    db.session.commit()
+    return user
@@ -0,0 +1,52 @@
+"""The long-lived objects of one app instance.
+
+create_app() builds them once and stores them on the app; views, CLI commands
+and worker threads reach them through get_services() instead of module
+globals, so several apps (tests, benchmarks) can coexist in one process and
+nothing is built at import time.
+"""
+import threading
+from dataclasses import dataclass, field
+
+from flask import current_app
+
+from grading import GradingWorkerPool
+from llm_cache import ResultCache
+from mailer import OutboxSender
+from model_routing import ModelRouter
+from oidc import OIDCProvider
+from storage import BlobStore
+
+EXTENSION_KEY = 'synapseai'
+
+
+@dataclass
+class Services:
+    blob_store: BlobStore
+    llm_cache: ResultCache
+    model_router: ModelRouter
+    llm_options: dict  # keyword arguments for the app's GeminiService
+    grading_pool: GradingWorkerPool
+    mail_sender: OutboxSender
+    google_oidc: OIDCProvider
+    gemini_api_key: str = None
+    _gemini: object = field(default=None, init=False, repr=False)
+    _gemini_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def gemini(self):
+        """The app's GeminiService, created on first use so that booting never imports the Gemini SDK."""
+        if self._gemini is None:
+            with self._gemini_lock:
+                if self._gemini is None:
+                    from llm_service import GeminiService
+                    self._gemini = GeminiService(api_key=self.gemini_api_key, **self.llm_options)
+        return self._gemini
+
+    def invalidate_solution(self, file_path):
+        """Drops the cached upload of a replaced solution file, if the service has been created."""
+        if self._gemini is not None:
+            self._gemini.solution_cache.invalidate(file_path)
+
+
+def get_services(app=None) -> Services:
+    return (app or current_app).extensions[EXTENSION_KEY]
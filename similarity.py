@@ -0,0 +1,194 @@
+"""Near-duplicate detection between submissions of the same assignment.
+
+Each submission is reduced to a MinHash signature: over word shingles of its
+extracted text, or for Python files over token shingles of the source after
+its AST has been normalised (identifiers replaced by a placeholder, strings
+and docstrings blanked), so renaming variables or reformatting does not hide a
+copy. Shingles that also occur in the assignment's solution are removed
+first: a short standard exercise leaves little room for variation, and
+independent answers that only share what the solution shows are not copies.
+Signatures are split into LSH bands stored in the database; a new
+submission only has to look up its own bands to find candidate matches, and
+only the TOP_K closest candidates above the threshold become SimilarityFlag
+rows for the LLM to explain, so a class yields O(n) flags rather than O(n²).
+"""
+import ast
+import builtins
+import hashlib
+import json
+import random
+import re
+from functools import lru_cache
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, LSHBucket, SimilarityFlag, Submission, SubmissionFingerprint
+from extraction import extracted_text
+
+NUM_PERM = 128
+BANDS = 32  # 4 rows per band: pairs around 0.45 Jaccard and above almost always share a band
+ROWS = NUM_PERM // BANDS
+TEXT_SHINGLE = 5
+CODE_SHINGLE = 8
+# Flags kept per newly indexed submission, highest scores first
+TOP_K = 3
+# Submissions with fewer shingles of their own (after removing the solution's) are not compared
+MIN_SHINGLES = 10
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240521)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_BUILTINS = set(dir(builtins))
+
+
+class _Normalizer(ast.NodeTransformer):
+    # Every user-defined name becomes the same placeholder; numbering names by first use would
+    # let one inserted variable shift every later name and hide the copy
+    def _rename(self, name):
+        return name if name in _BUILTINS else 'v'
+
+    def visit_Name(self, node):
+        node.id = self._rename(node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.arg = self._rename(node.arg)
+        node.annotation = None
+        return node
+
+    def _visit_def(self, node):
+        node.name = self._rename(node.name)
+        body = node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(getattr(body[0], 'value', None), ast.Constant) \
+                and isinstance(body[0].value.value, str):
+            node.body = body[1:] or [ast.Pass()]
+        self.generic_visit(node)
+        return node
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_def
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, str):
+            node.value = 'S'
+        return node
+
+
+def code_tokens(source):
+    """Tokens of Python source after AST normalisation, or None if it does not parse."""
+    try:
+        tree = _Normalizer().visit(ast.parse(source))
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+    return re.findall(r'\w+|[^\w\s]', ast.unparse(tree))
+
+
+def text_tokens(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def shingles(tokens, k):
+    if len(tokens) <= k:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + k]) for i in range(len(tokens) - k + 1)}
+
+
+def fingerprint(file_path):
+    """Returns (method, shingles) for a stored file; shingles are empty if it has no usable text."""
+    text = extracted_text(file_path)
+    if file_path.lower().endswith('.py'):
+        tokens = code_tokens(text)
+        if tokens is not None:
+            return 'ast', shingles(tokens, CODE_SHINGLE)
+    return 'text', shingles(text_tokens(text), TEXT_SHINGLE)
+
+
+@lru_cache(maxsize=64)
+def solution_fingerprint(file_path):
+    """fingerprint() of an assignment's solution; stored paths carry their digest, so caching by path is safe."""
+    method, shingle_set = fingerprint(file_path)
+    return method, frozenset(shingle_set)
+
+
+def minhash(shingle_set):
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingle_set]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def estimated_similarity(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def band_keys(method, signature):
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(repr(rows).encode('ascii'), digest_size=12).hexdigest()
+        keys.append(f'{method}:{band}:{digest}')
+    return keys
+
+
+def index_submission(submission, threshold=0.6, top_k=TOP_K):
+    """Adds a submission to its assignment's index and flags its closest near-duplicates.
+
+    The submission's own bands are committed before looking for candidates, so
+    of two submissions indexed at the same time at least the later lookup sees
+    the other. Idempotent: an already indexed submission returns no new flags.
+    Returns the SimilarityFlag rows created (already committed).
+    """
+    if db.session.get(SubmissionFingerprint, submission.id) is not None:
+        return []
+    method, shingle_set = fingerprint(submission.file_path)
+    solution_path = submission.assignment.solution_file_path
+    if solution_path:
+        solution_method, solution_shingles = solution_fingerprint(solution_path)
+        if solution_method == method:
+            shingle_set -= solution_shingles
+    if len(shingle_set) < MIN_SHINGLES:
+        return []
+    signature = minhash(shingle_set)
+    keys = band_keys(method, signature)
+    db.session.add(SubmissionFingerprint(submission_id=submission.id, assignment_id=submission.assignment_id,
+                                         method=method, signature=json.dumps(signature)))
+    db.session.add_all(LSHBucket(assignment_id=submission.assignment_id, bucket=key, submission_id=submission.id)
+                       for key in keys)
+    db.session.commit()
+
+    candidate_ids = {row.submission_id for row in
+                     db.session.query(LSHBucket.submission_id)
+                     .filter(LSHBucket.assignment_id == submission.assignment_id, LSHBucket.bucket.in_(keys))
+                     .distinct()}
+    candidate_ids.discard(submission.id)
+    if not candidate_ids:
+        return []
+    candidates = (db.session.query(SubmissionFingerprint, Submission)
+                  .join(Submission, Submission.id == SubmissionFingerprint.submission_id)
+                  .filter(SubmissionFingerprint.submission_id.in_(candidate_ids)).all())
+    scored = []
+    for other_fp, other in candidates:
+        if other.pupil_id == submission.pupil_id or other_fp.method != method:
+            continue
+        if other.file_sha256 and other.file_sha256 == submission.file_sha256:
+            score = 1.0
+        else:
+            score = estimated_similarity(signature, json.loads(other_fp.signature))
+        if score >= threshold:
+            scored.append((score, other))
+    scored.sort(key=lambda pair: (-pair[0], pair[1].id))
+    flags = []
+    for score, other in scored:
+        if len(flags) >= top_k:
+            break
+        # Pairs are stored newer-first so both sides of a race produce the same row
+        newer, older = max(submission.id, other.id), min(submission.id, other.id)
+        if SimilarityFlag.query.filter_by(submission_id=newer, other_submission_id=older).first():
+            continue
+        flag = SimilarityFlag(assignment_id=submission.assignment_id, submission_id=newer,
+                              other_submission_id=older, score=score, method=method, status='pending')
+        try:
+            with db.session.begin_nested():
+                db.session.add(flag)
+        except IntegrityError:
+            continue
+        flags.append(flag)
+    db.session.commit()
+    return flags
@@ -0,0 +1,126 @@
+"""Content-addressed storage for uploaded files.
+
+Uploads are written to a temporary file inside the store while the multipart
+parser streams them in, and hashed in the same pass. Saving a file then only
+renames it to `blobs/<aa>/<sha256><ext>`, so identical uploads share one blob
+and every stored path carries its own digest.
+"""
+import hashlib
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+CHUNK_SIZE = 1024 * 1024
+_BLOB_NAME = re.compile(r'^([0-9a-f]{64})(\.[a-z0-9]+)?$')
+# Read once at import, while the process is still single-threaded; os.umask can only be read by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+# Temp files are created 0600; blobs must be readable by a front proxy serving them (X-Accel-Redirect)
+BLOB_MODE = 0o644 & ~_UMASK
+
+
+@dataclass
+class Blob:
+    sha256: str
+    size: int
+    path: str
+
+
+class HashingUploadFile:
+    """Writable temp file that hashes and counts bytes as they are written.
+
+    Used as the stream behind Werkzeug's FileStorage, so the upload body is
+    hashed while it is parsed and never copied a second time.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload-', delete=False)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.max_size = max_size
+        self.committed = False
+
+    @property
+    def name(self):
+        return self._file.name
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            # The parser drops the file when this propagates, so nothing else would close it
+            self.close()
+            raise RequestEntityTooLarge()
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        if not self.committed and os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+    def __getattr__(self, attr):
+        return getattr(self._file, attr)
+
+
+class BlobStore:
+    def __init__(self, root='uploads', max_size=None):
+        self.root = root
+        self.max_size = max_size
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(root, 'tmp')
+
+    def _ensure_dirs(self):
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def incoming_file(self):
+        """Returns a temp file for Werkzeug to stream an upload into."""
+        self._ensure_dirs()
+        return HashingUploadFile(self.tmp_dir, self.max_size)
+
+    def path_for(self, sha256, ext=''):
+        return os.path.join(self.blob_dir, sha256[:2], sha256 + ext)
+
+    def save(self, file_storage):
+        """Stores an uploaded FileStorage and returns its Blob.
+
+        Files parsed through `incoming_file` are already hashed and only need a
+        rename; anything else is copied in chunks and hashed on the way.
+        """
+        ext = os.path.splitext(file_storage.filename or '')[1].lower()
+        stream = file_storage.stream
+        if not isinstance(stream, HashingUploadFile):
+            stream.seek(0)
+            incoming = self.incoming_file()
+            try:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    incoming.write(chunk)
+            except Exception:
+                incoming.close()
+                raise
+            stream = incoming
+        stream.flush()
+        sha256 = stream.sha256.hexdigest()
+        path = self.path_for(sha256, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(stream.name, BLOB_MODE)
+            os.replace(stream.name, path)
+            stream.committed = True
+        stream.close()
+        return Blob(sha256=sha256, size=stream.size, path=path)
+
+    def relative_name(self, path):
+        """Name of a stored file relative to the upload root, as used in download URLs."""
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+
+def blob_digest(path):
+    """Returns the SHA-256 encoded in a blob path, or None for other paths."""
+    match = _BLOB_NAME.match(os.path.basename(path or ''))
+    if match and os.path.basename(os.path.dirname(path)) == match.group(1)[:2]:
+        return match.group(1)
+    return None